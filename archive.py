@@ -0,0 +1,184 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+from store import Snapshot
+
+logger = logging.getLogger(__name__)
+
+# Каталог архива: один файл на каждый день замен
+ARCHIVE_DIR = 'archive'
+
+# Сколько дней хранить историю (учебный год с запасом)
+RETENTION_DAYS = 400
+
+
+class ReplacementsArchive:
+    """Архив замен по дням.
+
+    Каждый день хранится в отдельном компактном файле archive/ГГГГ-ММ-ДД.json.
+    При старте читается только список файлов: отсортированный список дат
+    строится по именам. Снимок дня с индексами читается с диска при первом
+    обращении (или заранее в фоне, см. preload) и дальше остается в памяти,
+    поэтому выборка по диапазону дат, группе или преподавателю обходится
+    двоичным поиском и словарями.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, retention_days=RETENTION_DAYS, source=None):
+        self.directory = directory
+        self.source = source
+        self.retention_days = retention_days
+        self._dates = []
+        self._days = {}  # дата -> снимок или None, если день еще не прочитан
+        self._lock = threading.Lock()
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{day}.json")
+
+    def load(self):
+        """Находит сохраненные дни; сами снимки читаются при первом обращении"""
+        if not os.path.isdir(self.directory):
+            return self
+        dates = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.json'):
+                continue
+            day = filename[:-len('.json')]
+            try:
+                date.fromisoformat(day)
+            except ValueError:
+                logger.error(f"Лишний файл в архиве: {filename}")
+                continue
+            dates.append(day)
+        with self._lock:
+            for day in dates:
+                if day not in self._days:
+                    bisect.insort(self._dates, day)
+                    self._days[day] = None
+        logger.info(f"Найдено дней в архиве: {len(self._dates)}")
+        return self
+
+    def preload(self):
+        """Читает все дни в фоновом потоке, чтобы первые выборки не ждали диска"""
+        thread = threading.Thread(target=self._preload, name='archive-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def _preload(self):
+        # С новых дней: их спрашивают чаще
+        for day in reversed(list(self._dates)):
+            self.get(day)
+        logger.info(f"Архив прочитан в память: {len(self._dates)} дн.")
+
+    def _read(self, day):
+        """Читает снимок дня с диска; день с испорченным файлом убирается из архива"""
+        try:
+            with open(self._path(day), 'r', encoding='utf-8') as f:
+                snapshot = Snapshot(json.load(f), version=0, source=self.source)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении архива за {day}: {e}")
+            with self._lock:
+                if day in self._days and self._days[day] is None:
+                    del self._days[day]
+                    self._dates.remove(day)
+            return None
+        with self._lock:
+            if day not in self._days:
+                return None
+            # Пока файл читался, день мог обновиться или прочитаться в другом потоке
+            if self._days[day] is None:
+                self._days[day] = snapshot
+            return self._days[day]
+
+    def _put(self, snapshot):
+        with self._lock:
+            if snapshot.date not in self._days:
+                bisect.insort(self._dates, snapshot.date)
+            self._days[snapshot.date] = snapshot
+
+    def on_swap(self, snapshot):
+        """Сохраняет новый снимок в архив; одинаковые дни не перезаписываются"""
+        day = snapshot.date
+        if not day:
+            return False
+        existing = self.get(day)
+        if existing is not None and existing.digest == snapshot.digest:
+            return False
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Свое имя временного файла: каталог архива могут делить несколько узлов
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{day}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_path, self._path(day))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении архива за {day}: {e}")
+            return False
+
+        self._put(snapshot)
+        self._apply_retention()
+        logger.info(f"Замены за {day} сохранены в архив")
+        return True
+
+    def _apply_retention(self):
+        """Удаляет дни старше срока хранения"""
+        if not self._dates:
+            return
+        newest = date.fromisoformat(self._dates[-1])
+        cutoff = (newest - timedelta(days=self.retention_days)).isoformat()
+        with self._lock:
+            expired = self._dates[:bisect.bisect_left(self._dates, cutoff)]
+            if not expired:
+                return
+            del self._dates[:len(expired)]
+            for day in expired:
+                self._days.pop(day, None)
+        for day in expired:
+            try:
+                os.remove(self._path(day))
+            except OSError as e:
+                logger.error(f"Ошибка при удалении архива за {day}: {e}")
+        logger.info(f"Из архива удалено дней: {len(expired)}")
+
+    def dates(self, start=None, end=None):
+        """Даты в диапазоне [start, end] в формате ГГГГ-ММ-ДД"""
+        dates = self._dates
+        lo = bisect.bisect_left(dates, start) if start else 0
+        hi = bisect.bisect_right(dates, end) if end else len(dates)
+        return dates[lo:hi]
+
+    def get(self, day):
+        """Снимок за день или None; день читается с диска при первом обращении"""
+        snapshot = self._days.get(day)
+        if snapshot is None and day in self._days:
+            snapshot = self._read(day)
+        return snapshot
+
+    def query(self, start=None, end=None, group=None, teacher=None):
+        """Замены по дням в диапазоне дат для группы или преподавателя.
+
+        Возвращает список (дата, пары) только для дней, где что-то нашлось.
+        """
+        result = []
+        for day in self.dates(start, end):
+            snapshot = self.get(day)
+            if snapshot is None:
+                continue
+            index = snapshot.index
+            if group is not None:
+                pairs = index.group_pairs.get(group)
+            elif teacher is not None:
+                pairs = index.teacher_pairs.get(teacher)
+            else:
+                pairs = None
+            if pairs:
+                result.append((day, pairs))
+        return result
@@ -0,0 +1,91 @@
+"""Замер старта архива и выборок по диапазону дат.
+
+Запуск: python benchmarks/bench_archive.py [дней] [групп]
+
+Сравнивает старый старт (снимок с индексами строится для каждого дня
+архива до начала работы) с ленивым, когда при старте читается только
+список файлов. Для ленивого архива отдельно показаны первая выборка
+преподавателя за месяц и за весь архив (дни читаются с диска) и те же
+выборки повторно, когда дни уже в памяти.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from archive import ReplacementsArchive
+from store import Snapshot
+from synthetic import make_schedule
+
+
+def write_archive(directory, days, groups):
+    """Архив из days дней подряд по groups групп; возвращает последний снимок"""
+    archive = ReplacementsArchive(directory, retention_days=days)
+    start = date(2024, 9, 2)
+    for offset in range(days):
+        data = make_schedule(groups, max(groups // 2, 5), day=start + timedelta(days=offset), seed=offset)
+        snapshot = Snapshot(data, version=0)
+        archive.on_swap(snapshot)
+    return snapshot
+
+
+def timed_ms(func):
+    started = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def eager_load(directory):
+    """Старый путь: снимок каждого дня строится при старте"""
+    archive = ReplacementsArchive(directory).load()
+    for day in archive.dates():
+        archive.get(day)
+    return archive
+
+
+def measure_archive(days, groups):
+    """Время старта и выборок преподавателя для архива из days дней"""
+    with tempfile.TemporaryDirectory() as directory:
+        last = write_archive(directory, days, groups)
+        teacher = last.index.teachers[0]
+        end = date.fromisoformat(last.date)
+        month = ((end - timedelta(days=29)).isoformat(), end.isoformat())
+
+        eager_ms, _ = timed_ms(lambda: eager_load(directory))
+        load_ms, archive = timed_ms(lambda: ReplacementsArchive(directory).load())
+        month_first_ms, _ = timed_ms(lambda: archive.query(*month, teacher=teacher))
+        month_ms, _ = timed_ms(lambda: archive.query(*month, teacher=teacher))
+        all_first_ms, _ = timed_ms(lambda: archive.query(teacher=teacher))
+        all_ms, _ = timed_ms(lambda: archive.query(teacher=teacher))
+    return {
+        'eager_load_ms': round(eager_ms, 1),
+        'load_ms': round(load_ms, 2),
+        'month_first_ms': round(month_first_ms, 1),
+        'month_ms': round(month_ms, 3),
+        'all_first_ms': round(all_first_ms, 1),
+        'all_ms': round(all_ms, 3),
+    }
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    groups = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+    logging.disable(logging.INFO)
+
+    result = measure_archive(days, groups)
+    print(f"Архив: {days} дн. по {groups} групп")
+    print(f"{'старт со снимками всех дней, мс':<40} {result['eager_load_ms']:>10}")
+    print(f"{'старт по списку файлов, мс':<40} {result['load_ms']:>10}")
+    print(f"{'месяц, первая выборка, мс':<40} {result['month_first_ms']:>10}")
+    print(f"{'месяц, повторно, мс':<40} {result['month_ms']:>10}")
+    print(f"{'весь архив, первая выборка, мс':<40} {result['all_first_ms']:>10}")
+    print(f"{'весь архив, повторно, мс':<40} {result['all_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Всплеск нажатий сразу после рассылки.
+
+Запуск: python benchmarks/bench_burst.py [число пользователей] [повторов]
+
+N пользователей в течение секунды нажимают "Замена по группам" и кнопку
+группы, часть из них нажимает кнопку дважды. Сравниваются число вызовов
+Bot API и задержки без защиты от повторов, с настройками бота по умолчанию
+и с соседними значениями окна и лимита: время до answerCallbackQuery (когда
+у пользователя пропадают часики) и время до конца обработки нажатия.
+Колонка "потеряно" - сколько первых нажатий защита отбросила по ошибке.
+Задержки - медиана по повторам.
+"""
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import telebot
+
+from bench_lookups import make_data
+from bench_runtime import percentile
+from fake_bot_api import FakeBotApi
+from runtime import HandlerPool
+from throttle import Debouncer, ChatRateLimiter
+
+API_LATENCY = 0.05
+DOUBLE_TAP_SHARE = 0.3
+
+
+def make_burst(users, token, groups, seed=1):
+    """(время поступления, обновление) для всплеска нажатий"""
+    rnd = random.Random(seed)
+    events = []
+    update_id = 0
+    for chat_id in range(1, users + 1):
+        user = {'id': chat_id, 'is_bot': False, 'first_name': 'user'}
+        message = {'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'from': user}
+        started = rnd.random()
+        taps = 2 if rnd.random() < DOUBLE_TAP_SHARE else 1
+
+        for tap in range(taps):
+            update_id += 1
+            events.append((started + tap * 0.15, {'update_id': update_id, 'message': {
+                **message, 'message_id': update_id, 'text': "Замена по группам"}}))
+        data = f"g:{rnd.randrange(len(groups))}:{token}"
+        for tap in range(taps):
+            update_id += 1
+            events.append((started + 0.5 + tap * 0.15, {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'from': user, 'chat_instance': '1', 'data': data,
+                'message': {**message, 'message_id': update_id, 'text': "Выберите группу:"}}}))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def run_burst(app, api, events, window, rate, burst):
+    app.debouncer = Debouncer(window=window)
+    app.chat_limiter = ChatRateLimiter(rate=rate, burst=burst)
+
+    arrived, done = {}, {}
+
+    def process(batch):
+        app.bot.process_new_updates(batch)
+        for update in batch:
+            done[update.update_id] = time.perf_counter()
+
+    api.reset()
+    pool = HandlerPool(process, workers=32, queue_size=len(events))
+    pool.start()
+    started = time.perf_counter()
+    for offset, update in events:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrived[update['update_id']] = time.perf_counter()
+        pool.submit(telebot.types.Update.de_json(update))
+    pool.drain(timeout=600)
+
+    callbacks = {update['update_id'] for _, update in events if 'callback_query' in update}
+    answered = [(at - arrived[int(params['callback_query_id'])]) * 1000
+                for at, method, params in api.calls if method == 'answerCallbackQuery']
+    finished = [(done[update_id] - arrived[update_id]) * 1000 for update_id in callbacks]
+    counts = api.counts()
+    return {
+        'calls': sum(counts.values()),
+        'send': counts.get('sendMessage', 0),
+        'answer_p50': percentile(answered, 0.5),
+        'answer_p99': percentile(answered, 0.99),
+        'done_p50': percentile(finished, 0.5),
+        'done_p99': percentile(finished, 0.99),
+    }
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    os.chdir(tempfile.mkdtemp(prefix='bench_burst_'))
+    with open('bot_token.txt', 'w') as f:
+        f.write('123456:bench')
+    logging.disable(logging.WARNING)
+
+    api = FakeBotApi(latency=API_LATENCY).start()
+    telebot.apihelper.API_URL = api.api_url
+
+    import bot as app
+    app.store.swap(make_data(100, 60))
+    app.user_store.open()
+    snapshot = app.read_replacements()
+    app.render_cache.get(snapshot)
+    events = make_burst(users, snapshot.token, snapshot.index.groups)
+
+    # Каждый пользователь хочет одно сообщение и один ответ на кнопку
+    wanted = 2 * users
+    variants = (
+        # Окно 0 и бесконечный лимит - все нажатия обрабатываются как раньше
+        ("без защиты", 0, 1e9, 1e9),
+        ("по умолчанию", app.DEBOUNCE_WINDOW, app.CHAT_RATE, app.CHAT_BURST),
+        ("окно 1 с", 1.0, app.CHAT_RATE, app.CHAT_BURST),
+        ("окно 3 с", 3.0, app.CHAT_RATE, app.CHAT_BURST),
+        ("burst 2", app.DEBOUNCE_WINDOW, app.CHAT_RATE, 2),
+    )
+
+    print(f"пользователей: {users}, нажатий: {len(events)}, повторных нажатий: {DOUBLE_TAP_SHARE:.0%}, "
+          f"повторов: {repeats}")
+    print(f"{'':>13} {'вызовов':>8} {'sendMessage':>12} {'потеряно':>9} {'ответ p50':>10} {'ответ p99':>10} "
+          f"{'готово p50':>11} {'готово p99':>11}")
+    for title, window, rate, burst in variants:
+        runs = [run_burst(app, api, events, window, rate, burst) for _ in range(repeats)]
+        result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        lost = max(wanted - result['send'], 0)
+        print(f"{title:>13} {result['calls']:>8.0f} {result['send']:>12.0f} {lost:>9.0f} "
+              f"{result['answer_p50']:>10.0f} {result['answer_p99']:>10.0f} "
+              f"{result['done_p50']:>11.0f} {result['done_p99']:>11.0f}")
+
+    app.user_store.close()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Замер стоимости поиска замен по группе и преподавателю.
+
+Запуск: python benchmarks/bench_lookups.py
+
+Сравнивает старый путь обработчиков (полный проход по data['groups'] и
+group_replacements_by_pairs на каждый запрос) с поиском по SnapshotIndex.
+Время поиска по индексу не должно расти вместе с числом групп.
+"""
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexes import SnapshotIndex, group_replacements_by_pairs
+from models import Replacement
+
+
+def make_data(groups_count, teachers_count, rows_per_group=6, seed=1):
+    """Синтетический снимок в формате replacements.json"""
+    rnd = random.Random(seed)
+    teachers = [f"Преподаватель{i} А.Б." for i in range(teachers_count)]
+    groups = {}
+    for g in range(groups_count):
+        rows = []
+        for lesson in rnd.sample(range(1, 11), rows_per_group):
+            rows.append({
+                "pair": str(lesson),
+                "original_subject": "Химия",
+                "teacher": rnd.choice(teachers),
+                "new_subject": "Индивидуальный проект",
+                "classroom": rnd.choice(["ДО", "108", "206", ""])
+            })
+        groups[str(100 + g)] = rows
+    return {"date": "2024-12-21", "raw_date": "Замены суббота 21.12.24", "groups": groups}
+
+
+def as_records(data):
+    groups = {g: [Replacement.from_dict(row) for row in rows] for g, rows in data['groups'].items()}
+    return {**data, 'groups': groups}
+
+
+def scan_teacher(data, teacher_name):
+    """Старый путь из callback_handler"""
+    teacher_replacements = []
+    for group_number, replacements in data['groups'].items():
+        for replacement in replacements:
+            if replacement.teacher == teacher_name:
+                teacher_replacements.append(replacement.with_group(group_number))
+    return group_replacements_by_pairs(teacher_replacements)
+
+
+def scan_group(data, group_number):
+    return group_replacements_by_pairs(data['groups'][group_number])
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'групп':>6} {'препод.':>8} {'индекс, мс':>11} "
+          f"{'скан гр., мкс':>14} {'индекс гр., мкс':>16} "
+          f"{'скан пр., мкс':>14} {'индекс пр., мкс':>16}")
+    for groups_count in (10, 100, 1000, 5000):
+        teachers_count = max(groups_count // 2, 5)
+        data = as_records(make_data(groups_count, teachers_count))
+
+        started = time.perf_counter()
+        index = SnapshotIndex(data)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        group = index.groups[len(index.groups) // 2]
+        teacher = index.teachers[len(index.teachers) // 2]
+        number = 2000 if groups_count <= 100 else 50
+
+        print(f"{groups_count:>6} {teachers_count:>8} {build_ms:>11.2f} "
+              f"{per_call_us(lambda: scan_group(data, group), number):>14.2f} "
+              f"{per_call_us(lambda: index.group_pairs[group], 100000):>16.3f} "
+              f"{per_call_us(lambda: scan_teacher(data, teacher), number):>14.2f} "
+              f"{per_call_us(lambda: index.teacher_pairs[teacher], 100000):>16.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Память и скорость: строки-словари против записей Replacement.
+
+Запуск: python benchmarks/bench_models.py [число групп]
+
+Сравнивает старое представление (словари строк, int() на каждом вызове)
+с Replacement на синтетическом снимке из 1000 групп: сколько памяти
+занимают строки и сколько стоит отрисовать ответы по всем группам.
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_lookups import make_data
+from indexes import group_replacements_by_pairs
+from models import Replacement
+from render import format_replacement
+
+
+def legacy_format(replacement):
+    """format_replacement до перехода на Replacement"""
+    lesson_num = int(replacement['pair']) if replacement['pair'].isdigit() else 0
+    pair_num = (lesson_num + 1) // 2 if lesson_num > 0 else lesson_num
+    message = f"🕐 Пара: {pair_num}\n"
+    if replacement['teacher'] == "Отмена пары":
+        message += "❌ Статус: Пара отменена\n"
+    elif replacement['teacher'] == "Перенос пары":
+        message += "🔄 Статус: Пара перенесена\n"
+    else:
+        if replacement['new_subject']:
+            message += f"📗 Предмет: {replacement['new_subject']}\n"
+        if replacement['teacher']:
+            message += f"👨‍🏫 Преподаватель: {replacement['teacher']}\n"
+    if replacement['classroom']:
+        if replacement['classroom'].upper() == 'ДО':
+            message += "🏠 Форма обучения: Дистанционно\n"
+        else:
+            message += f"🏛 Аудитория: {replacement['classroom']}\n"
+    return message
+
+
+def legacy_pairs(replacements):
+    """group_replacements_by_pairs до перехода на Replacement"""
+    rows = sorted(replacements, key=lambda x: int(x['pair']) if x['pair'].isdigit() else float('inf'))
+    pairs = {}
+    for i in range(0, len(rows), 2):
+        current = rows[i]
+        following = rows[i + 1] if i + 1 < len(rows) else None
+        if (following and current['pair'].isdigit() and following['pair'].isdigit() and
+                int(following['pair']) == int(current['pair']) + 1 and int(current['pair']) % 2 == 1):
+            pairs[(int(current['pair']) + 1) // 2] = current
+        elif current['pair'].isdigit():
+            pairs[(int(current['pair']) + 1) // 2] = current
+    return pairs
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+
+def render_all(groups, pairs_of, format_row):
+    started = time.perf_counter()
+    for rows in groups.values():
+        pairs = pairs_of(rows)
+        "".join(format_row(pairs[n]) + "\n" for n in sorted(pairs))
+    return time.perf_counter() - started
+
+
+def main():
+    groups_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # Сериализуем и читаем обратно, чтобы строки не были общими, как после json.load
+    payload = json.dumps(make_data(groups_count, groups_count // 2, rows_per_group=8), ensure_ascii=False)
+
+    dicts, dict_bytes = measure_memory(lambda: json.loads(payload)['groups'])
+    records, record_bytes = measure_memory(lambda: {
+        group: [Replacement.from_dict(row) for row in rows]
+        for group, rows in json.loads(payload)['groups'].items()
+    })
+    rows_count = sum(len(rows) for rows in dicts.values())
+
+    started = time.perf_counter()
+    for _ in range(5):
+        {group: [Replacement.from_dict(row) for row in rows] for group, rows in dicts.items()}
+    convert_ms = (time.perf_counter() - started) / 5 * 1000
+
+    dict_render = min(render_all(dicts, legacy_pairs, legacy_format) for _ in range(5))
+    record_render = min(render_all(records, group_replacements_by_pairs, format_replacement) for _ in range(5))
+
+    print(f"групп: {groups_count}, строк: {rows_count}")
+    print(f"память, словари:    {dict_bytes / 1024:9.1f} КБ ({dict_bytes / rows_count:.0f} Б/строка)")
+    print(f"память, Replacement: {record_bytes / 1024:8.1f} КБ ({record_bytes / rows_count:.0f} Б/строка)")
+    print(f"разбор в Replacement: {convert_ms:.2f} мс")
+    print(f"отрисовка всех групп, словари:    {dict_render * 1000:.2f} мс")
+    print(f"отрисовка всех групп, Replacement: {record_render * 1000:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
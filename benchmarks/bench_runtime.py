@@ -0,0 +1,148 @@
+"""Нагрузочный замер обработки обновлений.
+
+Запуск: python benchmarks/bench_runtime.py [число обновлений] [обновлений в секунду]
+
+Проигрывает тысячи обновлений (кнопки меню, кнопки групп, поиск текстом)
+через настоящие обработчики bot.py. Вызовы Bot API уходят в FakeBotApi с
+задержкой 50 мс, как у настоящего Telegram. Задержка обработчика - время
+от поступления обновления до конца его обработки, печатаются p50 и p99.
+Один поток соответствует старому последовательному разбору обновлений.
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import logging
+import telebot
+
+from bench_lookups import make_data
+from fake_bot_api import FakeBotApi
+from runtime import HandlerPool, WebhookServer
+
+API_LATENCY = 0.05
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def make_updates(count, chats, token, groups, seed=1):
+    """Записанные обновления в формате Bot API"""
+    rnd = random.Random(seed)
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = rnd.randrange(chats) + 1
+        user = {'id': chat_id, 'is_bot': False, 'first_name': 'user'}
+        chat = {'id': chat_id, 'type': 'private'}
+        message = {'message_id': update_id, 'date': 0, 'chat': chat, 'from': user}
+        kind = rnd.random()
+        if kind < 0.4:
+            updates.append({'update_id': update_id, 'message': {**message, 'text': "Замена по группам"}})
+        elif kind < 0.8:
+            position = rnd.randrange(len(groups))
+            updates.append({'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'from': user, 'chat_instance': '1',
+                'message': {**message, 'text': "Выберите группу:"}, 'data': f"g:{position}:{token}",
+            }})
+        else:
+            query = groups[rnd.randrange(len(groups))][:2]
+            updates.append({'update_id': update_id, 'message': {**message, 'text': query}})
+    return updates
+
+
+def replay(submit, updates, rate, arrived):
+    """Подает обновления с заданной частотой"""
+    started = time.perf_counter()
+    for number, update in enumerate(updates):
+        delay = started + number / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrived[update['update_id']] = time.perf_counter()
+        submit(update)
+
+
+def run_scenario(bot, updates, rate, workers, webhook=False):
+    arrived, done = {}, {}
+
+    def process(batch):
+        bot.process_new_updates(batch)
+        for update in batch:
+            done[update.update_id] = time.perf_counter()
+
+    pool = HandlerPool(process, workers=workers, queue_size=len(updates))
+    pool.start()
+    started = time.perf_counter()
+    if webhook:
+        server = WebhookServer(pool, host='127.0.0.1', port=0, path='/webhook')
+        server.start()
+        url = f"http://127.0.0.1:{server.address[1]}/webhook"
+
+        def submit(update):
+            request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST')
+            urllib.request.urlopen(request).close()
+
+        replay(submit, updates, rate, arrived)
+    else:
+        replay(lambda update: pool.submit(telebot.types.Update.de_json(update)), updates, rate, arrived)
+    pool.drain(timeout=600)
+    elapsed = time.perf_counter() - started
+    if webhook:
+        server.stop()
+
+    latencies = [(done[update_id] - arrived[update_id]) * 1000 for update_id in done]
+    return {
+        'workers': workers,
+        'webhook': webhook,
+        'updates': len(latencies),
+        'errors': pool.stats['errors'],
+        'seconds': round(elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5), 1),
+        'p99_ms': round(percentile(latencies, 0.99), 1),
+        'mean_ms': round(statistics.mean(latencies), 1),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    workdir = tempfile.mkdtemp(prefix='bench_runtime_')
+    os.chdir(workdir)
+    with open('bot_token.txt', 'w') as f:
+        f.write('123456:bench')
+    logging.disable(logging.WARNING)
+
+    api = FakeBotApi(latency=API_LATENCY).start()
+    telebot.apihelper.API_URL = api.api_url
+
+    import bot as app
+    app.store.swap(make_data(100, 60))
+    app.user_store.open()
+    snapshot = app.read_replacements()
+    app.render_cache.get(snapshot)
+    updates = make_updates(count, chats=500, token=snapshot.token, groups=snapshot.index.groups)
+
+    print(f"обновлений: {count}, поступает {rate:.0f}/с, ответ Bot API {API_LATENCY * 1000:.0f} мс")
+    print(f"{'режим':>16} {'время, с':>9} {'p50, мс':>10} {'p99, мс':>10} {'ошибок':>7}")
+    for workers, webhook in ((1, False), (2, False), (8, False), (32, False), (32, True)):
+        api.reset()
+        result = run_scenario(app.bot, updates, rate, workers, webhook)
+        mode = f"{'webhook' if webhook else 'пул'}, {workers} п."
+        print(f"{mode:>16} {result['seconds']:>9.2f} {result['p50_ms']:>10.1f} "
+              f"{result['p99_ms']:>10.1f} {result['errors']:>7}")
+
+    app.user_store.close()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
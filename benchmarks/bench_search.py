@@ -0,0 +1,63 @@
+"""Замер поиска групп и преподавателей по тексту.
+
+Запуск: python benchmarks/bench_search.py
+
+Сравнивает линейный проход по всем названиям с SearchIndex без кэша
+запросов. Inline-режиму нужен ответ за десятки миллисекунд при любом
+размере снимка.
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_lookups import make_data, as_records
+from indexes import SnapshotIndex
+from search import SearchIndex, QueryCache, normalize
+
+# Типичные запросы: номер группы, начало фамилии, часть фамилии
+QUERIES = ("142", "Преподаватель123", "ватель4321")
+# Широкий запрос, под который попадает почти все
+BROAD = "1"
+
+
+def scan(index, query):
+    """Линейный проход: подстрока в каждом названии"""
+    query = normalize(query)
+    return [name for name in index.groups + index.teachers if query in normalize(name)][:10]
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'групп':>6} {'препод.':>8} {'индекс, мс':>11} {'скан, мкс':>11} {'поиск, мкс':>11} "
+          f"{'скан «1», мкс':>15} {'поиск «1», мкс':>16}")
+    for groups_count in (100, 1000, 5000, 20000):
+        teachers_count = max(groups_count // 2, 5)
+        index = SnapshotIndex(as_records(make_data(groups_count, teachers_count)))
+
+        started = time.perf_counter()
+        search = SearchIndex(index)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        def uncached(queries):
+            # Каждый раз новый кэш, чтобы мерить сам поиск
+            search._cache = QueryCache()
+            for query in queries:
+                search.search(query)
+
+        number = 20 if groups_count >= 5000 else 200
+        scan_us = per_call_us(lambda: [scan(index, query) for query in QUERIES], number) / len(QUERIES)
+        search_us = per_call_us(lambda: uncached(QUERIES), number) / len(QUERIES)
+        broad_scan_us = per_call_us(lambda: scan(index, BROAD), number)
+        broad_search_us = per_call_us(lambda: uncached((BROAD,)), number)
+        print(f"{groups_count:>6} {teachers_count:>8} {build_ms:>11.2f} {scan_us:>11.1f} {search_us:>11.1f} "
+              f"{broad_scan_us:>15.1f} {broad_search_us:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
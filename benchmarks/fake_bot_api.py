@@ -0,0 +1,143 @@
+"""Поддельный Bot API для нагрузочных замеров.
+
+Отвечает на любые методы как Telegram, с заданной задержкой, и запоминает
+вызовы. С rate_limit_share отвечает на такую долю отправок ошибкой 429
+с retry_after, как Telegram при превышении лимитов. Через pages тот же
+сервер отдает HTML-страницы, например страницу замен для parser.FETCH_URL.
+
+Чтобы telebot ходил сюда, а не в api.telegram.org:
+
+    api = FakeBotApi(latency=0.05)
+    api.start()
+    telebot.apihelper.API_URL = api.api_url
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, rate_limit_share=0.0, retry_after=1, pages=None,
+                 host='127.0.0.1', port=0, seed=1):
+        self.latency = latency
+        self.pages = pages or {}  # путь -> HTML
+        self.rate_limit_share = rate_limit_share
+        self.retry_after = retry_after
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self.calls = []  # (время, метод, параметры)
+        self._lock = threading.Lock()
+        self._message_id = 1000
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        # Под нагрузкой клиенты открывают много соединений сразу
+        self._server.request_queue_size = 1024
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        """Шаблон для telebot.apihelper.API_URL"""
+        return self.url + "/bot{0}/{1}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls = []
+            self.rate_limited = 0
+
+    def counts(self):
+        """Число вызовов по методам"""
+        result = {}
+        with self._lock:
+            for _, method, _ in self.calls:
+                result[method] = result.get(method, 0) + 1
+        return result
+
+    def respond(self, method, params):
+        """Результат метода; переопределяется в наследниках"""
+        if method == 'sendMessage' and self.rate_limit_share:
+            with self._lock:
+                limited = self._random.random() < self.rate_limit_share
+                self.rate_limited += limited
+            if limited:
+                return (429, f"Too Many Requests: retry after {self.retry_after}",
+                        {'retry_after': self.retry_after})
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        if method == 'getUpdates':
+            return []
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _page(self, text):
+                body = text.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                parts = urlsplit(self.path)
+                if parts.path in api.pages:
+                    return self._page(api.pages[parts.path])
+                method = parts.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(parts.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    params.update(parse_qsl(self.rfile.read(length).decode('utf-8')))
+                with api._lock:
+                    api.calls.append((time.perf_counter(), method, params))
+                if api.latency:
+                    time.sleep(api.latency)
+
+                status, payload = 200, {'ok': True, 'result': api.respond(method, params)}
+                if isinstance(payload['result'], tuple):
+                    # (код, описание, параметры) - ответ с ошибкой
+                    code, description, parameters = payload['result']
+                    status = code
+                    payload = {'ok': False, 'error_code': code, 'description': description}
+                    if parameters:
+                        payload['parameters'] = parameters
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
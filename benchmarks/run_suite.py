@@ -0,0 +1,338 @@
+"""Набор повторяемых замеров с сохранением результатов в JSON.
+
+Запуск: python benchmarks/run_suite.py [--groups 100 1000] [--chats 10000 100000]
+        [--only parse ingest lookups archive broadcast startup] [--compare old.json]
+
+Данные строит synthetic.py, вызовы Bot API уходят в FakeBotApi. Сценарии:
+  parse     - разбор страницы fetch-rep в replacements.json;
+  ingest    - прием новых замен: сохранение, индексы и отрисовка ответов;
+  lookups   - то, что делают обработчики на каждое нажатие;
+  archive   - старт архива замен и выборки преподавателя за месяц и за весь архив;
+  broadcast - рассылка через Broadcaster и telebot с ответами 429;
+  startup   - запуск bot.py в отдельном процессе до готовности.
+Результаты пишутся в benchmarks/results/<время>.json. С --compare печатается
+изменение каждой величины относительно прошлого прогона, рост времени
+больше --threshold процентов помечается как регресс.
+"""
+import argparse
+import ast
+import json
+import logging
+import os
+import platform
+import queue
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import telebot
+
+import parser
+from bench_archive import measure_archive
+from broadcast import Broadcaster
+from fake_bot_api import FakeBotApi
+from render import RenderCache
+from store import ReplacementsStore
+from synthetic import make_schedule, next_day, render_html, write_json
+from table_parser import parse_replacements_html
+
+SCENARIOS = ('parse', 'ingest', 'lookups', 'archive', 'broadcast', 'startup')
+FETCH_PATH = '/replacements/api/fetch-rep'
+
+# Запуск bot.py как есть, но с Bot API и страницей замен на локальном сервере
+STARTUP_SCRIPT = """
+import runpy, sys
+import telebot, parser
+telebot.apihelper.API_URL = sys.argv[1]
+parser.FETCH_URL = sys.argv[2]
+runpy.run_path(sys.argv[3], run_name='__main__')
+"""
+
+
+def best_ms(func, repeat=5):
+    """Лучшее время одного вызова в миллисекундах"""
+    return round(min(timeit.repeat(func, number=1, repeat=repeat)) * 1000, 3)
+
+
+def per_call_us(func, number):
+    return round(min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6, 3)
+
+
+def schedule(args, groups):
+    return make_schedule(groups, args.teachers or max(groups // 2, 20), args.rows, seed=args.seed)
+
+
+def bench_parse(args):
+    rows = []
+    for groups in args.groups:
+        page = render_html(schedule(args, groups))
+        rows.append({
+            'name': f"{groups} групп",
+            'html_kb': round(len(page.encode('utf-8')) / 1024, 1),
+            'parse_ms': best_ms(lambda: parse_replacements_html(page)),
+        })
+    return rows
+
+
+def bench_ingest(args):
+    rows = []
+    workdir = tempfile.mkdtemp(prefix='bench_ingest_')
+    for groups in args.groups:
+        data = schedule(args, groups)
+        changed = next_day(data, seed=args.seed + 1)
+        store = ReplacementsStore(os.path.join(workdir, f"replacements_{groups}.json"))
+        store.subscribe(RenderCache().on_swap)
+
+        started = time.perf_counter()
+        store.ingest(data)
+        first_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        store.ingest(changed)
+        changed_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        store.ingest(changed)
+        same_ms = (time.perf_counter() - started) * 1000
+
+        rows.append({
+            'name': f"{groups} групп",
+            'first_ms': round(first_ms, 2),
+            'changed_ms': round(changed_ms, 2),
+            'unchanged_ms': round(same_ms, 2),
+        })
+    return rows
+
+
+def bench_lookups(args):
+    rows = []
+    for groups in args.groups:
+        store = ReplacementsStore(os.devnull)
+        snapshot = store.swap(schedule(args, groups))
+        cache = RenderCache()
+        rendered = cache.get(snapshot)
+        index = snapshot.index
+        group = index.groups[len(index.groups) // 2]
+        teacher = index.teachers[len(index.teachers) // 2]
+        query = teacher.split()[0][:4]
+
+        rows.append({
+            'name': f"{groups} групп",
+            'group_pairs_us': per_call_us(lambda: index.group_pairs[group], 100000),
+            'teacher_pairs_us': per_call_us(lambda: index.teacher_pairs[teacher], 100000),
+            'message_us': per_call_us(lambda: cache.get(snapshot).message_for('g', group), 100000),
+            'keyboard_page_us': per_call_us(lambda: cache.get(snapshot).groups_pages[0], 100000),
+            'search_us': per_call_us(lambda: rendered.search.search(query), 1000),
+            'render_all_ms': best_ms(lambda: cache.__class__().get(snapshot), repeat=3),
+        })
+    return rows
+
+
+def bench_archive(args):
+    groups = args.groups[0]
+    return [{'name': f"{days} дн.", **measure_archive(days, groups)} for days in args.days]
+
+
+def bench_broadcast(args):
+    rows = []
+    api = FakeBotApi(latency=args.api_latency, rate_limit_share=args.rate_limit_share,
+                     retry_after=1, seed=args.seed).start()
+    telebot.apihelper.API_URL = api.api_url
+    bot = telebot.TeleBot('123456:bench', threaded=False)
+    try:
+        for chats in args.chats:
+            api.reset()
+            broadcaster = Broadcaster(bot.send_message, rate=args.rate, workers=args.workers,
+                                      progress_every=max(chats // 10, 1))
+            stats = broadcaster.run(range(1, chats + 1), "🔔 Обнаружены новые замены")
+            rows.append({
+                'name': f"{chats} чатов",
+                'seconds': round(stats.elapsed, 2),
+                'messages_per_s': round(chats / stats.elapsed, 1),
+                'sent': stats.sent,
+                'failed': stats.failed,
+                'retries': stats.retries,
+                'injected_429': api.rate_limited,
+                'api_calls': api.counts().get('sendMessage', 0),
+            })
+    finally:
+        api.stop()
+    return rows
+
+
+def read_lines(stream, lines):
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+def start_bot(workdir, api, timeout):
+    """Запускает bot.py и ждет строк о готовности и времени этапов"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', STARTUP_SCRIPT, api.api_url, api.url + FETCH_PATH,
+         os.path.join(ROOT_DIR, 'bot.py')],
+        cwd=workdir, env={**os.environ, 'LOG_LEVEL': 'INFO', 'PYTHONPATH': ROOT_DIR},
+        stderr=subprocess.PIPE, text=True, encoding='utf-8',
+    )
+    lines = queue.Queue()
+    threading.Thread(target=read_lines, args=(process.stderr, lines), daemon=True).start()
+
+    ready_s, timings = None, None
+    deadline = time.monotonic() + timeout
+    try:
+        while ready_s is None or timings is None:
+            line = lines.get(timeout=max(deadline - time.monotonic(), 0.01))
+            if line is None:
+                raise RuntimeError(f"bot.py завершился с кодом {process.wait()}")
+            if "Бот запущен за" in line:
+                ready_s = time.perf_counter() - started
+            match = re.search(r"Время этапов запуска, с: (\{.*\})", line)
+            if match:
+                timings = ast.literal_eval(match.group(1))
+    except queue.Empty:
+        raise RuntimeError(f"bot.py не запустился за {timeout} с")
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return ready_s, timings
+
+
+def bench_startup(args):
+    rows = []
+    for users in args.users:
+        workdir = tempfile.mkdtemp(prefix='bench_startup_')
+        data = schedule(args, args.groups[-1])
+        write_json(data, os.path.join(workdir, 'replacements.json'))
+        with open(os.path.join(workdir, 'bot_token.txt'), 'w') as f:
+            f.write('123456:bench')
+        conn = sqlite3.connect(os.path.join(workdir, 'bot.db'))
+        conn.execute("CREATE TABLE users (chat_id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO users VALUES (?)", ((chat_id,) for chat_id in range(1, users + 1)))
+        conn.commit()
+        conn.close()
+
+        # Страница замен та же, что на диске: прогрев не запускает рассылку
+        api = FakeBotApi(latency=0.01, pages={FETCH_PATH: render_html(data)}).start()
+        try:
+            ready_s, timings = start_bot(workdir, api, args.startup_timeout)
+        finally:
+            api.stop()
+        rows.append({
+            'name': f"{users} пользователей",
+            'ready_s': round(ready_s, 3),
+            **{f"{phase}_s": seconds for phase, seconds in timings.items() if phase != 'ready'},
+        })
+    return rows
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'ingest': bench_ingest,
+    'lookups': bench_lookups,
+    'archive': bench_archive,
+    'broadcast': bench_broadcast,
+    'startup': bench_startup,
+}
+
+
+def print_table(scenario, rows):
+    print(f"\n== {scenario}")
+    if not rows:
+        return
+    keys = list(rows[0])
+    widths = [max(len(key), *(len(str(row.get(key, ''))) for row in rows)) for key in keys]
+    print("  ".join(key.rjust(width) for key, width in zip(keys, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(key, '')).rjust(width) for key, width in zip(keys, widths)))
+
+
+def is_duration(key):
+    return key.endswith(('_ms', '_us', '_s')) or key == 'seconds'
+
+
+def compare(old, new, threshold):
+    """Печатает изменения относительно прошлого прогона, возвращает число регрессов"""
+    regressions = 0
+    print(f"\n== сравнение с {old.get('started', '?')}")
+    for scenario, rows in new['results'].items():
+        previous = {row['name']: row for row in old.get('results', {}).get(scenario, [])}
+        for row in rows:
+            before = previous.get(row['name'])
+            if not before:
+                continue
+            for key, value in row.items():
+                if key == 'name' or not isinstance(value, (int, float)) or not before.get(key):
+                    continue
+                change = (value - before[key]) / before[key] * 100
+                mark = ''
+                if is_duration(key) and change > threshold:
+                    mark = '  <- регресс'
+                    regressions += 1
+                print(f"{scenario:>9} {row['name']:>18} {key:>18} {before[key]:>12} -> {value:<12} "
+                      f"{change:+7.1f}%{mark}")
+    return regressions
+
+
+def main():
+    arguments = argparse.ArgumentParser(description="Замеры бота на синтетических данных")
+    arguments.add_argument('--only', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    arguments.add_argument('--groups', nargs='+', type=int, default=[100, 1000], help="размеры снимка")
+    arguments.add_argument('--teachers', type=int, default=0, help="по умолчанию половина числа групп")
+    arguments.add_argument('--rows', type=int, default=4, help="замен на группу")
+    arguments.add_argument('--days', nargs='+', type=int, default=[300], help="дней в архиве")
+    arguments.add_argument('--chats', nargs='+', type=int, default=[10000, 100000])
+    arguments.add_argument('--users', nargs='+', type=int, default=[1000, 100000])
+    arguments.add_argument('--rate', type=float, default=5000, help="сообщений в секунду в рассылке")
+    arguments.add_argument('--workers', type=int, default=32, help="потоков рассылки")
+    arguments.add_argument('--api-latency', type=float, default=0.01, help="ответ Bot API, с")
+    arguments.add_argument('--rate-limit-share', type=float, default=0.0002, help="доля ответов 429")
+    arguments.add_argument('--startup-timeout', type=float, default=60)
+    arguments.add_argument('--seed', type=int, default=1)
+    arguments.add_argument('--output', help="файл результатов, по умолчанию benchmarks/results/<время>.json")
+    arguments.add_argument('--compare', help="прошлый файл результатов")
+    arguments.add_argument('--threshold', type=float, default=10, help="порог регресса, %%")
+    args = arguments.parse_args()
+
+    logging.disable(logging.WARNING)
+    # Замер не должен ходить на настоящий сервер замен
+    parser.FETCH_URL = 'http://127.0.0.1:9' + FETCH_PATH
+
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': {},
+    }
+    for scenario in args.only:
+        rows = BENCHMARKS[scenario](args)
+        report['results'][scenario] = rows
+        print_table(scenario, rows)
+
+    output = args.output or os.path.join(
+        BENCH_DIR, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Синтетические замены заданного размера.
+
+make_schedule строит снимок в формате replacements.json, render_html -
+страницу в формате fetch-rep, которую разбирает table_parser: строка
+с датой, таблица с заголовком, строки групп и строки замен, подпись.
+Одинаковый seed дает одинаковые данные, поэтому замеры повторяемы.
+"""
+import html
+import json
+import random
+from datetime import date
+
+SURNAMES = (
+    "Иванова", "Петров", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева", "Козлов",
+    "Новикова", "Морозов", "Волкова", "Алексеев", "Львова", "Семёнов", "Егорова", "Павлов",
+    "Степанова", "Николаев", "Орлова", "Андреев", "Макарова", "Захаров", "Зайцева", "Соловьёв",
+)
+INITIALS = "АБВГДЕИКЛМНОПРСТ"
+SUBJECTS = (
+    "Математика", "Физика", "Химия", "Информатика", "История", "Литература", "Английский язык",
+    "Индивидуальный проект", "Основы алгоритмизации", "Базы данных", "Компьютерные сети",
+    "Операционные системы", "Физическая культура", "Экономика", "Обществознание",
+)
+STATUSES = ("Отмена пары", "Перенос пары")
+WEEKDAYS = ("понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье")
+
+
+def make_teachers(count, rnd):
+    """Уникальные ФИО вида "Иванова А.Б." """
+    teachers = []
+    seen = set()
+    while len(teachers) < count:
+        name = f"{rnd.choice(SURNAMES)} {rnd.choice(INITIALS)}.{rnd.choice(INITIALS)}."
+        if name in seen:
+            # Однофамильцев с теми же инициалами различаем номером
+            name = f"{name[:-5]}{len(teachers)} {name[-4:]}"
+        seen.add(name)
+        teachers.append(name)
+    return teachers
+
+
+def make_schedule(groups=100, teachers=60, rows_per_group=4, day=None, seed=1):
+    """Снимок {date, raw_date, groups} в формате replacements.json"""
+    rnd = random.Random(seed)
+    day = day or date(2024, 12, 21)
+    names = make_teachers(teachers, rnd)
+    numbers = rnd.sample(range(100, 100 + groups * 10), groups)
+
+    data_groups = {}
+    for number in sorted(numbers):
+        rows = []
+        lessons = sorted(rnd.sample(range(1, 11), min(rows_per_group, 10)))
+        for lesson in lessons:
+            if rnd.random() < 0.1:
+                teacher, new_subject, classroom = rnd.choice(STATUSES), "", ""
+            else:
+                teacher = rnd.choice(names)
+                new_subject = rnd.choice(SUBJECTS)
+                classroom = "ДО" if rnd.random() < 0.15 else str(rnd.randrange(101, 420))
+            rows.append({
+                "pair": str(lesson),
+                "original_subject": rnd.choice(SUBJECTS),
+                "teacher": teacher,
+                "new_subject": new_subject,
+                "classroom": classroom,
+            })
+        data_groups[str(number)] = rows
+
+    weekday = WEEKDAYS[day.weekday()]
+    return {
+        "date": day.isoformat(),
+        "raw_date": f"Замены {weekday} {day:%d.%m.%y} {'четная' if day.isocalendar()[1] % 2 else 'нечетная'}",
+        "groups": data_groups,
+    }
+
+
+def render_html(data):
+    """Страница fetch-rep для снимка"""
+    cell = lambda text: f"<td>{html.escape(text)}</td>"
+    rows = ["<tr><th>№ пары</th><th>Предмет</th><th>Преподаватель</th><th>Замена</th><th>Аудитория</th></tr>",
+            "<tr>" + cell("№ пары") + cell("Что заменяем") + cell("Кто заменяет") + cell("Чем") + cell("Где") + "</tr>"]
+    for number, replacements in data["groups"].items():
+        rows.append(f'<tr><td colspan="5"><b>{number}</b></td></tr>')
+        for row in replacements:
+            rows.append("<tr>" + "".join(cell(row[field]) for field in
+                                         ("pair", "original_subject", "teacher", "new_subject", "classroom")) + "</tr>")
+    rows.append("<tr>" + cell("Заместитель директора по УР") + cell("") + cell("Венедиктова Н.В.") + cell("") + "</tr>")
+    return (f'<div class="rep"><p><b>{html.escape(data["raw_date"])}</b></p>\n'
+            f'<table class="table">\n' + "\n".join(rows) + "\n</table></div>")
+
+
+def write_json(data, filename):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def next_day(data, seed=2, changed_share=0.2):
+    """Тот же снимок с частью измененных групп, как при обновлении замен"""
+    rnd = random.Random(seed)
+    changed = make_schedule(len(data["groups"]), 60, 4, seed=seed)
+    groups = dict(data["groups"])
+    replacements = list(changed["groups"].values())
+    for number in rnd.sample(sorted(groups), int(len(groups) * changed_share)):
+        groups[number] = rnd.choice(replacements)
+    return {**data, "groups": groups}
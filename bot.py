@@ -1,243 +1,485 @@
-import telebot
-import json
-import logging
 import time
+
+# Отсчет времени запуска начинается до импорта зависимостей
+PROCESS_STARTED = time.perf_counter()
+
+import logging
 import threading
-from parser import get_replacements, save_to_json
+from contextlib import contextmanager
+from parser import NOT_MODIFIED
+from render import (MAIN_KEYBOARD, render_changes, render_group, render_teacher,
+                    build_subscribe_keyboard, build_groups_keyboard, build_teachers_keyboard,
+                    build_dates_keyboard, build_day_keyboard, build_matches_keyboard,
+                    build_sources_keyboard, format_day)
+from sources import SOURCES_FILE, SourceRegistry, load_sources
+import callbacks
+from search import EXACT
+from broadcast import Broadcaster, GLOBAL_RATE
+from subscriptions import Subscriptions, GROUP, TEACHER
+from diff import diff_snapshots
+from users_store import UserStore
+from runtime import BotRuntime, POLLING, WEBHOOK
+from chat_history import ChatHistory, ChatCleaner, TrackingBot
+from throttle import Debouncer, ChatRateLimiter, SingleFlight
+from export import ExportServer
+from cluster import ClusterNode, ShardedBroadcast, SharedUserSources, make_backend
+import functools
+import metrics
 from datetime import datetime
 import os
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
+# Время этапов запуска в секундах
+startup_timings = {'imports': round(time.perf_counter() - PROCESS_STARTED, 3)}
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - started, 3)
+
 # Инициализация бота
+# Последние сообщения чатов для кнопки "Очистить"
+chat_history = ChatHistory()
+
+# Обработчики запускает пул из runtime, поэтому собственные потоки telebot не нужны
 with open('bot_token.txt', 'r') as f:
-    bot = telebot.TeleBot(f.read().strip())
+    bot = TrackingBot(f.read().strip(), chat_history, threaded=False)
 
-# Файл для хранения ID пользователей
-USERS_FILE = 'users.json'
+# Удаление сообщений пачками в отдельном потоке
+chat_cleaner = ChatCleaner(bot.delete_messages)
 
-# Функция для загрузки списка пользователей
-def load_users():
-    try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        return []
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке пользователей: {e}")
-        return []
+# Способ приема обновлений: polling или webhook
+RUNTIME_MODE = os.environ.get('BOT_RUNTIME', POLLING)
+HANDLER_WORKERS = int(os.environ.get('HANDLER_WORKERS', '8'))
 
-# Функция для сохранения списка пользователей
-def save_users(users):
-    try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(list(set(users)), f)  # Используем set для удаления дубликатов
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении пользователей: {e}")
+# Чаты администраторов, которым доступна команда /refresh
+ADMIN_IDS = {int(chat_id) for chat_id in os.environ.get('ADMIN_IDS', '').split(',') if chat_id.strip()}
 
-# Функция для чтения данных из JSON
-def read_replacements():
-    try:
-        with open('replacements.json', 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except Exception as e:
-        logger.error(f"Ошибка при чтении JSON: {e}")
-        return None
+# Пользователи в SQLite с индексом в памяти, users.json переносится при первом запуске
+user_store = UserStore()
 
-# Функция для форматирования замен
-def format_replacement(replacement):
-    # Конвертируем номер урока в номер пары
-    lesson_num = int(replacement['pair']) if replacement['pair'].isdigit() else 0
-    pair_num = (lesson_num + 1) // 2 if lesson_num > 0 else lesson_num
-    
-    message = f"🕐 Пара: {pair_num}\n"
-    
-    if replacement['teacher'] == "Отмена пары":
-        message += "❌ Статус: Пара отменена\n"
-    elif replacement['teacher'] == "Перенос пары":
-        message += "🔄 Статус: Пара перенесена\n"
-    else:
-        if replacement['new_subject']:
-            message += f"📗 Предмет: {replacement['new_subject']}\n"
-        
-        if replacement['teacher']:
-            message += f"👨‍🏫 Преподаватель: {replacement['teacher']}\n"
-    
-    if replacement['classroom']:
-        if replacement['classroom'].upper() == 'ДО':
-            message += "🏠 Форма обучения: Дистанционно\n"
-        else:
-            message += f"🏛 Аудитория: {replacement['classroom']}\n"
-    
-    return message
+# Несколько процессов или узлов с общим состоянием: sqlite или redis, пусто - один процесс
+CLUSTER_BACKEND = os.environ.get('CLUSTER_BACKEND', '')
+# Сколько узлов рассылают одновременно; лимит Telegram делится между ними
+CLUSTER_SIZE = int(os.environ.get('CLUSTER_SIZE', '1'))
+cluster_backend = None
+if CLUSTER_BACKEND:
+    cluster_backend = make_backend(CLUSTER_BACKEND, filename=os.environ.get('CLUSTER_DB', 'cluster.db'),
+                                   url=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
 
-# Функция для группировки замен по парам
-def group_replacements_by_pairs(replacements):
-    # Сортируем замены по номеру урока
-    sorted_replacements = sorted(replacements, key=lambda x: int(x['pair']) if x['pair'].isdigit() else float('inf'))
-    
-    # Группируем по парам
-    pairs = {}
-    for i in range(0, len(sorted_replacements), 2):
-        # Получаем текущий урок
-        current = sorted_replacements[i]
-        # Проверяем, есть ли следующий урок
-        next_lesson = sorted_replacements[i + 1] if i + 1 < len(sorted_replacements) else None
-        
-        # Если это последовательные уроки (например, 1-2, 3-4 и т.д.)
-        if (next_lesson and 
-            current['pair'].isdigit() and 
-            next_lesson['pair'].isdigit() and 
-            int(next_lesson['pair']) == int(current['pair']) + 1 and 
-            int(current['pair']) % 2 == 1):  # Проверяем, что первый урок нечетный
-            
-            # Вычисляем номер пары
-            pair_num = (int(current['pair']) + 1) // 2
-            pairs[pair_num] = current  # Берем только первый урок, так как они одинаковые
-            
-        # Если это одиночный урок или уроки разные
-        else:
-            if current['pair'].isdigit():
-                pair_num = (int(current['pair']) + 1) // 2
-                pairs[pair_num] = current
+# Подписки пользователей на группы и преподавателей, в кластере - в общем хранилище
+subscriptions = Subscriptions(cluster_backend or user_store)
+
+# Выбранные пользователями источники, в кластере - в общем хранилище с кэшем
+chosen_sources = SharedUserSources(cluster_backend) if cluster_backend else user_store
+
+# Сайты замен: без sources.json один сайт колледжа. У каждого источника свой
+# снимок в памяти, архив по дням, готовые ответы, выгрузка и расписание опроса
+sources = SourceRegistry(load_sources(os.environ.get('SOURCES_FILE', SOURCES_FILE)))
+
+# Основной источник под прежними именами
+store = sources.primary.store
+archive = sources.primary.archive
+render_cache = sources.primary.render_cache
+export_cache = sources.primary.export_cache
+scheduler = sources.primary.scheduler
+
+# Лидерство и снимки от лидера, если узлов несколько
+cluster = None
+if cluster_backend:
+    cluster = ClusterNode(cluster_backend, sources.stores(), node_id=os.environ.get('CLUSTER_NODE_ID'))
+    for source in sources:
+        source.store.subscribe(cluster.publish)
+    # Подписки и выбор источника, измененные на других узлах, перечитываются
+    cluster.subscribe_users(subscriptions.refresh)
+    cluster.subscribe_users(chosen_sources.invalidate)
+
+# Функция для проверки, опрашивает ли замены этот процесс
+def is_fetcher():
+    return cluster is None or cluster.is_leader()
+
+# Функция для получения источника, который выбрал пользователь
+def source_for(chat_id):
+    return sources.get(chosen_sources.source_of(chat_id))
+
+# Функция для получения текущего снимка замен пользователя
+def read_replacements(chat_id=None):
+    source = sources.primary if chat_id is None else source_for(chat_id)
+    return source.store.current()
+
+# Функция для получения готовых ответов снимка из его источника
+def rendered_for(snapshot):
+    return sources.get(snapshot.source).render_cache.get(snapshot)
+
+# Сколько последних дней показывать в выборе даты
+ARCHIVE_DATES_SHOWN = 12
+
+HANDLER_SECONDS = metrics.histogram('handler_seconds', "Время обработчиков бота", ('handler',), slow=2.0)
+BROADCAST_SECONDS = metrics.histogram('broadcast_seconds', "Длительность рассылок", ('kind',))
+DROPPED_REQUESTS = metrics.counter('dropped_requests', "Отброшенные запросы пользователей", ('reason',))
+
+# Повторное нажатие той же кнопки в течение двух секунд отбрасывается,
+# не больше 5 запросов подряд от чата, дальше один в секунду.
+# Значения подобраны по benchmarks/bench_burst.py: во всплеске нажатия
+# ждут в очереди, и двойное нажатие доходит до обработчика с разрывом
+# больше секунды, поэтому окно в секунду пропускало часть повторов
+DEBOUNCE_WINDOW = 2.0
+CHAT_RATE = 1.0
+CHAT_BURST = 5
+debouncer = Debouncer(window=DEBOUNCE_WINDOW)
+chat_limiter = ChatRateLimiter(rate=CHAT_RATE, burst=CHAT_BURST)
+# Одинаковые вычисления, идущие одновременно, выполняются один раз
+flights = SingleFlight()
 
-    return pairs
+# Функция для проверки, нужно ли обрабатывать запрос чата
+def accept(chat_id, key):
+    if debouncer.repeated((chat_id, key)):
+        DROPPED_REQUESTS.inc(reason='repeated')
+        logger.debug(f"Повторное нажатие в чате {chat_id}: {key}")
+        return False
+    if not chat_limiter.allow(chat_id):
+        DROPPED_REQUESTS.inc(reason='rate_limited')
+        logger.debug(f"Чат {chat_id} превысил частоту запросов")
+        return False
+    return True
 
-# Создание основной клавиатуры
+# Декоратор для обработчиков сообщений: повторы и лишние запросы пропускаются
+def guarded(handler):
+    @functools.wraps(handler)
+    def wrapper(message):
+        if accept(message.chat.id, message.text):
+            handler(message)
+    return wrapper
+
+# Основная клавиатура
 def get_main_keyboard():
-    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.row("Замена по группам", "Замена по преподавателям")
-    keyboard.row("Очистить")
-    return keyboard
+    return MAIN_KEYBOARD
 
 # Обработчик команды /start
 @bot.message_handler(commands=['start'])
 def start(message):
-    users = load_users()
-    if message.chat.id not in users:
-        users.append(message.chat.id)
-        save_users(users)
+    if user_store.add(message.chat.id):
         logger.info(f"Новый пользователь добавлен: {message.chat.id}")
+        if cluster_backend:
+            cluster_backend.add_users([message.chat.id])
     
-    bot.reply_to(message, 
-                 "Добро пожаловать! Выберите тип поиска замен. Вы будете получать уведомления о новых заменах.",
-                 reply_markup=get_main_keyboard())
+    text = "Добро пожаловать! Выберите тип поиска замен. Вы будете получать уведомления о новых заменах."
+    if len(sources) > 1:
+        text += f"\nСейчас выбран сайт замен «{source_for(message.chat.id).title}», сменить: /source"
+    bot.reply_to(message, text, reply_markup=get_main_keyboard())
+
+# Обработчик команды /source: выбор сайта замен
+@bot.message_handler(commands=['source'])
+def choose_source(message):
+    current = sources.position(source_for(message.chat.id))
+    keyboard = build_sources_keyboard([source.title for source in sources], current)
+    bot.reply_to(message, "Выберите сайт замен:", reply_markup=keyboard)
 
 # Обработчик кнопки "Замена по группам"
 @bot.message_handler(func=lambda message: message.text == "Замена по группам")
+@guarded
 def show_groups(message):
-    data = read_replacements()
-    if not data or not data['groups']:
+    snapshot = read_replacements(message.chat.id)
+    if not snapshot or not snapshot.index.groups:
         bot.reply_to(message, "Данные о заменах отсутствуют")
         return
 
-    keyboard = telebot.types.InlineKeyboardMarkup(row_width=3)
-    
-    # Сортируем группы по номеру
-    groups = sorted(data['groups'].keys(), key=lambda x: int(x))
-    
-    # Создаем кнопки для каждой группы
-    buttons = []
-    for group_number in groups:
-        buttons.append(
-            telebot.types.InlineKeyboardButton(
-                text=group_number,
-                callback_data=f"group_{group_number}"
-            )
-        )
-    
-    # Добавляем кнопки в клавиатуру по 3 в ряд
-    for i in range(0, len(buttons), 3):
-        row = buttons[i:min(i + 3, len(buttons))]
-        keyboard.add(*row)
-
-    bot.reply_to(message, "Выберите группу:", reply_markup=keyboard)
+    rendered = rendered_for(snapshot)
+    bot.reply_to(message, "Выберите группу:", reply_markup=rendered.groups_pages[0])
 
 # Обработчик кнопки "Замена по преподавателям"
 @bot.message_handler(func=lambda message: message.text == "Замена по преподавателям")
+@guarded
 def show_teachers(message):
-    data = read_replacements()
-    if not data or not data['groups']:
+    snapshot = read_replacements(message.chat.id)
+    if not snapshot or not snapshot.index.groups:
         bot.reply_to(message, "Данные о заменах отсутствуют")
         return
 
-    teachers = set()
-    for group_replacements in data['groups'].values():
-        for replacement in group_replacements:
-            if (replacement['teacher'] and 
-                replacement['teacher'] not in ["Отмена пары", "Перенос пары"]):
-                teachers.add(replacement['teacher'])
+    rendered = rendered_for(snapshot)
+    bot.reply_to(message, "Выберите преподавателя:", reply_markup=rendered.teachers_pages[0])
 
-    keyboard = telebot.types.InlineKeyboardMarkup()
-    for teacher in sorted(teachers):
-        keyboard.add(telebot.types.InlineKeyboardButton(
-            text=teacher,
-            callback_data=f"teacher_{teacher}"
-        ))
+# Обработчик кнопки "Выбрать дату"
+@bot.message_handler(func=lambda message: message.text == "Выбрать дату")
+@guarded
+def show_dates(message):
+    dates = source_for(message.chat.id).archive.dates()[-ARCHIVE_DATES_SHOWN:][::-1]
+    if not dates:
+        bot.reply_to(message, "Архив замен пуст")
+        return
+    bot.reply_to(message, "Выберите дату:", reply_markup=build_dates_keyboard(dates))
 
-    bot.reply_to(message, "Выберите преподавателя:", reply_markup=keyboard)
+# Ответ на кнопку из сообщения, отправленного до обновления данных
+STALE_MESSAGE = "Данные обновились, откройте меню заново"
 
 # Обработчик callback-запросов
 @bot.callback_query_handler(func=lambda call: True)
 def callback_handler(call):
-    data = read_replacements()
-    if not data:
+    # Кнопку все равно нужно подтвердить, иначе у пользователя крутятся часики
+    if debouncer.repeated((call.from_user.id, call.data)):
+        DROPPED_REQUESTS.inc(reason='repeated')
+        bot.answer_callback_query(call.id)
+        return
+    if not chat_limiter.allow(call.from_user.id):
+        DROPPED_REQUESTS.inc(reason='rate_limited')
+        bot.answer_callback_query(call.id, "Слишком много нажатий, подождите немного")
+        return
+
+    kind, parts = callbacks.unpack(call.data)
+    handler = CALLBACK_HANDLERS.get(kind)
+    try:
+        if handler is not None:
+            handler(call, kind, *parts)
+            return
+    except (TypeError, ValueError, IndexError) as e:
+        logger.warning(f"Некорректная кнопка {call.data!r}: {e}")
+
+    # Неизвестные и устаревшие кнопки, в том числе старого формата
+    bot.answer_callback_query(call.id, STALE_MESSAGE)
+
+# Функция для получения снимка, к которому относится кнопка
+def snapshot_for(call, token):
+    snapshot = read_replacements(call.from_user.id)
+    if not snapshot:
         bot.answer_callback_query(call.id, "Ошибка получения данных")
+        return None
+    if token != snapshot.token:
+        # Кнопка могла остаться от источника, который пользователь выбирал раньше
+        snapshot = next((current for current in (source.store.current() for source in sources)
+                         if current and current.token == token), None)
+        if snapshot is None:
+            bot.answer_callback_query(call.id, STALE_MESSAGE)
+    return snapshot
+
+# Функция для получения группы или преподавателя по номеру из кнопки
+def resolve_item(snapshot, kind, position):
+    items = snapshot.index.groups if kind == callbacks.GROUP else snapshot.index.teachers
+    name = callbacks.resolve(items, position)
+    if name is None:
+        raise ValueError(position)
+    return name
+
+# Функция для отправки готового ответа по группе или преподавателю с кнопкой подписки
+def send_item(chat_id, snapshot, kind, position):
+    name = resolve_item(snapshot, kind, position)
+
+    # Ответы отрисованы заранее для текущего снимка
+    response = rendered_for(snapshot).message_for(kind, name)
+    subscribe_kind = callbacks.SUBSCRIBE_GROUP if kind == callbacks.GROUP else callbacks.SUBSCRIBE_TEACHER
+    subscribe = callbacks.pack(subscribe_kind, position, snapshot.token)
+    bot.send_message(chat_id, response, reply_markup=build_subscribe_keyboard(subscribe))
+
+# Кнопка группы или преподавателя из текущего снимка
+def on_item(call, kind, position, token):
+    snapshot = snapshot_for(call, token)
+    if not snapshot:
         return
 
-    if call.data.startswith('group_'):
-        group_number = call.data[6:]
-        response = f"📅 Замены для группы {group_number}\n"
-        if data['raw_date']:
-            response += f"📆 {data['raw_date']}\n\n"
-        
-        if group_number in data['groups']:
-            replacements = data['groups'][group_number]
-            if not replacements:
-                response = f"Для группы {group_number} замен нет"
-            else:
-                # Группируем замены по парам
-                pairs = group_replacements_by_pairs(replacements)
-                for pair_num in sorted(pairs.keys()):
-                    response += format_replacement(pairs[pair_num]) + "\n"
-        else:
-            response = f"Для группы {group_number} замен нет"
-            
-    elif call.data.startswith('teacher_'):
-        teacher_name = call.data[8:]
-        response = f"👨‍🏫 Замены для преподавателя {teacher_name}\n"
-        if data['raw_date']:
-            response += f"📆 {data['raw_date']}\n\n"
-        
-        # Соираем все замены для преподавателя
-        teacher_replacements = []
-        for group_number, replacements in data['groups'].items():
-            for replacement in replacements:
-                if replacement['teacher'] == teacher_name:
-                    replacement_with_group = {**replacement, 'group_number': group_number}
-                    teacher_replacements.append(replacement_with_group)
-        
-        if teacher_replacements:
-            # Группируем замены по парам
-            pairs = group_replacements_by_pairs(teacher_replacements)
-            for pair_num in sorted(pairs.keys()):
-                response += f"👥 Группа: {pairs[pair_num]['group_number']}\n"
-                response += format_replacement(pairs[pair_num]) + "\n"
-        else:
-            response = f"Для преподавателя {teacher_name} замен нет"
+    resolve_item(snapshot, kind, position)
+    # Подтверждаем нажатие до отправки ответа
+    bot.answer_callback_query(call.id)
+    send_item(call.message.chat.id, snapshot, kind, position)
+
+# Листание страниц клавиатуры групп или преподавателей
+def on_page(call, kind, page, token):
+    snapshot = snapshot_for(call, token)
+    if not snapshot:
+        return
 
+    rendered = rendered_for(snapshot)
+    pages = rendered.groups_pages if kind == callbacks.GROUPS_PAGE else rendered.teachers_pages
+    page = min(max(int(page), 0), len(pages) - 1)
     bot.answer_callback_query(call.id)
+    bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=pages[page])
+
+# Функция для включения и выключения подписки по кнопке
+def on_subscribe(call, kind, position, token):
+    snapshot = snapshot_for(call, token)
+    if not snapshot:
+        return
+
+    if kind == callbacks.SUBSCRIBE_GROUP:
+        key = callbacks.resolve(snapshot.index.groups, position)
+        subscription, title = GROUP, f"группу {key}"
+    else:
+        key = callbacks.resolve(snapshot.index.teachers, position)
+        subscription, title = TEACHER, f"преподавателя {key}"
+    if key is None:
+        raise ValueError(position)
+
+    if subscriptions.toggle(call.message.chat.id, subscription, key):
+        text = f"Вы подписались на {title}. Уведомления будут приходить только по вашим подпискам."
+    else:
+        text = f"Вы отписались от {title}"
+    bot.answer_callback_query(call.id, text)
+
+# Функция для получения дня из архива, к которому относится кнопка
+def day_for(call, day, token=None):
+    snapshot = source_for(call.from_user.id).archive.get(day)
+    if not snapshot:
+        bot.answer_callback_query(call.id, "Замены за этот день больше не хранятся")
+        return None
+    if token is not None and token != snapshot.token:
+        bot.answer_callback_query(call.id, STALE_MESSAGE)
+        return None
+    return snapshot
+
+# Выбор дня из архива
+def on_day(call, kind, day):
+    snapshot = day_for(call, day)
+    if not snapshot:
+        return
+
+    response = f"📆 {snapshot.data['raw_date'] or format_day(day)}\nПоказать замены:"
+    bot.answer_callback_query(call.id)
+    bot.send_message(call.message.chat.id, response, reply_markup=build_day_keyboard(day, snapshot.token))
+
+# Страница групп или преподавателей дня из архива
+def on_day_page(call, kind, day, page, token):
+    snapshot = day_for(call, day, token)
+    if not snapshot:
+        return
+
+    title = format_day(day)
+    if kind == callbacks.DAY_GROUPS_PAGE:
+        text = f"Выберите группу ({title}):"
+        keyboard = build_groups_keyboard(snapshot.index.groups, token, int(page), day)
+    else:
+        text = f"Выберите преподавателя ({title}):"
+        keyboard = build_teachers_keyboard(snapshot.index.teachers, token, int(page), day)
+
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+
+# Замены группы или преподавателя за день из архива
+def on_day_item(call, kind, day, position, token):
+    snapshot = day_for(call, day, token)
+    if not snapshot:
+        return
+
+    items = snapshot.index.groups if kind == callbacks.DAY_GROUP else snapshot.index.teachers
+    key = callbacks.resolve(items, position)
+    if key is None:
+        raise ValueError(position)
+
+    bot.answer_callback_query(call.id)
+    response = flights.do((snapshot.source, kind, day, key), lambda: render_day_item(snapshot, kind, day, key))
     bot.send_message(call.message.chat.id, response)
 
-# Функция для отправки уведомлений всем пользователям
-def notify_users(new_data):
-    users = load_users()
+# Функция для отрисовки замен группы или преподавателя за день из архива
+def render_day_item(snapshot, kind, day, key):
+    title = format_day(day)
+    if kind == callbacks.DAY_GROUP:
+        pairs = snapshot.index.group_pairs.get(key)
+        if pairs is not None:
+            return render_group(snapshot.data, key, pairs)
+        return f"Для группы {key} замен за {title} нет"
+
+    pairs = snapshot.index.teacher_pairs.get(key)
+    if pairs is not None:
+        return render_teacher(snapshot.data, key, pairs)
+    return f"Для преподавателя {key} замен за {title} нет"
+
+# Кнопка с номером страницы ничего не делает
+def on_noop(call, kind):
+    bot.answer_callback_query(call.id)
+
+# Выбор сайта замен
+def on_source(call, kind, position):
+    source = sources.at(int(position))
+    if source is None:
+        raise ValueError(position)
+
+    chosen_sources.set_source(call.from_user.id, source.name)
+    bot.answer_callback_query(call.id, f"Выбран сайт замен «{source.title}»")
+    keyboard = build_sources_keyboard([other.title for other in sources], int(position))
+    bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+
+# Обработчики кнопок по виду из callback_data
+CALLBACK_HANDLERS = {
+    callbacks.GROUP: on_item,
+    callbacks.TEACHER: on_item,
+    callbacks.GROUPS_PAGE: on_page,
+    callbacks.TEACHERS_PAGE: on_page,
+    callbacks.SUBSCRIBE_GROUP: on_subscribe,
+    callbacks.SUBSCRIBE_TEACHER: on_subscribe,
+    callbacks.DAY: on_day,
+    callbacks.DAY_GROUPS_PAGE: on_day_page,
+    callbacks.DAY_TEACHERS_PAGE: on_day_page,
+    callbacks.DAY_GROUP: on_day_item,
+    callbacks.DAY_TEACHER: on_day_item,
+    callbacks.NOOP: on_noop,
+    callbacks.SOURCE: on_source,
+}
+
+# Обработчик команды /subscriptions
+@bot.message_handler(commands=['subscriptions'])
+def show_subscriptions(message):
+    entry = subscriptions.of(message.chat.id)
+    if not entry[GROUP] and not entry[TEACHER]:
+        bot.reply_to(message, "У вас нет подписок. Вы получаете общие уведомления о новых заменах.")
+        return
+
+    response = "🔔 Ваши подписки\n"
+    if entry[GROUP]:
+        response += "👥 Группы: " + ", ".join(entry[GROUP]) + "\n"
+    if entry[TEACHER]:
+        response += "👨‍🏫 Преподаватели: " + ", ".join(entry[TEACHER]) + "\n"
+    bot.reply_to(message, response)
+
+# Функция для удаления из рассылки пользователей, заблокировавших бота
+def remove_users(chat_ids):
+    removed = set(chat_ids)
+    user_store.remove_many(removed)
+    subscriptions.remove_chats(removed)
+    if cluster_backend:
+        cluster_backend.remove_users(removed)
+    logger.info(f"Пользователи удалены из списка рассылки: {len(removed)}")
+
+# Функция для разового переноса пользователей и подписок этого узла в общее хранилище.
+# Дальше подписки меняются только в общем хранилище, и повторный перенос
+# вернул бы отписки и удаленные чаты
+def migrate_to_cluster():
+    marker = f"migrated:{user_store.instance_id()}"
+    if cluster_backend.has_marker(marker):
+        return
+    cluster_backend.add_users(user_store.all())
+    for chat_id, kind, key in user_store.load_subscriptions():
+        cluster_backend.add_subscription(chat_id, kind, key)
+    cluster_backend.set_marker(marker)
+    logger.info(f"Пользователи и подписки узла перенесены в общее хранилище: {len(user_store)}")
+
+# Рассылка с ограничением частоты и повторами после 429
+broadcaster = Broadcaster(bot.send_message, rate=GLOBAL_RATE / CLUSTER_SIZE, on_blocked=remove_users)
+
+# В кластере лидер режет рассылку на части, и их отправляют все узлы
+sharded_broadcast = ShardedBroadcast(cluster_backend, broadcaster) if cluster_backend else None
+
+# Функция для выбора из чатов тех, кто смотрит замены этого источника
+def chats_of(source, chat_ids):
+    user_sources = chosen_sources.user_sources()
+    return [chat_id for chat_id in chat_ids if sources.get(user_sources.get(chat_id)) is source]
+
+# Функция для отправки уведомлений всем пользователям без подписок
+@BROADCAST_SECONDS.timed(kind='all')
+def notify_users(source, new_data):
+    if cluster_backend:
+        subscriptions.reload()
+    subscribed = subscriptions.subscribed_chats()
+    all_users = cluster_backend.all_users() if cluster_backend else user_store.all()
+    users = chats_of(source, [user_id for user_id in all_users if user_id not in subscribed])
     date_str = new_data.get('raw_date', 'Неизвестная дата')
     
     # Формируем сообщение с кратким обзором замен
     message = f"🔔 Обнаружены новые замены на {date_str}\n\n"
+    if len(sources) > 1:
+        message = f"🔔 {source.title}: обнаружены новые замены на {date_str}\n\n"
     
     # Добавляем список групп с заменами
     groups = new_data.get('groups', {}).keys()
@@ -245,85 +487,127 @@ def notify_users(new_data):
         message += "Замены есть для групп: " + ", ".join(sorted(groups, key=lambda x: int(x))) + "\n\n"
         message += "Используйте меню бота для просмотра подробной информации."
     
-    # Отправляем уведомление каждому пользователю
-    for user_id in users:
-        try:
-            bot.send_message(user_id, message, reply_markup=get_main_keyboard())
-            logger.info(f"Уведомление отправлено пользователю {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-            # Если бот заблокирован или чат не найден, удаляем пользователя из списка
-            if "Forbidden" in str(e) or "chat not found" in str(e).lower():
-                users.remove(user_id)
-                logger.info(f"Пользователь {user_id} удален из списка рассылки")
-    
-    # Сохраняем обновленный список пользователей
-    save_users(users)
+    # Рассылаем уведомление с ограничением частоты
+    if sharded_broadcast:
+        return sharded_broadcast.submit(chat_ids=users, text=message, reply_markup=get_main_keyboard())
+    stats = broadcaster.run(users, message, reply_markup=get_main_keyboard())
+    return stats
 
-# Функция для периодической проверки обновлений
-def check_updates():
-    while True:
-        try:
-            current_time = datetime.now()
+# Функция для отправки подписчикам только их изменений
+@BROADCAST_SECONDS.timed(kind='subscribers')
+def notify_subscribers(previous, snapshot):
+    # При смене даты разница считается от пустого снимка: подписчики не попадают
+    # в общую рассылку о новом дне и получают все замены нового дня по подпискам
+    diff = diff_snapshots(previous.data if previous else None, snapshot.data)
+    if not diff:
+        return None
+    if cluster_backend:
+        # Подписки могли поменяться через другие узлы
+        subscriptions.reload()
+
+    # По инвертированному индексу находим только затронутые чаты этого источника
+    affected = subscriptions.affected(diff)
+    messages = {
+        chat_id: render_changes(snapshot.data, diff, affected[chat_id])
+        for chat_id in chats_of(sources.get(snapshot.source), affected)
+    }
+    if not messages:
+        return None
+    if sharded_broadcast:
+        return sharded_broadcast.submit(messages=messages, reply_markup=get_main_keyboard())
+    return broadcaster.run_messages(messages, reply_markup=get_main_keyboard())
+
+# Функция для одной проверки обновлений
+def poll_replacements(source=None):
+    source = source or sources.primary
+    scheduler = source.scheduler
+    try:
+        # Получаем новые данные не дольше, чем разрешено источнику
+        new_data = source.fetch(skip_unchanged=True)
+        
+        if new_data is NOT_MODIFIED:
+            logger.info(f"Новых данных нет: {source.name}")
+            scheduler.record_success()
+        elif new_data and 'error' not in new_data:
+            scheduler.record_success()
+
+            # Сохраняем и подменяем снимок, только если данные изменились
+            changes = source.store.ingest(new_data)
+            # Только теперь страница считается принятой: после ошибки разбора,
+            # сохранения или таймаута следующий опрос разберет ее снова
+            source.commit()
+            if changes:
+                previous, snapshot = changes
+                logger.info(f"Обнаружены и сохранены новые данные замен: {source.name}")
+                scheduler.record_change()
+
+                # Подписчики узнают о любых изменениях своих групп и преподавателей
+                notify_subscribers(previous, snapshot)
+
+                # Если дата изменилась или данных не было, отправляем уведомления остальным
+                if previous is None or previous.date != snapshot.date:
+                    notify_users(source, new_data)
+                    logger.info("Уведомления о новых заменах отправлены")
+        else:
+            scheduler.record_error()
             
-            # Проверяем, находимся ли мы в интервале 17-18 часов
-            if current_time.hour == 17:
-                # Получаем новые данные
-                new_data = get_replacements()
-                
-                if new_data and 'error' not in new_data:
-                    try:
-                        # Читаем текущие данные
-                        current_data = read_replacements()
-                        
-                        # Проверяем, изменилась ли дата
-                        new_date = new_data.get('date')
-                        current_date = current_data.get('date') if current_data else None
-                        
-                        # Если данные отличаются или файла нет
-                        if current_data != new_data:
-                            # Удаляем старый файл если он существует
-                            if os.path.exists('replacements.json'):
-                                os.remove('replacements.json')
-                            
-                            # Сохраняем новые данные
-                            save_to_json(new_data)
-                            logger.info("Обнаружены и сохранены новые данные замен")
-                            
-                            # Если дата изменилась, отправляем уведомления
-                            if new_date != current_date:
-                                notify_users(new_data)
-                                logger.info("Уведомления о новых заменах отправлены")
-                            
-                    except FileNotFoundError:
-                        # Если файла нет, сохраняем новые данные и отправляем уведомления
-                        save_to_json(new_data)
-                        notify_users(new_data)
-                        logger.info("Создан новый файл с данными замен и отправлены уведомления")
-                
-                # Ждем 20 минут перед следующей проверкой
-                time.sleep(20 * 60)
-            else:
-                # Если не в интервале 17-18, проверяем раз в 30 минут
-                time.sleep(30 * 60)
-                
-        except Exception as e:
-            logger.error(f"Ошибка при проверке обновлений: {e}")
-            time.sleep(5 * 60)
+    except Exception as e:
+        logger.error(f"Ошибка при проверке обновлений {source.name}: {e}")
+        scheduler.record_error()
+
+# Функция для периодической проверки обновлений одного источника,
+# у каждого источника свой поток, и медленный сайт не задерживает остальные
+def check_updates(source):
+    # Первая проверка прогревает данные, пока бот уже отвечает по старому снимку
+    if source.primary:
+        with startup_phase('warmup'):
+            if is_fetcher():
+                poll_replacements(source)
+        logger.info(f"Время этапов запуска, с: {startup_timings}")
+    elif is_fetcher():
+        poll_replacements(source)
+
+    while True:
+        # Ждем следующей проверки по расписанию или ручного запуска
+        source.scheduler.wait()
+        # Остальные узлы кластера получают снимок от лидера
+        if is_fetcher():
+            poll_replacements(source)
+
+# Обработчик команды /status
+@bot.message_handler(commands=['status'])
+def show_status(message):
+    source = source_for(message.chat.id)
+    snapshot = source.store.current()
+    response = f"🏫 Сайт замен: {source.title}\n" if len(sources) > 1 else ""
+    response += f"📆 Данные: {snapshot.data['raw_date'] if snapshot else 'нет'}\n"
+    if source.scheduler.next_run:
+        response += f"🔄 Следующая проверка: {datetime.fromtimestamp(source.scheduler.next_run):%H:%M}\n"
+    bot.reply_to(message, response)
+
+# Обработчик команды /refresh, доступен только администраторам
+@bot.message_handler(commands=['refresh'], func=lambda message: message.chat.id in ADMIN_IDS)
+def refresh(message):
+    if not is_fetcher():
+        bot.reply_to(message, "Замены опрашивает другой узел, проверка запустится там по расписанию")
+        return
+    for source in sources:
+        source.scheduler.poll_now()
+    bot.reply_to(message, "Проверка замен запущена")
+
+# Сколько последних номеров сообщений удалять, даже если бот их не запомнил,
+# например после перезапуска
+CLEAR_RECENT = 100
 
 # Добавляем новый обработчик для кнопки "Очистить"
 @bot.message_handler(func=lambda message: message.text == "Очистить")
+@guarded
 def clear_chat(message):
-    try:
-        # Удаляем предыдущие сообщения
-        for i in range(message.message_id, 0, -1):
-            try:
-                bot.delete_message(message.chat.id, i)
-            except:
-                break
-    except Exception as e:
-        logger.error(f"Ошибка при очистке чата: {e}")
-    
+    # Номера забираем до отправки приветствия, чтобы оно осталось в чате
+    message_ids = chat_history.take(message.chat.id)
+    message_ids.extend(range(max(message.message_id - CLEAR_RECENT, 1), message.message_id + 1))
+    chat_cleaner.clear(message.chat.id, message_ids)
+
     # Отправляем новое приветственное сообщение
     bot.send_message(
         message.chat.id,
@@ -331,21 +615,118 @@ def clear_chat(message):
         reply_markup=get_main_keyboard()
     )
 
-if __name__ == '__main__':
-    # Запускаем парсер при старте бота
-    logger.info("Запуск парсера при старте бота")
-    new_data = get_replacements()
-    if new_data and 'error' not in new_data:
-        save_to_json(new_data)
-        logger.info("Начальные данные успешно получены и сохранены")
+# Сколько совпадений показывать кнопками при поиске текстом
+SEARCH_RESULTS = 10
+# Сколько секунд Telegram может кэшировать ответ на inline-запрос
+INLINE_CACHE_TIME = 60
+
+# Обработчик inline-запросов: "@бот 141" или "@бот Льво"
+@bot.inline_handler(func=lambda query: True)
+def inline_search(query):
+    try:
+        snapshot = read_replacements(query.from_user.id)
+        results = []
+        if snapshot:
+            rendered = rendered_for(snapshot)
+            results = flights.do(('inline', snapshot.digest, query.query),
+                                 lambda: rendered.inline_results(query.query))
+        bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME)
+    except Exception as e:
+        logger.error(f"Ошибка ответа на inline-запрос {query.query!r}: {e}")
+
+# Обработчик произвольного текста: номер группы или фамилия преподавателя.
+# Регистрируется последним, чтобы не перехватывать кнопки меню
+@bot.message_handler(content_types=['text'], func=lambda message: not message.text.startswith('/'))
+@guarded
+def search_text(message):
+    snapshot = read_replacements(message.chat.id)
+    if not snapshot or not snapshot.index.groups:
+        bot.reply_to(message, "Данные о заменах отсутствуют")
+        return
+
+    search = rendered_for(snapshot).search
+    matches = flights.do(('search', snapshot.digest, message.text),
+                         lambda: search.search(message.text, limit=SEARCH_RESULTS))
+    if not matches:
+        bot.reply_to(message, "Ничего не найдено. Введите номер группы или фамилию преподавателя")
+    elif len(matches) == 1 or (matches[0].rank == EXACT and matches[1].rank != EXACT):
+        # Однозначное совпадение сразу отвечаем заменами
+        send_item(message.chat.id, snapshot, matches[0].kind, matches[0].position)
     else:
-        logger.error("Не удалось получить начальные данные")
+        bot.reply_to(message, "Найдено:", reply_markup=build_matches_keyboard(matches, snapshot.token))
+
+# Функция для замера времени всех зарегистрированных обработчиков
+def instrument_handlers():
+    for handlers in (bot.message_handlers, bot.callback_query_handlers, bot.inline_handlers):
+        for handler in handlers:
+            function = handler['function']
+            handler['function'] = HANDLER_SECONDS.timed(handler=function.__name__)(function)
+
+instrument_handlers()
 
-    # Запуск проверки обновлений в отдельном потоке
-    update_thread = threading.Thread(target=check_updates)
-    update_thread.daemon = True
-    update_thread.start()
+if __name__ == '__main__':
+    with startup_phase('archive'):
+        for source in sources:
+            source.archive.load().preload()
+
+    # Сразу поднимаем последние сохраненные снимки, свежие данные
+    # загружаются в фоне и подменят их, когда будут готовы
+    with startup_phase('snapshot'):
+        for source in sources:
+            if not source.store.load():
+                logger.warning(f"Сохраненного снимка {source.name} нет, данные появятся после первой проверки")
+    with startup_phase('users'):
+        user_store.open()
+        if cluster_backend:
+            migrate_to_cluster()
+            # Изменения с других узлов узел ловит с момента запуска, поэтому
+            # запускаем его до чтения подписок
+            cluster.start()
+        subscriptions.load()
+        for source in sources:
+            source.scheduler.load()
+
+    chat_cleaner.start()
+    if cluster:
+        sharded_broadcast.start()
+
+    # Метрики на /metrics и/или периодическая сводка в логе
+    if os.environ.get('METRICS_PORT'):
+        metrics.MetricsServer(host=os.environ.get('METRICS_HOST', '127.0.0.1'),
+                              port=int(os.environ['METRICS_PORT'])).start()
+    if os.environ.get('METRICS_DUMP_INTERVAL'):
+        metrics.dump_periodically(float(os.environ['METRICS_DUMP_INTERVAL']))
+
+    # Выгрузка замен в JSON и iCalendar для веб-страницы и экранов
+    if os.environ.get('EXPORT_PORT'):
+        ExportServer(export_cache, host=os.environ.get('EXPORT_HOST', '127.0.0.1'),
+                     port=int(os.environ['EXPORT_PORT']),
+                     sources={source.name: source.export_cache for source in sources}).start()
+
+    # Запуск проверки обновлений: по потоку на источник
+    for source in sources:
+        update_thread = threading.Thread(target=check_updates, args=(source,), name=f"poll-{source.name}")
+        update_thread.daemon = True
+        update_thread.start()
     
     # Запуск бота
-    logger.info("Бот запущен")
-    bot.polling(none_stop=True)
+    startup_timings['ready'] = round(time.perf_counter() - PROCESS_STARTED, 3)
+    logger.info(f"Бот запущен за {startup_timings['ready']} с")
+    # В кластере обновления через polling принимает только лидер, webhook регистрирует тоже он
+    runtime = BotRuntime(bot, workers=HANDLER_WORKERS, active=cluster.is_leader if cluster else None)
+    try:
+        if RUNTIME_MODE == WEBHOOK:
+            runtime.run_webhook(
+                os.environ['WEBHOOK_URL'],
+                host=os.environ.get('WEBHOOK_HOST', '0.0.0.0'),
+                port=int(os.environ.get('WEBHOOK_PORT', '8443')),
+                path=os.environ.get('WEBHOOK_PATH', '/webhook'),
+                secret_token=os.environ.get('WEBHOOK_SECRET'),
+            )
+        else:
+            runtime.run_polling()
+    finally:
+        if cluster:
+            sharded_broadcast.stop()
+            cluster.stop()
+        user_store.close()
@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_ERRORS = metrics.counter('telegram_errors', "Ошибки Bot API по месту и коду", ('source', 'code'))
+RATE_LIMITED = metrics.counter('telegram_rate_limited', "Ответы 429 от Bot API", ('source',))
+BROADCAST_MESSAGES = metrics.counter('broadcast_messages', "Сообщения рассылок по результату", ('result',))
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота
+# и не чаще одного сообщения в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+
+# Сколько задач на поток держать в очереди исполнителя: остальные
+# отправки ждут своей очереди без future на каждый чат
+SUBMIT_AHEAD = 4
+
+
+class TokenBucket:
+    """Потокобезопасное ведро токенов для ограничения частоты отправки"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов, например после ответа 429"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+    def acquire(self):
+        """Ждет, пока не освободится токен"""
+        while True:
+            with self._lock:
+                now = self.clock()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+class BroadcastStats:
+    """Итоги рассылки"""
+
+    __slots__ = ('total', 'sent', 'failed', 'blocked', 'retries', 'started', 'finished', 'clock')
+
+    def __init__(self, total, clock=time.monotonic):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retries = 0
+        self.clock = clock
+        self.started = clock()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def elapsed(self):
+        return (self.finished or self.clock()) - self.started
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'retries': self.retries,
+            'elapsed': round(self.elapsed, 3),
+        }
+
+
+def error_code(error):
+    """Код ошибки Telegram из исключения telebot"""
+    return getattr(error, 'error_code', None)
+
+
+def retry_after(error):
+    """Сколько секунд Telegram просит подождать после 429"""
+    result = getattr(error, 'result_json', None) or {}
+    return (result.get('parameters') or {}).get('retry_after')
+
+
+def count_error(error, source):
+    """Учитывает ошибку Bot API в метриках"""
+    code = error_code(error)
+    # Сетевые и прочие ошибки без кода помечаются типом исключения
+    TELEGRAM_ERRORS.inc(source=source, code=code or type(error).__name__)
+    if code == 429:
+        RATE_LIMITED.inc(source=source)
+
+
+def is_blocked(error):
+    """Бот заблокирован пользователем или чат больше не существует"""
+    text = str(error)
+    return error_code(error) == 403 or "Forbidden" in text or "chat not found" in text.lower()
+
+
+class Broadcaster:
+    """Параллельная рассылка с ограничением частоты.
+
+    send - функция отправки вида bot.send_message(chat_id, *args, **kwargs).
+    Для проверки против локального сервера достаточно направить telebot
+    на него через telebot.apihelper.API_URL.
+    """
+
+    def __init__(self, send, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 workers=8, max_retries=3, backoff=1.0, prune_batch=100,
+                 on_blocked=None, on_progress=None, progress_every=500,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.send = send
+        self.bucket = TokenBucket(rate, clock=clock, sleep=sleep)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.prune_batch = prune_batch
+        self.on_blocked = on_blocked
+        self.on_progress = on_progress
+        self.progress_every = progress_every
+        self.clock = clock
+        self.sleep = sleep
+        self._last_sent = {}  # чат -> время последней отправки, пока не истек per_chat_interval
+        self._lock = threading.Lock()
+
+    def _wait_for_chat(self, chat_id):
+        """Соблюдает интервал между сообщениями в один чат"""
+        with self._lock:
+            now = self.clock()
+            ready_at = self._last_sent.get(chat_id, 0) + self.per_chat_interval
+            self._last_sent[chat_id] = max(now, ready_at)
+        if ready_at > now:
+            self.sleep(ready_at - now)
+
+    def _prune_last_sent(self):
+        """Забывает чаты, интервал которых уже истек, чтобы словарь не рос с числом пользователей"""
+        with self._lock:
+            expired = self.clock() - self.per_chat_interval
+            self._last_sent = {chat_id: sent for chat_id, sent in self._last_sent.items() if sent > expired}
+
+    def _send_one(self, chat_id, stats, blocked, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_chat(chat_id)
+            self.bucket.acquire()
+            try:
+                self.send(chat_id, *args, **kwargs)
+                return 'sent'
+            except Exception as e:
+                code = error_code(e)
+                count_error(e, 'broadcast')
+                if is_blocked(e):
+                    logger.info(f"Пользователь {chat_id} заблокировал бота")
+                    with self._lock:
+                        blocked.append(chat_id)
+                    return 'blocked'
+                if attempt == self.max_retries:
+                    logger.error(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+                    return 'failed'
+
+                if code == 429:
+                    # Telegram сам говорит, сколько ждать, и это касается всех отправок
+                    delay = retry_after(e) or self.backoff
+                    self.bucket.pause(delay)
+                elif code is None or code >= 500:
+                    delay = self.backoff * 2 ** attempt
+                else:
+                    logger.error(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+                    return 'failed'
+
+                with self._lock:
+                    stats.retries += 1
+                logger.warning(f"Повтор отправки пользователю {chat_id} через {delay} с: {e}")
+                self.sleep(delay)
+        return 'failed'
+
+    def _flush_blocked(self, blocked, force=False):
+        """Передает заблокированные чаты на удаление пачками"""
+        with self._lock:
+            if not blocked or (len(blocked) < self.prune_batch and not force):
+                return
+            batch = blocked[:]
+            del blocked[:]
+        if self.on_blocked:
+            try:
+                self.on_blocked(batch)
+            except Exception as e:
+                logger.error(f"Ошибка удаления пользователей из рассылки: {e}")
+
+    def run(self, chat_ids, *args, **kwargs):
+        """Отправляет одно сообщение во все чаты и возвращает BroadcastStats"""
+        chat_ids = list(dict.fromkeys(chat_ids))
+        return self._run([(chat_id, args) for chat_id in chat_ids], kwargs)
+
+    def run_messages(self, messages, **kwargs):
+        """Отправляет каждому чату свой текст из словаря {chat_id: text}"""
+        return self._run([(chat_id, (text,)) for chat_id, text in messages.items()], kwargs)
+
+    def _run(self, jobs, kwargs):
+        stats = BroadcastStats(len(jobs), self.clock)
+        blocked = []
+
+        def task(job):
+            chat_id, args = job
+            result = self._send_one(chat_id, stats, blocked, args, kwargs)
+            with self._lock:
+                setattr(stats, result, getattr(stats, result) + 1)
+                done = stats.done
+            BROADCAST_MESSAGES.inc(result=result)
+            self._flush_blocked(blocked)
+            if done % self.progress_every == 0 or done == stats.total:
+                logger.info(f"Рассылка: {done}/{stats.total}")
+                if self.on_progress:
+                    self.on_progress(stats)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for job in jobs:
+                if len(pending) >= self.workers * SUBMIT_AHEAD:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(task, job))
+            for future in wait(pending).done:
+                future.result()
+
+        self._flush_blocked(blocked, force=True)
+        self._prune_last_sent()
+        stats.finished = self.clock()
+        logger.info(f"Рассылка завершена: {stats.as_dict()}")
+        return stats
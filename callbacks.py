@@ -0,0 +1,50 @@
+"""Короткие callback_data для inline-кнопок.
+
+Вместо названий групп и фамилий в кнопку кладется вид кнопки, номер
+группы или преподавателя в отсортированном списке снимка и метка версии
+снимка, например "t:17:3fa9c2d1". Telegram ограничивает callback_data 64
+байтами, а длинные фамилии на кириллице в него не помещались.
+"""
+
+SEPARATOR = ':'
+MAX_LENGTH = 64
+
+# Виды кнопок
+GROUP = 'g'
+TEACHER = 't'
+GROUPS_PAGE = 'gp'
+TEACHERS_PAGE = 'tp'
+SUBSCRIBE_GROUP = 'sg'
+SUBSCRIBE_TEACHER = 'st'
+DAY = 'd'
+DAY_GROUPS_PAGE = 'dg'
+DAY_TEACHERS_PAGE = 'dt'
+DAY_GROUP = 'ag'
+DAY_TEACHER = 'at'
+NOOP = 'n'
+SOURCE = 'so'
+
+
+def pack(kind, *parts):
+    """Собирает callback_data из вида кнопки и ее параметров"""
+    data = SEPARATOR.join(str(part) for part in (kind,) + parts)
+    if len(data.encode('utf-8')) > MAX_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+    return data
+
+
+def unpack(data):
+    """Разбирает callback_data на вид кнопки и список параметров"""
+    kind, *parts = data.split(SEPARATOR)
+    return kind, parts
+
+
+def resolve(items, position):
+    """Элемент списка по номеру из кнопки или None"""
+    try:
+        position = int(position)
+    except (TypeError, ValueError):
+        return None
+    if 0 <= position < len(items):
+        return items[position]
+    return None
@@ -0,0 +1,123 @@
+"""Сообщения чатов для кнопки "Очистить".
+
+Бот запоминает номера последних сообщений каждого чата, входящих и своих,
+в кольцевом буфере ограниченного размера. Очистка удаляет их пачками
+через deleteMessages (до 100 номеров за вызов) в отдельном потоке
+с ограничением частоты, не занимая поток обработчика.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+import telebot
+
+from broadcast import TokenBucket, count_error, error_code, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Bot API на число сообщений в одном deleteMessages
+DELETE_BATCH = 100
+
+
+class ChatHistory:
+    """Номера последних сообщений по чатам"""
+
+    def __init__(self, per_chat=300, max_chats=20000):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, chat_id, message_id):
+        with self._lock:
+            ids = self._chats.get(chat_id)
+            if ids is None:
+                ids = self._chats[chat_id] = deque(maxlen=self.per_chat)
+                # Давно молчавшие чаты вытесняются первыми
+                while len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            else:
+                self._chats.move_to_end(chat_id)
+            ids.append(message_id)
+
+    def take(self, chat_id):
+        """Забирает номера сообщений чата, буфер чата очищается"""
+        with self._lock:
+            return list(self._chats.pop(chat_id, ()))
+
+
+class TrackingBot(telebot.TeleBot):
+    """TeleBot, который запоминает входящие и отправленные сообщения"""
+
+    def __init__(self, token, history, **kwargs):
+        super().__init__(token, **kwargs)
+        self.history = history
+
+    def process_new_messages(self, new_messages):
+        for message in new_messages:
+            self.history.remember(message.chat.id, message.message_id)
+        super().process_new_messages(new_messages)
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        message = super().send_message(chat_id, text, *args, **kwargs)
+        self.history.remember(message.chat.id, message.message_id)
+        return message
+
+
+class ChatCleaner:
+    """Фоновое удаление сообщений пачками с ограничением частоты"""
+
+    def __init__(self, delete_messages, rate=10, max_retries=3, clock=time.monotonic, sleep=time.sleep):
+        self.delete_messages = delete_messages  # обычно bot.delete_messages
+        self.bucket = TokenBucket(rate, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self._jobs = queue.Queue()
+        self._thread = None
+        self.stats = {'chats': 0, 'calls': 0, 'messages': 0, 'errors': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, name="chat-cleaner", daemon=True)
+        self._thread.start()
+
+    def clear(self, chat_id, message_ids):
+        """Ставит удаление в очередь и сразу возвращается"""
+        if message_ids:
+            self._jobs.put((chat_id, sorted(set(message_ids), reverse=True)))
+
+    def _work(self):
+        while True:
+            chat_id, message_ids = self._jobs.get()
+            try:
+                self._clear(chat_id, message_ids)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка при очистке чата {chat_id}: {e}")
+            finally:
+                self._jobs.task_done()
+
+    def _clear(self, chat_id, message_ids):
+        self.stats['chats'] += 1
+        for start in range(0, len(message_ids), DELETE_BATCH):
+            batch = message_ids[start:start + DELETE_BATCH]
+            for attempt in range(self.max_retries + 1):
+                self.bucket.acquire()
+                try:
+                    self.delete_messages(chat_id, batch)
+                    self.stats['calls'] += 1
+                    self.stats['messages'] += len(batch)
+                    break
+                except Exception as e:
+                    count_error(e, 'clear')
+                    if error_code(e) == 429 and attempt < self.max_retries:
+                        self.bucket.pause(retry_after(e) or 1)
+                        continue
+                    # Если ни одно сообщение удалить нельзя, Telegram отвечает 400
+                    self.stats['errors'] += 1
+                    logger.warning(f"Не удалось удалить сообщения в чате {chat_id}: {e}")
+                    break
+
+    def join(self):
+        """Ждет, пока очередь очистки опустеет"""
+        self._jobs.join()
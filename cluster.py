@@ -0,0 +1,816 @@
+"""Несколько процессов или узлов бота с общим состоянием.
+
+Общее состояние хранится в хранилище (SqliteBackend для одной машины,
+RedisBackend для нескольких): аренда лидерства, последний снимок замен
+каждого источника, пользователи с подписками и очередь частей рассылки.
+Подписки и выбранные источники узлы держат в памяти, а хранилище
+сообщает, чьи из них поменялись, чтобы узлы перечитали только эти чаты.
+
+Замены опрашивает только лидер - узел, который держит аренду. Аренда
+продлевается каждую треть срока; если лидер пропал, после истечения срока
+ее забирает другой узел. Лидер публикует каждый новый снимок, остальные
+узлы получают уведомление и подменяют свой снимок. Рассылку лидер режет
+на части, и их разбирают все узлы; часть, которую узел взял и не закончил,
+через visibility секунд снова становится доступной.
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SQLITE = 'sqlite'
+REDIS = 'redis'
+
+LEADER_LEASE = 'leader'
+
+# Сколько последних снимков хранить в SqliteBackend
+SNAPSHOTS_KEPT = 5
+
+# Чатов в одной части рассылки
+SHARD_SIZE = 500
+
+# Сколько последних изменений пользователей хранить в SqliteBackend
+USER_CHANGES_KEPT = 10000
+
+
+class SqliteBackend:
+    """Общее состояние в SQLite (WAL) для процессов на одной машине"""
+
+    def __init__(self, filename='cluster.db', poll_interval=0.5):
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self._conn = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS snapshots (version INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " source TEXT NOT NULL, digest TEXT NOT NULL, data TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS users (chat_id INTEGER PRIMARY KEY);"
+                "CREATE TABLE IF NOT EXISTS user_sources (chat_id INTEGER PRIMARY KEY, source TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS subscriptions (chat_id INTEGER NOT NULL, kind TEXT NOT NULL,"
+                " key TEXT NOT NULL, PRIMARY KEY (chat_id, kind, key));"
+                "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL, visible_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS user_changes (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " chat_id INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS markers (name TEXT PRIMARY KEY);"
+            )
+
+    def _write(self, func):
+        """Выполняет func(conn) в одной транзакции с блокировкой на запись"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _read(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    # Аренда
+
+    def acquire_lease(self, name, holder, ttl):
+        """Берет или продлевает аренду; False, если ее держит другой живой узел"""
+        def acquire(conn):
+            now = time.time()
+            row = conn.execute("SELECT holder, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, holder, expires) VALUES (?, ?, ?)",
+                         (name, holder, now + ttl))
+            return True
+        return self._write(acquire)
+
+    def release_lease(self, name, holder):
+        self._write(lambda conn: conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder)))
+
+    # Снимки
+
+    def publish_snapshot(self, source, digest, data):
+        """Сохраняет снимок источника и возвращает его версию"""
+        def publish(conn):
+            version = conn.execute("INSERT INTO snapshots (source, digest, data) VALUES (?, ?, ?)",
+                                   (source, digest, json.dumps(data, ensure_ascii=False))).lastrowid
+            conn.execute(
+                "DELETE FROM snapshots WHERE source = ? AND version NOT IN"
+                " (SELECT version FROM snapshots WHERE source = ? ORDER BY version DESC LIMIT ?)",
+                (source, source, SNAPSHOTS_KEPT))
+            return version
+        return self._write(publish)
+
+    def version(self):
+        return self._read("SELECT COALESCE(MAX(version), 0) FROM snapshots")[0][0]
+
+    def latest_snapshot(self, source):
+        """(версия, хэш, данные) последнего снимка источника или None"""
+        rows = self._read("SELECT version, digest, data FROM snapshots WHERE source = ?"
+                          " ORDER BY version DESC LIMIT 1", (source,))
+        if not rows:
+            return None
+        version, digest, data = rows[0]
+        return version, digest, json.loads(data)
+
+    def wait_for_change(self, version, timeout):
+        """Ждет снимка новее version; уведомлений в SQLite нет, поэтому опрашиваем"""
+        deadline = time.monotonic() + timeout
+        while True:
+            latest = self.version()
+            if latest > version or time.monotonic() >= deadline:
+                return latest
+            time.sleep(self.poll_interval)
+
+    # Отметки о разовых действиях, например о переносе пользователей узла
+
+    def has_marker(self, name):
+        return bool(self._read("SELECT 1 FROM markers WHERE name = ?", (name,)))
+
+    def set_marker(self, name):
+        self._write(lambda conn: conn.execute("INSERT OR IGNORE INTO markers (name) VALUES (?)", (name,)))
+
+    # Пользователи и подписки; методы подписок совпадают с UserStore
+
+    def add_users(self, chat_ids):
+        self._write(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO users (chat_id) VALUES (?)", ((chat_id,) for chat_id in chat_ids)))
+
+    def remove_users(self, chat_ids):
+        self._write(lambda conn: conn.executemany(
+            "DELETE FROM users WHERE chat_id = ?", ((chat_id,) for chat_id in chat_ids)))
+
+    def all_users(self):
+        return [row[0] for row in self._read("SELECT chat_id FROM users")]
+
+    @staticmethod
+    def _changed(conn, chat_ids):
+        """Записывает, что у чатов поменялись подписки или источник"""
+        last = None
+        for chat_id in chat_ids:
+            last = conn.execute("INSERT INTO user_changes (chat_id) VALUES (?)", (chat_id,)).lastrowid
+        if last is not None:
+            conn.execute("DELETE FROM user_changes WHERE id <= ?", (last - USER_CHANGES_KEPT,))
+
+    def set_user_source(self, chat_id, source):
+        def set_source(conn):
+            conn.execute("INSERT OR REPLACE INTO user_sources (chat_id, source) VALUES (?, ?)", (chat_id, source))
+            self._changed(conn, [chat_id])
+        self._write(set_source)
+
+    def user_source(self, chat_id):
+        rows = self._read("SELECT source FROM user_sources WHERE chat_id = ?", (chat_id,))
+        return rows[0][0] if rows else None
+
+    def user_sources(self):
+        return dict(self._read("SELECT chat_id, source FROM user_sources"))
+
+    def load_subscriptions(self):
+        return self._read("SELECT chat_id, kind, key FROM subscriptions")
+
+    def subscriptions_of(self, chat_id):
+        return self._read("SELECT kind, key FROM subscriptions WHERE chat_id = ?", (chat_id,))
+
+    def add_subscription(self, chat_id, kind, key):
+        def add(conn):
+            if conn.execute("INSERT OR IGNORE INTO subscriptions (chat_id, kind, key) VALUES (?, ?, ?)",
+                            (chat_id, kind, key)).rowcount:
+                self._changed(conn, [chat_id])
+        self._write(add)
+
+    def remove_subscription(self, chat_id, kind, key):
+        def remove(conn):
+            if conn.execute("DELETE FROM subscriptions WHERE chat_id = ? AND kind = ? AND key = ?",
+                            (chat_id, kind, key)).rowcount:
+                self._changed(conn, [chat_id])
+        self._write(remove)
+
+    def toggle_subscription(self, chat_id, kind, key):
+        """Включает или выключает подписку; True, если она включена"""
+        def toggle(conn):
+            removed = conn.execute("DELETE FROM subscriptions WHERE chat_id = ? AND kind = ? AND key = ?",
+                                   (chat_id, kind, key)).rowcount
+            if not removed:
+                conn.execute("INSERT INTO subscriptions (chat_id, kind, key) VALUES (?, ?, ?)",
+                             (chat_id, kind, key))
+            self._changed(conn, [chat_id])
+            return not removed
+        return self._write(toggle)
+
+    def remove_subscriptions_of(self, chat_ids):
+        chat_ids = list(chat_ids)
+
+        def remove(conn):
+            conn.executemany("DELETE FROM subscriptions WHERE chat_id = ?", ((chat_id,) for chat_id in chat_ids))
+            self._changed(conn, chat_ids)
+        self._write(remove)
+
+    def user_changes_cursor(self):
+        """Метка, начиная с которой wait_for_user_changes вернет изменения"""
+        return self._read("SELECT COALESCE(MAX(id), 0) FROM user_changes")[0][0]
+
+    def wait_for_user_changes(self, cursor, timeout):
+        """(новая метка, чаты с изменениями после cursor).
+
+        Вместо списка чатов возвращает None, если часть изменений уже
+        удалена и узлу нужно перечитать всех пользователей.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            rows = self._read("SELECT id, chat_id FROM user_changes WHERE id > ? ORDER BY id", (cursor,))
+            if rows:
+                # Номера идут подряд, пропуск значит, что старые изменения удалены
+                if rows[0][0] > cursor + 1:
+                    return rows[-1][0], None
+                return rows[-1][0], list(dict.fromkeys(chat_id for _, chat_id in rows))
+            if time.monotonic() >= deadline:
+                return cursor, []
+            time.sleep(self.poll_interval)
+
+    # Очередь частей рассылки
+
+    def push_tasks(self, payloads):
+        self._write(lambda conn: conn.executemany(
+            "INSERT INTO tasks (payload, visible_at) VALUES (?, 0)",
+            ((json.dumps(payload, ensure_ascii=False),) for payload in payloads)))
+
+    def claim_task(self, visibility):
+        """(номер, данные) доступной части или None; часть скрывается на visibility секунд"""
+        def claim(conn):
+            now = time.time()
+            row = conn.execute("SELECT id, payload FROM tasks WHERE visible_at <= ? ORDER BY id LIMIT 1",
+                               (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET visible_at = ? WHERE id = ?", (now + visibility, row[0]))
+            return row[0], json.loads(row[1])
+        return self._write(claim)
+
+    def complete_task(self, task_id):
+        self._write(lambda conn: conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,)))
+
+    def pending_tasks(self):
+        return self._read("SELECT COUNT(*) FROM tasks")[0][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisBackend:
+    """Общее состояние в Redis или совместимом хранилище.
+
+    client - готовый клиент с интерфейсом redis-py, например заглушка для
+    локального запуска; без него клиент создается по url. Пакет redis
+    нужен только в этом случае и импортируется здесь же.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='replacements_bot:', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._pubsub = None
+        self._users_pubsub = None
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def _compare_and(self, key, holder, action):
+        """Выполняет action(pipe), только если ключ все еще принадлежит holder"""
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if _text(pipe.get(key)) != holder:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                action(pipe)
+                pipe.execute()
+                return True
+            except Exception as e:
+                # WatchError: ключ изменился между проверкой и записью
+                logger.debug(f"Аренда {key} изменилась во время продления: {e}")
+                return False
+
+    def acquire_lease(self, name, holder, ttl):
+        key = self._key('lease:' + name)
+        milliseconds = int(ttl * 1000)
+        if self.client.set(key, holder, nx=True, px=milliseconds):
+            return True
+        return self._compare_and(key, holder, lambda pipe: pipe.pexpire(key, milliseconds))
+
+    def release_lease(self, name, holder):
+        key = self._key('lease:' + name)
+        self._compare_and(key, holder, lambda pipe: pipe.delete(key))
+
+    def _transaction(self, keys, body, attempts=5):
+        """Выполняет body(pipe) под WATCH keys одной транзакцией MULTI/EXEC.
+
+        body читает через pipe, затем вызывает pipe.multi() и ставит команды
+        записи; None значит, что писать нечего. Если ключи поменял другой
+        узел, транзакция повторяется.
+        """
+        for attempt in range(attempts):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(*keys)
+                    result = body(pipe)
+                    if result is not None:
+                        pipe.execute()
+                    return result
+                except Exception as e:
+                    # WatchError: ключи изменились между чтением и записью
+                    if attempt == attempts - 1:
+                        raise
+                    logger.debug(f"Транзакция с {', '.join(keys)} повторяется: {e}")
+
+    def publish_snapshot(self, source, digest, data):
+        """Сохраняет снимок источника и возвращает его версию.
+
+        Счетчик версий, снимок и уведомление пишутся одной транзакцией:
+        узел не увидит новую версию раньше самого снимка.
+        """
+        version_key = self._key('version')
+
+        def publish(pipe):
+            version = int(pipe.get(version_key) or 0) + 1
+            payload = json.dumps({'version': version, 'digest': digest, 'data': data}, ensure_ascii=False)
+            pipe.multi()
+            pipe.set(version_key, version)
+            pipe.set(self._key('snapshot:' + source), payload)
+            pipe.publish(self._key('changes'), version)
+            return version
+        return self._transaction([version_key], publish)
+
+    def version(self):
+        return int(self.client.get(self._key('version')) or 0)
+
+    def latest_snapshot(self, source):
+        payload = self.client.get(self._key('snapshot:' + source))
+        if not payload:
+            return None
+        snapshot = json.loads(payload)
+        return snapshot['version'], snapshot['digest'], snapshot['data']
+
+    def wait_for_change(self, version, timeout):
+        """Ждет уведомления о новом снимке через pub/sub"""
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(self._key('changes'))
+        deadline = time.monotonic() + timeout
+        while True:
+            # Версию проверяем и после подписки: уведомление могло прийти раньше
+            latest = self.version()
+            remaining = deadline - time.monotonic()
+            if latest > version or remaining <= 0:
+                return latest
+            self._pubsub.get_message(timeout=min(remaining, 5))
+
+    def has_marker(self, name):
+        return bool(self.client.sismember(self._key('markers'), name))
+
+    def set_marker(self, name):
+        self.client.sadd(self._key('markers'), name)
+
+    def add_users(self, chat_ids):
+        chat_ids = list(chat_ids)
+        if chat_ids:
+            self.client.sadd(self._key('users'), *chat_ids)
+
+    def remove_users(self, chat_ids):
+        chat_ids = list(chat_ids)
+        if chat_ids:
+            self.client.srem(self._key('users'), *chat_ids)
+
+    def all_users(self):
+        return [int(chat_id) for chat_id in self.client.smembers(self._key('users'))]
+
+    def _changed(self, pipe, chat_ids):
+        """Сообщает узлам, что у чатов поменялись подписки или источник"""
+        for chat_id in chat_ids:
+            pipe.publish(self._key('user_changes'), chat_id)
+
+    def set_user_source(self, chat_id, source):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key('user_sources'), chat_id, source)
+        self._changed(pipe, [chat_id])
+        pipe.execute()
+
+    def user_source(self, chat_id):
+        return _text(self.client.hget(self._key('user_sources'), chat_id))
+
+    def user_sources(self):
+        return {int(chat_id): _text(source)
+                for chat_id, source in self.client.hgetall(self._key('user_sources')).items()}
+
+    # Подписка хранится строкой "chat_id kind key" в одном множестве
+
+    def load_subscriptions(self):
+        result = []
+        for member in self.client.smembers(self._key('subscriptions')):
+            chat_id, kind, key = _text(member).split(' ', 2)
+            result.append((int(chat_id), kind, key))
+        return result
+
+    def subscriptions_of(self, chat_id):
+        result = []
+        for member in self.client.sscan_iter(self._key('subscriptions'), match=f"{chat_id} *"):
+            _, kind, key = _text(member).split(' ', 2)
+            result.append((kind, key))
+        return result
+
+    def add_subscription(self, chat_id, kind, key):
+        pipe = self.client.pipeline()
+        pipe.sadd(self._key('subscriptions'), f"{chat_id} {kind} {key}")
+        self._changed(pipe, [chat_id])
+        pipe.execute()
+
+    def remove_subscription(self, chat_id, kind, key):
+        pipe = self.client.pipeline()
+        pipe.srem(self._key('subscriptions'), f"{chat_id} {kind} {key}")
+        self._changed(pipe, [chat_id])
+        pipe.execute()
+
+    def toggle_subscription(self, chat_id, kind, key):
+        """Включает или выключает подписку; True, если она включена"""
+        member = f"{chat_id} {kind} {key}"
+        pipe = self.client.pipeline()
+        # srem удается только одному из одновременных нажатий
+        subscribed = not self.client.srem(self._key('subscriptions'), member)
+        if subscribed:
+            pipe.sadd(self._key('subscriptions'), member)
+        self._changed(pipe, [chat_id])
+        pipe.execute()
+        return subscribed
+
+    def remove_subscriptions_of(self, chat_ids):
+        # Подписок немного и удаляют их редко, поэтому просто перебираем множество
+        chat_ids = set(chat_ids)
+        members = [f"{chat_id} {kind} {key}" for chat_id, kind, key in self.load_subscriptions()
+                   if chat_id in chat_ids]
+        pipe = self.client.pipeline()
+        if members:
+            pipe.srem(self._key('subscriptions'), *members)
+        self._changed(pipe, chat_ids)
+        pipe.execute()
+
+    def user_changes_cursor(self):
+        """Подписывается на изменения пользователей; метка в Redis не нужна"""
+        if self._users_pubsub is None:
+            self._users_pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._users_pubsub.subscribe(self._key('user_changes'))
+        return 0
+
+    def wait_for_user_changes(self, cursor, timeout):
+        """(cursor, чаты с изменениями) по уведомлениям pub/sub"""
+        self.user_changes_cursor()
+        chat_ids = []
+        message = self._users_pubsub.get_message(timeout=timeout)
+        while message is not None:
+            if message.get('type') == 'message':
+                chat_ids.append(int(message['data']))
+            message = self._users_pubsub.get_message(timeout=0)
+        return cursor, list(dict.fromkeys(chat_ids))
+
+    def push_tasks(self, payloads):
+        pipe = self.client.pipeline()
+        for payload in payloads:
+            task_id = self.client.incr(self._key('task_id'))
+            pipe.hset(self._key('tasks'), task_id, json.dumps(payload, ensure_ascii=False))
+            pipe.rpush(self._key('queue'), task_id)
+        pipe.execute()
+
+    def claim_task(self, visibility):
+        """Берет часть из очереди; снятие с очереди и срок видимости пишутся
+        одной транзакцией, поэтому часть не теряется, если узел упал между ними"""
+        now = time.time()
+        queue, claimed = self._key('queue'), self._key('claimed')
+
+        # Части, которые узел взял и не закончил, возвращаются в очередь;
+        # под WATCH вернуть часть удается только одному узлу
+        for task_id in self.client.zrangebyscore(claimed, 0, now):
+            def requeue(pipe, task_id=task_id):
+                score = pipe.zscore(claimed, task_id)
+                if score is None or score > now:
+                    return None
+                pipe.multi()
+                pipe.zrem(claimed, task_id)
+                pipe.lpush(queue, task_id)
+                return task_id
+            self._transaction([claimed], requeue)
+
+        def claim(pipe):
+            task_id = pipe.lindex(queue, 0)
+            if task_id is None:
+                return None
+            pipe.multi()
+            pipe.lpop(queue)
+            pipe.zadd(claimed, {task_id: now + visibility})
+            return task_id
+
+        task_id = self._transaction([queue], claim)
+        if task_id is None:
+            return None
+        payload = self.client.hget(self._key('tasks'), task_id)
+        if payload is None:
+            self.client.zrem(claimed, task_id)
+            return None
+        return int(task_id), json.loads(payload)
+
+    def complete_task(self, task_id):
+        pipe = self.client.pipeline()
+        pipe.zrem(self._key('claimed'), task_id)
+        pipe.hdel(self._key('tasks'), task_id)
+        pipe.execute()
+
+    def pending_tasks(self):
+        return self.client.hlen(self._key('tasks'))
+
+    def close(self):
+        for pubsub in (self._pubsub, self._users_pubsub):
+            if pubsub is not None:
+                pubsub.close()
+
+
+def make_backend(kind, filename='cluster.db', url='redis://localhost:6379/0'):
+    """Хранилище по названию: sqlite или redis"""
+    if kind == SQLITE:
+        return SqliteBackend(filename)
+    if kind == REDIS:
+        return RedisBackend(url)
+    raise ValueError(f"Неизвестное хранилище кластера: {kind}")
+
+
+class ClusterNode:
+    """Узел кластера: аренда лидерства, снимки от лидера и изменения пользователей.
+
+    stores - хранилища снимков по именам источников.
+    """
+
+    def __init__(self, backend, stores, node_id=None, lease_ttl=30, change_timeout=30):
+        self.backend = backend
+        self.stores = stores
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self.change_timeout = change_timeout
+        self.leader = threading.Event()
+        self._valid_until = 0
+        self._version = 0
+        self._applied = {}  # источник -> версия последнего принятого или опубликованного снимка
+        self._users_cursor = 0
+        self._user_listeners = []
+        self._stop = threading.Event()
+
+    def is_leader(self):
+        return self.leader.is_set()
+
+    def subscribe_users(self, listener):
+        """Регистрирует функцию, которая вызывается при изменении пользователей.
+
+        Функция получает чаты, чьи подписки или источник поменялись на любом
+        узле, или None, если перечитать нужно всех.
+        """
+        self._user_listeners.append(listener)
+
+    def start(self):
+        # Изменения пользователей отслеживаем до того, как узел начнет их читать
+        self._users_cursor = self.backend.user_changes_cursor()
+        self._renew()
+        for target, name in ((self._lease_loop, "cluster-lease"), (self._follow_loop, "cluster-follow"),
+                             (self._users_loop, "cluster-users")):
+            threading.Thread(target=target, name=name, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self.leader.is_set():
+            self.leader.clear()
+            try:
+                self.backend.release_lease(LEADER_LEASE, self.node_id)
+            except Exception as e:
+                logger.warning(f"Не удалось освободить аренду лидера: {e}")
+
+    def _renew(self):
+        started = time.monotonic()
+        try:
+            held = self.backend.acquire_lease(LEADER_LEASE, self.node_id, self.lease_ttl)
+        except Exception as e:
+            logger.error(f"Ошибка продления аренды лидера: {e}")
+            # Без связи с хранилищем остаемся лидером, пока аренда точно наша
+            held = self.leader.is_set() and time.monotonic() < self._valid_until
+        else:
+            if held:
+                # Запас на случай, если часы узлов и хранилища немного расходятся
+                self._valid_until = started + self.lease_ttl * 0.8
+
+        if held and not self.leader.is_set():
+            self._take_over()
+            self.leader.set()
+            logger.info(f"Узел {self.node_id} стал лидером")
+        elif not held and self.leader.is_set():
+            self.leader.clear()
+            logger.warning(f"Узел {self.node_id} больше не лидер")
+
+    def _take_over(self):
+        """Сверяет снимки с общими перед тем, как начать опрос замен"""
+        for source, store in self.stores.items():
+            try:
+                latest = self.backend.latest_snapshot(source)
+                current = store.current()
+                if (latest and latest[0] > self._applied.get(source, 0)
+                        and (current is None or current.digest != latest[1])):
+                    # Прошлый лидер успел опубликовать снимок новее нашего
+                    self._applied[source] = latest[0]
+                    store.swap(latest[2])
+                elif current is not None and (latest is None or latest[1] != current.digest):
+                    # Общего снимка еще нет, например при первом запуске кластера
+                    self._applied[source] = self.backend.publish_snapshot(
+                        source, current.digest, current.to_dict())
+            except Exception as e:
+                logger.error(f"Ошибка сверки снимка {source} при смене лидера: {e}")
+
+    def _lease_loop(self):
+        while not self._stop.wait(self.lease_ttl / 3):
+            self._renew()
+
+    def publish(self, snapshot):
+        """Обработчик подмены снимка: лидер рассылает снимок остальным узлам"""
+        if not self.leader.is_set():
+            return
+        try:
+            version = self.backend.publish_snapshot(snapshot.source, snapshot.digest, snapshot.to_dict())
+            self._applied[snapshot.source] = version
+            logger.info(f"Снимок {snapshot.source}/{snapshot.token} опубликован как версия {version}")
+        except Exception as e:
+            logger.error(f"Ошибка публикации снимка: {e}")
+
+    def _follow_loop(self):
+        while not self._stop.is_set():
+            try:
+                version = self.backend.wait_for_change(self._version, self.change_timeout)
+                if version <= self._version:
+                    continue
+                # Версию берем из тех же чтений, что и снимки, а не из счетчика:
+                # иначе снимок, записанный позже счетчика, был бы пропущен
+                seen = self._version
+                for source, store in self.stores.items():
+                    latest = self.backend.latest_snapshot(source)
+                    if latest is None:
+                        continue
+                    seen = max(seen, latest[0])
+                    if latest[0] <= self._applied.get(source, 0):
+                        continue
+                    self._applied[source], digest, data = latest
+                    current = store.current()
+                    if current is None or current.digest != digest:
+                        logger.info(f"Получен снимок {source} версии {latest[0]} от лидера")
+                        store.swap(data)
+                self._version = seen
+                if seen < version:
+                    # Счетчик впереди снимков этого узла, например источник есть только у лидера
+                    self._stop.wait(1)
+            except Exception as e:
+                logger.error(f"Ошибка получения снимка от лидера: {e}")
+                self._stop.wait(5)
+
+    def _users_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._users_cursor, chat_ids = self.backend.wait_for_user_changes(
+                    self._users_cursor, self.change_timeout)
+            except Exception as e:
+                logger.error(f"Ошибка получения изменений пользователей: {e}")
+                # Уведомления могли потеряться, перечитываем всех
+                chat_ids = None
+                self._stop.wait(5)
+            if chat_ids == []:
+                continue
+            for listener in self._user_listeners:
+                try:
+                    listener(chat_ids)
+                except Exception as e:
+                    logger.error(f"Ошибка обработчика изменений пользователей: {e}")
+
+
+class SharedUserSources:
+    """Выбранные пользователями источники в общем хранилище с кэшем в памяти.
+
+    Методы совпадают с UserStore. Кэш сбрасывает invalidate, который
+    ClusterNode вызывает по изменениям с других узлов.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._sources = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def source_of(self, chat_id):
+        with self._lock:
+            if chat_id in self._sources:
+                return self._sources[chat_id]
+            generation = self._generation
+        source = self.backend.user_source(chat_id)
+        with self._lock:
+            # Пока читали, выбор могли поменять: тогда не кэшируем прочитанное
+            if generation == self._generation:
+                self._sources[chat_id] = source
+        return source
+
+    def set_source(self, chat_id, source):
+        self.backend.set_user_source(chat_id, source)
+        with self._lock:
+            self._generation += 1
+            self._sources[chat_id] = source
+
+    def user_sources(self):
+        return self.backend.user_sources()
+
+    def invalidate(self, chat_ids):
+        with self._lock:
+            self._generation += 1
+            if chat_ids is None:
+                self._sources = {}
+            for chat_id in chat_ids or ():
+                self._sources.pop(chat_id, None)
+
+
+class ShardedBroadcast:
+    """Рассылка частями через общую очередь, части разбирают все узлы"""
+
+    def __init__(self, backend, broadcaster, shard_size=SHARD_SIZE, visibility=600, idle_interval=1.0):
+        self.backend = backend
+        self.broadcaster = broadcaster
+        self.shard_size = shard_size
+        self.visibility = visibility
+        self.idle_interval = idle_interval
+        self._stop = threading.Event()
+        self.stats = {'shards': 0, 'messages': 0, 'errors': 0}
+
+    def submit(self, chat_ids=None, text=None, messages=None, reply_markup=None):
+        """Ставит рассылку в очередь: один текст для chat_ids или свой текст каждому из messages"""
+        if messages is not None:
+            items = [[chat_id, message] for chat_id, message in messages.items()]
+        else:
+            items = list(dict.fromkeys(chat_ids))
+        payloads = []
+        for start in range(0, len(items), self.shard_size):
+            part = items[start:start + self.shard_size]
+            payload = {'messages': part} if messages is not None else {'chat_ids': part, 'text': text}
+            payload['reply_markup'] = reply_markup
+            payloads.append(payload)
+        if payloads:
+            self.backend.push_tasks(payloads)
+        logger.info(f"Рассылка на {len(items)} чатов поставлена в очередь частями: {len(payloads)}")
+        return len(payloads)
+
+    def start(self):
+        threading.Thread(target=self._work, name="broadcast-shards", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                task = self.backend.claim_task(self.visibility)
+            except Exception as e:
+                logger.error(f"Ошибка получения части рассылки: {e}")
+                task = None
+            if task is None:
+                self._stop.wait(self.idle_interval)
+                continue
+
+            task_id, payload = task
+            try:
+                self.run(payload)
+                self.backend.complete_task(task_id)
+            except Exception as e:
+                # Часть вернется в очередь после visibility и ее доотправит другой узел
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка части рассылки {task_id}: {e}")
+
+    def run(self, payload):
+        kwargs = {'reply_markup': payload['reply_markup']} if payload.get('reply_markup') else {}
+        if 'messages' in payload:
+            stats = self.broadcaster.run_messages(dict(payload['messages']), **kwargs)
+        else:
+            stats = self.broadcaster.run(payload['chat_ids'], payload['text'], **kwargs)
+        self.stats['shards'] += 1
+        self.stats['messages'] += stats.sent
+        return stats
@@ -0,0 +1,78 @@
+def _keyed_rows(replacements):
+    """Строки группы по номеру урока; повторы одного урока нумеруются"""
+    rows = {}
+    for replacement in replacements:
+        pair = replacement.pair
+        occurrence = 0
+        while (pair, occurrence) in rows:
+            occurrence += 1
+        rows[(pair, occurrence)] = replacement
+    return rows
+
+
+class GroupChanges:
+    """Изменения замен одной группы"""
+
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []  # пары (было, стало)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def teachers(self):
+        """Преподаватели, которых касаются изменения"""
+        rows = self.added + self.removed + [row for pair in self.changed for row in pair]
+        return {row.teacher for row in rows if row.teacher}
+
+
+class SnapshotDiff:
+    """Построчная разница двух снимков замен.
+
+    Замены другого дня не сравниваются со старыми: при смене даты разница
+    считается от пустого снимка, и все строки нового дня попадают в added.
+    """
+
+    def __init__(self, old_data, new_data):
+        self.date_changed = (old_data or {}).get('date') != (new_data or {}).get('date')
+        old_groups = {} if self.date_changed else (old_data or {}).get('groups') or {}
+        new_groups = (new_data or {}).get('groups') or {}
+        self.groups = {}
+
+        for group_number in set(old_groups) | set(new_groups):
+            old_rows = _keyed_rows(old_groups.get(group_number, ()))
+            new_rows = _keyed_rows(new_groups.get(group_number, ()))
+            changes = GroupChanges()
+            for key in sorted(set(old_rows) | set(new_rows), key=_pair_order):
+                old_row = old_rows.get(key)
+                new_row = new_rows.get(key)
+                if old_row is None:
+                    changes.added.append(new_row)
+                elif new_row is None:
+                    changes.removed.append(old_row)
+                elif old_row.fields() != new_row.fields():
+                    changes.changed.append((old_row, new_row))
+            if changes:
+                self.groups[group_number] = changes
+
+        # Инвертированный индекс: преподаватель -> группы с изменениями
+        self.teachers = {}
+        for group_number, changes in self.groups.items():
+            for teacher in changes.teachers():
+                self.teachers.setdefault(teacher, []).append(group_number)
+
+    def __bool__(self):
+        return bool(self.groups)
+
+
+def _pair_order(key):
+    pair, occurrence = key
+    return (int(pair) if pair.isdigit() else float('inf'), pair, occurrence)
+
+
+def diff_snapshots(old_data, new_data):
+    """Возвращает SnapshotDiff между старыми и новыми данными"""
+    return SnapshotDiff(old_data, new_data)
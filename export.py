@@ -0,0 +1,376 @@
+"""HTTP-выгрузка текущих замен только для чтения.
+
+Отдает уже разобранный снимок, чтобы веб-страница и экраны в колледже не
+ходили на rep.spb-kit.ru и не разбирали таблицу сами:
+
+    /api/replacements.json      весь снимок
+    /api/groups.json            список групп, /api/teachers.json - преподавателей
+    /api/groups/<номер>.json    замены группы, .ics - календарь
+    /api/teachers/<ФИО>.json    замены преподавателя, .ics - календарь
+    /api/sources/<имя>/...      то же для отдельного источника замен
+
+Тело каждого ответа собирается и сжимается gzip один раз на версию снимка.
+Сильный ETag считается по телу, поэтому If-None-Match отвечает 304 без
+повторной отправки данных.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EXPORT_REQUESTS = metrics.counter('export_requests', "Запросы к выгрузке замен по статусу", ('status',))
+
+API_PREFIX = '/api'
+
+# Время пар по звонкам колледжа: номер пары -> (начало, конец)
+DEFAULT_PAIR_TIMES = {
+    1: ("08:30", "10:00"),
+    2: ("10:10", "11:40"),
+    3: ("12:10", "13:40"),
+    4: ("13:50", "15:20"),
+    5: ("15:30", "17:00"),
+    6: ("17:10", "18:40"),
+    7: ("18:50", "20:20"),
+}
+TIMEZONE = "Europe/Moscow"
+
+
+def parse_pair_times(value):
+    """Время пар из строки "1=08:30-10:00,2=10:10-11:40" или словаря
+    {"1": ["08:30", "10:00"]} из sources.json"""
+    if isinstance(value, str):
+        value = dict(item.split('=', 1) for item in value.replace(' ', '').split(',') if item)
+    pair_times = {}
+    for pair, times in value.items():
+        if isinstance(times, str):
+            times = times.split('-')
+        start, end = times
+        if not (re.fullmatch(r'\d\d:\d\d', start) and re.fullmatch(r'\d\d:\d\d', end)):
+            raise ValueError(f"Время пары {pair} должно быть вида ЧЧ:ММ-ЧЧ:ММ: {start}-{end}")
+        pair_times[int(pair)] = (start, end)
+    return pair_times
+
+
+# Другие звонки задаются переменной окружения PAIR_TIMES в том же формате,
+# для отдельного источника - полем pair_times в sources.json
+PAIR_TIMES = parse_pair_times(os.environ['PAIR_TIMES']) if os.environ.get('PAIR_TIMES') else DEFAULT_PAIR_TIMES
+
+# Клиенты могут не спрашивать сервер минуту
+CACHE_CONTROL = "public, max-age=60"
+
+JSON_TYPE = 'application/json; charset=utf-8'
+ICAL_TYPE = 'text/calendar; charset=utf-8'
+
+
+def replacement_item(replacement, group_number=None):
+    """Строка замены для JSON с посчитанными номером пары и статусами"""
+    item = replacement.to_dict()
+    item.update(
+        pair_num=replacement.pair_num,
+        cancelled=replacement.cancelled,
+        moved=replacement.moved,
+        remote=replacement.remote,
+    )
+    if group_number or replacement.group_number:
+        item['group'] = group_number or replacement.group_number
+    return item
+
+
+def _ical_text(value):
+    """Экранирование текста по RFC 5545"""
+    return (value.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Перенос длинных строк календаря: не больше 75 байт в строке"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(encoded):
+        end = min(start + (75 if not parts else 74), len(encoded))
+        # Не разрезаем многобайтовый символ
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start = end
+    return "\r\n ".join(parts)
+
+
+def build_calendar(snapshot, name, rows, pair_times=None):
+    """Календарь iCalendar с заменами одного дня"""
+    pair_times = pair_times or PAIR_TIMES
+    try:
+        day = date.fromisoformat(snapshot.date)
+    except (TypeError, ValueError):
+        day = None
+    # Метка от даты замен, а не от времени загрузки: после перезапуска тело и ETag те же
+    stamp = f"{day:%Y%m%d}T000000Z" if day else ""
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//spb-kit//replacements-bot//RU",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_ical_text('Замены ' + name)}",
+        f"X-WR-TIMEZONE:{TIMEZONE}",
+        # Москва живет без перехода на летнее время, хватает одного смещения
+        "BEGIN:VTIMEZONE",
+        f"TZID:{TIMEZONE}",
+        "BEGIN:STANDARD",
+        "DTSTART:19700101T000000",
+        "TZOFFSETFROM:+0300",
+        "TZOFFSETTO:+0300",
+        "TZNAME:MSK",
+        "END:STANDARD",
+        "END:VTIMEZONE",
+    ]
+    for replacement in rows if day else ():
+        times = pair_times.get(replacement.pair_num)
+        if not times:
+            continue
+        if replacement.cancelled:
+            summary = f"Отмена: {replacement.original_subject}"
+        elif replacement.moved:
+            summary = f"Перенос: {replacement.original_subject}"
+        else:
+            summary = replacement.new_subject or replacement.original_subject
+        description = f"Группа {replacement.group_number}" if replacement.group_number else ""
+        if replacement.teacher and not (replacement.cancelled or replacement.moved):
+            description = f"{description}\n{replacement.teacher}".strip()
+        location = "Дистанционно" if replacement.remote else replacement.classroom
+        start, end = (time.replace(':', '') for time in times)
+        # UID не меняется между версиями снимка, и календарь обновляет событие, а не дублирует
+        uid = hashlib.sha1(f"{name}|{replacement.group_number}|{replacement.pair}".encode('utf-8')).hexdigest()[:16]
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{day:%Y%m%d}-{uid}@replacements-bot",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;TZID={TIMEZONE}:{day:%Y%m%d}T{start}00",
+            f"DTEND;TZID={TIMEZONE}:{day:%Y%m%d}T{end}00",
+            f"SUMMARY:{_ical_text(summary)}",
+        ]
+        if description:
+            lines.append(f"DESCRIPTION:{_ical_text(description)}")
+        if location:
+            lines.append(f"LOCATION:{_ical_text(location)}")
+        if replacement.cancelled:
+            lines.append("STATUS:CANCELLED")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+class ExportBody:
+    """Готовый ответ: тело, его gzip и сильные ETag для обоих вариантов"""
+
+    __slots__ = ('content_type', 'body', 'gzipped', 'etag', 'gzip_etag')
+
+    def __init__(self, content_type, text):
+        self.content_type = content_type
+        self.body = text.encode('utf-8')
+        # mtime=0, чтобы одинаковое тело всегда сжималось одинаково
+        self.gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        digest = hashlib.sha1(self.body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+
+
+class ExportCache:
+    """Ответы выгрузки для одного снимка, сбрасываются при подмене снимка"""
+
+    def __init__(self, store, pair_times=None):
+        self.store = store
+        self.pair_times = pair_times  # None - время пар по умолчанию
+        self._digest = None
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def on_swap(self, snapshot):
+        with self._lock:
+            self._digest = snapshot.digest
+            self._bodies = {}
+
+    def get(self, path):
+        """ExportBody для пути или None, если такого ресурса нет"""
+        snapshot = self.store.current()
+        if snapshot is None:
+            return None
+        with self._lock:
+            if self._digest != snapshot.digest:
+                self._digest = snapshot.digest
+                self._bodies = {}
+            bodies = self._bodies
+        body = bodies.get(path)
+        if body is None:
+            body = self._build(snapshot, path)
+            if body is None:
+                return None
+            # Два одновременных запроса могут собрать тело дважды, сохранится одно
+            body = bodies.setdefault(path, body)
+        return body
+
+    def _build(self, snapshot, path):
+        index = snapshot.index
+        if path == '/replacements.json':
+            return self._json({
+                'date': snapshot.date,
+                'raw_date': snapshot.data.get('raw_date'),
+                'version': snapshot.digest,
+                'groups': {
+                    group_number: [replacement_item(row) for row in snapshot.data['groups'][group_number]]
+                    for group_number in index.groups
+                },
+            })
+        if path == '/groups.json':
+            return self._json(list(index.groups))
+        if path == '/teachers.json':
+            return self._json(list(index.teachers))
+
+        kind, _, name = path[1:].partition('/')
+        name, dot, extension = name.rpartition('.')
+        name = unquote(name)
+        if not dot or extension not in ('json', 'ics'):
+            return None
+        if kind == 'groups' and name in index.group_pairs:
+            rows = [replacement.with_group(name) for _, replacement in index.group_pairs[name]]
+            title = f"группы {name}"
+        elif kind == 'teachers' and name in index.teachers:
+            rows = [replacement for _, replacement in index.teacher_pairs[name]]
+            title = name
+        else:
+            return None
+
+        if extension == 'ics':
+            return ExportBody(ICAL_TYPE, build_calendar(snapshot, title, rows, self.pair_times))
+        return self._json({
+            'date': snapshot.date,
+            'raw_date': snapshot.data.get('raw_date'),
+            'version': snapshot.digest,
+            'name': name,
+            'replacements': [replacement_item(row) for row in rows],
+        })
+
+    @staticmethod
+    def _json(value):
+        return ExportBody(JSON_TYPE, json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+
+
+def etag_matches(header, body):
+    """Есть ли ETag ответа в If-None-Match"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return body.etag in tags or body.gzip_etag in tags
+
+
+def accepts_gzip(header):
+    for coding in (header or '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+class ExportServer:
+    """HTTP-сервер выгрузки замен; каждый запрос в своем потоке"""
+
+    def __init__(self, cache, host='127.0.0.1', port=8080, prefix=API_PREFIX, sources=None):
+        self.cache = cache
+        self.sources = sources or {}  # имя источника -> ExportCache
+        self.prefix = prefix
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.respond(self, send_body=True)
+
+            def do_HEAD(self):
+                server.respond(self, send_body=False)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, request, send_body):
+        path = urlsplit(request.path).path
+        body = None
+        if path.startswith(self.prefix + '/'):
+            cache, path = self.cache, path[len(self.prefix):]
+            if path.startswith('/sources/'):
+                name, _, rest = path[len('/sources/'):].partition('/')
+                cache, path = self.sources.get(unquote(name)), '/' + rest
+            try:
+                body = cache.get(path) if cache else None
+            except Exception as e:
+                logger.error(f"Ошибка сборки ответа выгрузки {path}: {e}")
+                return self._empty(request, 500)
+        if body is None:
+            return self._empty(request, 404)
+
+        use_gzip = accepts_gzip(request.headers.get('Accept-Encoding'))
+        etag = body.gzip_etag if use_gzip else body.etag
+        if etag_matches(request.headers.get('If-None-Match'), body):
+            EXPORT_REQUESTS.inc(status='304')
+            request.send_response(304)
+            self._cache_headers(request, etag)
+            request.end_headers()
+            return
+
+        payload = body.gzipped if use_gzip else body.body
+        EXPORT_REQUESTS.inc(status='200')
+        request.send_response(200)
+        request.send_header('Content-Type', body.content_type)
+        if use_gzip:
+            request.send_header('Content-Encoding', 'gzip')
+        request.send_header('Content-Length', str(len(payload)))
+        self._cache_headers(request, etag)
+        request.end_headers()
+        if send_body:
+            request.wfile.write(payload)
+
+    @staticmethod
+    def _cache_headers(request, etag):
+        request.send_header('ETag', etag)
+        request.send_header('Cache-Control', CACHE_CONTROL)
+        request.send_header('Vary', 'Accept-Encoding')
+        # Страница Studi может открываться с другого адреса
+        request.send_header('Access-Control-Allow-Origin', '*')
+
+    @staticmethod
+    def _empty(request, status):
+        EXPORT_REQUESTS.inc(status=str(status))
+        request.send_response(status)
+        request.send_header('Content-Length', '0')
+        request.end_headers()
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="export", daemon=True).start()
+        logger.info(f"Выгрузка замен доступна на {self.address[0]}:{self.address[1]}{self.prefix}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
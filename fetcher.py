@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class FetchResult:
+    """Ответ сервера замен и признак того, что содержимое изменилось"""
+
+    __slots__ = ('content', 'changed', 'digest')
+
+    def __init__(self, content, changed, digest):
+        self.content = content
+        self.changed = changed
+        self.digest = digest
+
+
+class Fetcher:
+    """Получение страницы замен через постоянное соединение.
+
+    Держит requests.Session с keep-alive, отправляет If-None-Match и
+    If-Modified-Since, если сервер прислал ETag или Last-Modified, и помнит
+    хэш последнего тела ответа, чтобы не разбирать одинаковые данные.
+
+    Новый ответ запоминается только после commit(), то есть когда данные
+    разобраны и сохранены. Если разбор упал или результат не дождались,
+    следующий запрос снова вернет эту страницу как измененную.
+    """
+
+    def __init__(self, url, headers=None, timeout=10, session=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        self.stats = {'requests': 0, 'not_modified': 0, 'unchanged': 0, 'changed': 0, 'errors': 0}
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        self._content = None
+        self._pending = None  # (ETag, Last-Modified, хэш, тело) ответа, который еще не приняли
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def fetch(self):
+        """Запрашивает страницу; возвращает FetchResult или None при ошибке"""
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+
+        self._count('requests')
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and self._content is not None:
+                self._count('not_modified')
+                return FetchResult(self._content, False, self._digest)
+
+            response.encoding = 'utf-8'  # Явно указываем кодировку
+            response.raise_for_status()
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Ошибка при XHR-запросе: {str(e)}")
+            return None
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        digest = hashlib.sha1(response.content).hexdigest()
+        if digest == self._digest:
+            # Тело то же, что уже принято, поэтому новые заголовки можно запомнить сразу
+            self._count('unchanged')
+            with self._lock:
+                self._etag, self._last_modified = etag, last_modified
+                self._pending = None
+            return FetchResult(self._content, False, digest)
+
+        self._count('changed')
+        content = response.text
+        with self._lock:
+            self._pending = (etag, last_modified, digest, content)
+        return FetchResult(content, True, digest)
+
+    def commit(self):
+        """Запоминает последний измененный ответ как принятый"""
+        with self._lock:
+            if self._pending is None:
+                return
+            self._etag, self._last_modified, self._digest, self._content = self._pending
+            self._pending = None
+
+    def reset(self):
+        """Забывает последний ответ, следующий запрос будет считаться новым"""
+        with self._lock:
+            self._etag = None
+            self._last_modified = None
+            self._digest = None
+            self._content = None
+            self._pending = None
@@ -0,0 +1,73 @@
+from models import TEACHER_STATUSES
+
+
+# Функция для группировки замен по парам
+def group_replacements_by_pairs(replacements):
+    # Сортируем замены по номеру урока
+    sorted_replacements = sorted(replacements, key=lambda x: x.lesson if x.lesson is not None else float('inf'))
+
+    # Группируем по парам
+    pairs = {}
+    for i in range(0, len(sorted_replacements), 2):
+        # Получаем текущий урок
+        current = sorted_replacements[i]
+        # Проверяем, есть ли следующий урок
+        next_lesson = sorted_replacements[i + 1] if i + 1 < len(sorted_replacements) else None
+
+        # Если это последовательные уроки (например, 1-2, 3-4 и т.д.)
+        if (next_lesson and
+            current.lesson is not None and
+            next_lesson.lesson is not None and
+            next_lesson.lesson == current.lesson + 1 and
+            current.lesson % 2 == 1):  # Проверяем, что первый урок нечетный
+
+            # Номер пары уже посчитан при разборе
+            pairs[current.pair_num] = current  # Берем только первый урок, так как они одинаковые
+
+        # Если это одиночный урок или уроки разные
+        else:
+            if current.lesson is not None:
+                pairs[current.pair_num] = current
+
+    return pairs
+
+
+def _sorted_pairs(replacements):
+    """Пары в порядке номеров, как их выводят обработчики"""
+    pairs = group_replacements_by_pairs(replacements)
+    return tuple((pair_num, pairs[pair_num]) for pair_num in sorted(pairs.keys()))
+
+
+class SnapshotIndex:
+    """Индексы снимка, которые строятся один раз при загрузке данных.
+
+    groups и teachers - отсортированные списки для клавиатур,
+    group_pairs и teacher_pairs - готовые пары для ответов обработчиков.
+    """
+
+    __slots__ = ('groups', 'teachers', 'group_pairs', 'teacher_pairs')
+
+    def __init__(self, data):
+        groups = data.get('groups') or {}
+
+        # Сортируем группы по номеру
+        self.groups = tuple(sorted(groups.keys(), key=lambda x: int(x)))
+        self.group_pairs = {
+            group_number: _sorted_pairs(replacements)
+            for group_number, replacements in groups.items()
+        }
+
+        # Собираем все замены для каждого преподавателя
+        teacher_rows = {}
+        for group_number, replacements in groups.items():
+            for replacement in replacements:
+                teacher_rows.setdefault(replacement.teacher, []).append(replacement.with_group(group_number))
+
+        self.teachers = tuple(sorted(
+            teacher for teacher in teacher_rows
+            if teacher and teacher not in TEACHER_STATUSES
+        ))
+        self.teacher_pairs = {
+            teacher: _sorted_pairs(rows)
+            for teacher, rows in teacher_rows.items()
+        }
@@ -0,0 +1,267 @@
+"""Счетчики и гистограммы времени в формате Prometheus.
+
+Метрики объявляются в модулях, где они меняются:
+
+    PARSE_SECONDS = metrics.histogram('parse_seconds', "Разбор таблицы замен")
+    with PARSE_SECONDS.time():
+        ...
+
+и отдаются одной страницей текста на /metrics, если задан METRICS_PORT,
+или пишутся в лог раз в METRICS_DUMP_INTERVAL секунд.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'replacements_bot_'
+
+# Границы корзин в секундах: от быстрых ответов из кэша до рассылки на всех
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name if name.endswith('_total') else name + '_total'
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        return self._values.get(key, 0)
+
+    def items(self):
+        """Пары (значения меток, значение счетчика)"""
+        with self._lock:
+            return sorted(self._values.items())
+
+    def samples(self):
+        for key, value in self.items():
+            yield f"{self.name}{_label_text(self.labels, key)} {value}"
+
+
+class _Series:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Распределение длительностей по корзинам"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, slow=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.slow = slow  # длительность, после которой замер пишется в лог
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.buckets) + 1)
+            series.counts[position] += 1
+            series.total += value
+            series.count += 1
+        if self.slow is not None and value >= self.slow:
+            logger.warning(f"Медленно: {self.name} {dict(zip(self.labels, key))} {value:.3f} с")
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def timed(self, **labels):
+        """Декоратор, замеряющий каждый вызов функции"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def label_values(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def summary(self, **labels):
+        """Число замеров, среднее и приблизительные p50/p99 по корзинам"""
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None or not series.count:
+                return None
+            counts = list(series.counts)
+            count, total = series.count, series.total
+        return {
+            'count': count,
+            'mean': total / count,
+            'p50': self._quantile(counts, count, 0.5),
+            'p99': self._quantile(counts, count, 0.99),
+        }
+
+    def _quantile(self, counts, count, share):
+        rank = share * count
+        seen = 0
+        for position, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[position] if position < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series.counts), series.total, series.count)
+                           for key, series in self._series.items())
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f"{self.name}_bucket{_label_text(self.labels, key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labels, key)} {total}"
+            yield f"{self.name}_count{_label_text(self.labels, key)} {count}"
+
+
+class Registry:
+    """Все метрики процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Повторное объявление возвращает уже существующую метрику
+            return self._metrics.setdefault(metric.name, metric)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4"""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def dump(self):
+        """Короткая сводка для лога"""
+        parts = []
+        for metric in self.metrics():
+            if isinstance(metric, Counter):
+                for key, value in metric.items():
+                    parts.append(f"{metric.name}{_label_text(metric.labels, key)}={value}")
+            else:
+                for key in metric.label_values():
+                    summary = metric.summary(**dict(zip(metric.labels, key)))
+                    parts.append(f"{metric.name}{_label_text(metric.labels, key)}: n={summary['count']} "
+                                 f"avg={summary['mean']:.3f} p50<={summary['p50']} p99<={summary['p99']}")
+        return '; '.join(parts)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    """Счетчик; к имени добавляются префикс бота и _total"""
+    return REGISTRY.register(Counter(PREFIX + name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS, slow=None):
+    return REGISTRY.register(Histogram(PREFIX + name, documentation, labels, buckets, slow))
+
+
+class MetricsServer:
+    """Страница /metrics для Prometheus"""
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9108, path='/metrics'):
+        self.registry = registry
+        self.path = path
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                body = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Метрики доступны на {self.address[0]}:{self.address[1]}{self.path}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def dump_periodically(interval, registry=REGISTRY):
+    """Пишет сводку метрик в лог раз в interval секунд в фоновом потоке"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            logger.info(f"Метрики: {registry.dump()}")
+
+    thread = threading.Thread(target=loop, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,88 @@
+import sys
+
+# Значения в колонке преподавателя, которые означают статус, а не фамилию
+CANCELLED = "Отмена пары"
+MOVED = "Перенос пары"
+TEACHER_STATUSES = (CANCELLED, MOVED)
+
+# Аудитория для дистанционных занятий
+REMOTE_CLASSROOM = "ДО"
+
+# Поля строки замены в replacements.json
+FIELDS = ("pair", "original_subject", "teacher", "new_subject", "classroom")
+
+
+def _intern(value):
+    return sys.intern(value) if value else ""
+
+
+class Replacement:
+    """Одна строка замены.
+
+    Номер урока, номер пары и признаки отмены, переноса и дистанционного
+    занятия вычисляются один раз при создании записи. Повторяющиеся строки
+    (преподаватели, предметы, аудитории) интернируются. Для совместимости со
+    старым кодом поддерживается доступ как к словарю: replacement['teacher'].
+    """
+
+    __slots__ = FIELDS + ('lesson', 'pair_num', 'cancelled', 'moved', 'remote', 'group_number')
+
+    def __init__(self, pair, original_subject, teacher, new_subject, classroom="", group_number=None):
+        self.pair = pair
+        self.original_subject = _intern(original_subject)
+        self.teacher = _intern(teacher)
+        self.new_subject = _intern(new_subject)
+        self.classroom = _intern(classroom)
+        self.group_number = group_number
+
+        # Номер урока и пары считаем один раз
+        self.lesson = int(pair) if pair.isdigit() else None
+        self.pair_num = (self.lesson + 1) // 2 if self.lesson else 0
+
+        self.cancelled = teacher == CANCELLED
+        self.moved = teacher == MOVED
+        self.remote = classroom.upper() == REMOTE_CLASSROOM
+
+    @classmethod
+    def from_dict(cls, row, group_number=None):
+        return cls(row.get('pair', ""), row.get('original_subject', ""), row.get('teacher', ""),
+                   row.get('new_subject', ""), row.get('classroom', ""), group_number)
+
+    def to_dict(self):
+        """Строка в формате replacements.json"""
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def with_group(self, group_number):
+        """Копия записи с номером группы (для выборки по преподавателю)"""
+        return Replacement(self.pair, self.original_subject, self.teacher,
+                           self.new_subject, self.classroom, group_number)
+
+    def fields(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __eq__(self, other):
+        if not isinstance(other, Replacement):
+            return NotImplemented
+        return self.fields() == other.fields() and self.group_number == other.group_number
+
+    def __hash__(self):
+        return hash((self.fields(), self.group_number))
+
+    def __repr__(self):
+        return f"Replacement({self.to_dict()!r})"
+
+
+def to_json(value):
+    """Функция для json.dump(default=...), сохраняет формат replacements.json"""
+    if isinstance(value, Replacement):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
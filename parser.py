@@ -1,182 +1,186 @@
 import json
-from datetime import datetime
 import logging
-import requests
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-import time
-
-# Настройка логирования
-logging.basicConfig(level=logging.DEBUG)
+import os
+import tempfile
+import threading
+import metrics
+from models import to_json
+
 logger = logging.getLogger(__name__)
 
+FETCH_SECONDS = metrics.histogram('fetch_seconds', "Загрузка страницы замен")
+FETCHES = metrics.counter('fetches', "Запросы страницы замен по результату", ('result',))
+PARSE_SECONDS = metrics.histogram('parse_seconds', "Разбор таблицы замен", ('engine',))
+SAVE_SECONDS = metrics.histogram('save_seconds', "Сохранение replacements.json")
+
+# Движок разбора таблицы: "html" (без браузера) или "selenium"
+PARSER_ENGINE = os.environ.get("PARSER_ENGINE", "html")
+
+# Адрес, с которого страница замен загружает таблицу
+FETCH_URL = "http://rep.spb-kit.ru/replacements/api/fetch-rep"
+
+# Одно постоянное соединение на каждый адрес, создается при первом запросе
+_fetchers = {}
+_fetcher_lock = threading.Lock()
+
+def get_fetcher(url=None, timeout=10):
+    """Возвращает общий Fetcher для адреса, при первом вызове загружает requests"""
+    url = url or FETCH_URL
+    with _fetcher_lock:
+        fetcher = _fetchers.get(url)
+        if fetcher is None:
+            from fetcher import Fetcher
+            fetcher = _fetchers[url] = Fetcher(url, timeout=timeout, headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                'Accept-Charset': 'utf-8'
+            })
+    return fetcher
+
+# Возвращается get_replacements(skip_unchanged=True), если страница не менялась
+NOT_MODIFIED = object()
+
+@FETCH_SECONDS.timed()
+def fetch_replacements(fetcher=None):
+    """Получение данных через XHR-запрос вместе с признаком изменения"""
+    result = (fetcher or get_fetcher()).fetch()
+    if not result:
+        FETCHES.inc(result='error')
+        return None
+    FETCHES.inc(result='changed' if result.changed else 'unchanged')
+
+    # Получаем HTML-контент
+    content = result.content
+    
+    if content and 'error' not in content.lower():
+        # Проверяем наличие данных в ответе
+        if '<table' in content and '</table>' in content:
+            logger.debug(f"Получены данные через XHR: {content[:200]}...")  # Логируем первые 200 символов для проверки
+            return result
+        else:
+            logger.warning("XHR-ответ не содержит таблицу с данными")
+            return None
+    return None
+
 def get_replacements_xhr():
     """Получение данных через XHR-запрос"""
+    result = fetch_replacements()
+    return result.content if result else None
+
+def get_replacements_selenium(xhr_content):
+    """Разбор таблицы через headless Chrome (запасной вариант)"""
+    # Selenium нужен только для запасного варианта, поэтому импортируем его здесь
+    from table_parser import parse_date, parse_rows
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+
+    driver = webdriver.Chrome(options=chrome_options)
     try:
-        url = "http://rep.spb-kit.ru/replacements/api/fetch-rep"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept-Charset': 'utf-8'
+        # Создаем базовую HTML-структуру с указанием кодировки
+        html_template = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+        </head>
+        <body>
+            <div id="content">
+                {xhr_content}
+            </div>
+        </body>
+        </html>
+        """
+
+        # Загружаем контент через data URL для сохранения кодировки
+        driver.get(f"data:text/html;charset=utf-8,{html_template}")
+
+        # Ждем загрузки контента
+        wait = WebDriverWait(driver, 10)
+        content = wait.until(EC.presence_of_element_located((By.ID, "content")))
+
+        # Получаем весь текст из контента
+        raw_date, date = parse_date(content.text.strip())
+
+        rows = []
+        for table in driver.find_elements(By.TAG_NAME, "table"):
+            for row in table.find_elements(By.TAG_NAME, "tr"):
+                rows.append([cell.text.strip() for cell in row.find_elements(By.TAG_NAME, "td")])
+
+        result = {
+            "date": date,
+            "raw_date": raw_date,
+            "groups": parse_rows(rows)
         }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.encoding = 'utf-8'  # Явно указываем кодировку
-        response.raise_for_status()
-        
-        # Получаем HTML-контент
-        content = response.text
-        
-        if content and 'error' not in content.lower():
-            # Проверяем наличие данных в ответе
-            if '<table' in content and '</table>' in content:
-                logger.debug(f"Получены данные через XHR: {content[:200]}...")  # Логируем первые 200 символов для проверки
-                return content
-            else:
-                logger.warning("XHR-ответ не содержит таблицу с данными")
-                return None
-        return None
-        
-    except Exception as e:
-        logger.error(f"Ошибка при XHR-запросе: {str(e)}")
-        return None
+        logger.info(f"Всего обработано групп: {len(result['groups'])}")
+        return result
 
-def get_replacements():
-    """Основная функция получения замен"""
-    url = "http://rep.spb-kit.ru/replacements/view.html"
-    
+    finally:
+        logger.debug("Закрытие браузера")
+        driver.quit()
+
+def get_replacements(skip_unchanged=False, fetcher=None, engine=None):
+    """Основная функция получения замен.
+
+    С skip_unchanged=True возвращает NOT_MODIFIED, если страница не
+    изменилась с последнего принятого ответа, и не разбирает ее повторно.
+    Ответ принимает fetcher.commit() после сохранения данных. fetcher
+    и engine задают адрес и движок разбора для отдельного источника.
+    """
+    fetcher = fetcher or get_fetcher()
     try:
         # Сначала пробуем получить данные через XHR
-        xhr_content = get_replacements_xhr()
-        if xhr_content:
-            logger.info("Данные успешно получены через XHR")
-            chrome_options = Options()
-            chrome_options.add_argument("--headless")
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            
-            driver = webdriver.Chrome(options=chrome_options)
+        result = fetch_replacements(fetcher)
+        if result:
+            if skip_unchanged and not result.changed:
+                logger.info(f"Страница замен {fetcher.url} не изменилась, разбор пропущен: {fetcher.stats}")
+                return NOT_MODIFIED
+
+            xhr_content = result.content
+            logger.info(f"Данные успешно получены через XHR: {fetcher.url}")
+            if (engine or PARSER_ENGINE) == "selenium":
+                with PARSE_SECONDS.time(engine='selenium'):
+                    return get_replacements_selenium(xhr_content)
+
             try:
-                # Создаем базовую HTML-структуру с указанием кодировки
-                html_template = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="utf-8">
-                </head>
-                <body>
-                    <div id="content">
-                        {xhr_content}
-                    </div>
-                </body>
-                </html>
-                """
-                
-                # Загружаем контент через data URL для сохранения кодировки
-                driver.get(f"data:text/html;charset=utf-8,{html_template}")
-                
-                # Ждем загрузки контента
-                wait = WebDriverWait(driver, 10)
-                content = wait.until(EC.presence_of_element_located((By.ID, "content")))
-                
-                # Далее используем существующий код для парсинга...
-                result = {
-                    "date": None,
-                    "raw_date": None,
-                    "groups": {}
-                }
-                
-                # Получаем весь текст из контента
-                content_text = content.text.strip()
-                logger.debug(f"Текст контента: {content_text}")
-                
-                # Ищем дату в первых строках текста
-                lines = content_text.split('\n')
-                for line in lines[:3]:  # Проверяем первые 3 строки
-                    if any(word in line.lower() for word in ['замены', 'понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота']):
-                        result["raw_date"] = line.strip()
-                        logger.debug(f"Найдена сырая дата: {result['raw_date']}")
-                        
-                        # Ищем дату в формате DD.MM.YY
-                        import re
-                        date_match = re.search(r'\d{2}\.\d{2}\.\d{2}', line)
-                        if date_match:
-                            date_str = date_match.group(0)
-                            date_obj = datetime.strptime(date_str, "%d.%m.%y")
-                            result["date"] = date_obj.strftime("%Y-%m-%d")
-                            logger.debug(f"Обработана дата: {result['date']}")
-                        break
-                
-                # Ждем появления таблиц
-                tables = driver.find_elements(By.TAG_NAME, "table")
-                logger.debug(f"Найдено таблиц: {len(tables)}")
-                
-                current_group = None
-                for table in tables:
-                    rows = table.find_elements(By.TAG_NAME, "tr")
-                    
-                    for row in rows:
-                        cells = row.find_elements(By.TAG_NAME, "td")
-                        
-                        if not cells:
-                            continue
-                        
-                        # Пропускаем заголовки и служебные записи
-                        first_cell = cells[0].text.strip()
-                        if (first_cell == "№ пары" or 
-                            "директор" in first_cell.lower() or
-                            any("венедиктова" in cell.text.lower() for cell in cells)):
-                            continue
-                        
-                        # Если это строка с номером группы
-                        if len(cells) == 1:
-                            group_number = first_cell
-                            if group_number.isdigit():
-                                current_group = group_number
-                                result["groups"][current_group] = []
-                                logger.debug(f"Обработка группы: {current_group}")
-                        
-                        # Если это строка с заменами
-                        elif len(cells) >= 4 and current_group and current_group in result["groups"]:
-                            replacement = {
-                                "pair": cells[0].text.strip(),
-                                "original_subject": cells[1].text.strip(),
-                                "teacher": cells[2].text.strip(),
-                                "new_subject": cells[3].text.strip(),
-                                "classroom": cells[4].text.strip() if len(cells) > 4 else ""
-                            }
-                            
-                            # Добавляем только если есть реальные данные
-                            if any(v for v in replacement.values() if v and "венедиктова" not in v.lower()):
-                                result["groups"][current_group].append(replacement)
-                                logger.debug(f"Добавлена замена для группы {current_group}: {replacement}")
-                
-                # Удаляем пустые группы
-                result["groups"] = {k: v for k, v in result["groups"].items() if v}
-                
-                logger.info(f"Всего обработано групп: {len(result['groups'])}")
-                return result
-                
-            finally:
-                logger.debug("Закрытие браузера")
-                driver.quit()
-                
+                from table_parser import parse_replacements_html
+                with PARSE_SECONDS.time(engine='html'):
+                    return parse_replacements_html(xhr_content)
+            except Exception as e:
+                # Браузер оставляем только как запасной вариант
+                logger.error(f"Ошибка разбора HTML, переключаемся на Selenium: {str(e)}")
+                with PARSE_SECONDS.time(engine='selenium'):
+                    return get_replacements_selenium(xhr_content)
+
         else:
-            # Если XHR не сработал, используем оригинальный метод через Selenium
-            logger.info("XHR не удался, переключаемся на Selenium")
-            # ... (оставшийся оригинальный код)
+            logger.info("XHR не удался, данные не получены")
 
     except Exception as e:
         logger.error(f"Ошибка при обработке данных: {str(e)}", exc_info=True)
         return {"error": f"Ошибка при обработке данных: {str(e)}"}
 
+@SAVE_SECONDS.timed()
 def save_to_json(data, filename="replacements.json"):
     """Сохраняет данные в JSON файл"""
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # Пишем во временный файл и подменяем его целиком,
+        # чтобы читатель никогда не увидел полузаписанный файл.
+        # Имя временного файла свое у каждой записи: файл могут делить несколько узлов
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                            prefix=f"{os.path.basename(filename)}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2, default=to_json)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
         logger.info(f"Данные успешно сохранены в файл {filename}")
         return True
     except Exception as e:
@@ -184,6 +188,8 @@ def save_to_json(data, filename="replacements.json"):
         return False
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+
     # Получаем данные
     logger.info("Начало работы парсера")
     data = get_replacements()
@@ -0,0 +1,324 @@
+import logging
+import threading
+import telebot
+import callbacks
+import metrics
+from search import SearchIndex, QueryCache
+
+logger = logging.getLogger(__name__)
+
+RENDER_SECONDS = metrics.histogram('render_seconds', "Отрисовка всех ответов для снимка")
+
+
+# Функция для форматирования замен
+def format_replacement(replacement):
+    # Номер пары и статусы посчитаны при разборе
+    message = f"🕐 Пара: {replacement.pair_num}\n"
+
+    if replacement.cancelled:
+        message += "❌ Статус: Пара отменена\n"
+    elif replacement.moved:
+        message += "🔄 Статус: Пара перенесена\n"
+    else:
+        if replacement.new_subject:
+            message += f"📗 Предмет: {replacement.new_subject}\n"
+
+        if replacement.teacher:
+            message += f"👨‍🏫 Преподаватель: {replacement.teacher}\n"
+
+    if replacement.classroom:
+        if replacement.remote:
+            message += "🏠 Форма обучения: Дистанционно\n"
+        else:
+            message += f"🏛 Аудитория: {replacement.classroom}\n"
+
+    return message
+
+
+def render_group(data, group_number, pairs):
+    """Текст ответа с заменами для группы"""
+    response = f"📅 Замены для группы {group_number}\n"
+    if data['raw_date']:
+        response += f"📆 {data['raw_date']}\n\n"
+    for pair_num, replacement in pairs:
+        response += format_replacement(replacement) + "\n"
+    return response
+
+
+def render_teacher(data, teacher_name, pairs):
+    """Текст ответа с заменами для преподавателя"""
+    response = f"👨‍🏫 Замены для преподавателя {teacher_name}\n"
+    if data['raw_date']:
+        response += f"📆 {data['raw_date']}\n\n"
+    for pair_num, replacement in pairs:
+        response += f"👥 Группа: {replacement.group_number}\n"
+        response += format_replacement(replacement) + "\n"
+    return response
+
+
+def _render_group_changes(changes, teacher=None, new_day=False):
+    """Строки изменений одной группы, при необходимости только по преподавателю"""
+    def matches(row):
+        return teacher is None or row.teacher == teacher
+
+    response = ""
+    added = [row for row in changes.added if matches(row)]
+    removed = [row for row in changes.removed if matches(row)]
+    changed = [(old, new) for old, new in changes.changed if matches(old) or matches(new)]
+    if added and new_day:
+        # Новый день: все строки новые, подзаголовок не нужен
+        return "".join(format_replacement(row) + "\n" for row in added)
+    if added:
+        response += "➕ Новые замены:\n"
+        response += "".join(format_replacement(row) + "\n" for row in added)
+    if changed:
+        response += "✏️ Изменено:\n"
+        response += "".join(format_replacement(new) + "\n" for old, new in changed)
+    if removed:
+        response += "➖ Больше не действует:\n"
+        response += "".join(format_replacement(row) + "\n" for row in removed)
+    return response
+
+
+def render_changes(data, diff, targets):
+    """Персональное уведомление только по подпискам пользователя.
+
+    При смене даты все строки diff новые, и уведомление показывает замены
+    нового дня по подпискам, а не изменения относительно прошлого дня.
+    """
+    response = "🔔 Новые замены" if diff.date_changed else "🔔 Изменения в заменах"
+    if data['raw_date']:
+        response += f" на {data['raw_date']}"
+    response += "\n"
+
+    for group_number in sorted(targets['groups'], key=lambda x: int(x) if x.isdigit() else 0):
+        response += f"\n👥 Группа {group_number}\n"
+        response += _render_group_changes(diff.groups[group_number], new_day=diff.date_changed)
+
+    for teacher in sorted(targets['teachers']):
+        response += f"\n👨‍🏫 Преподаватель {teacher}\n"
+        for group_number in diff.teachers[teacher]:
+            response += f"👥 Группа: {group_number}\n"
+            response += _render_group_changes(diff.groups[group_number], teacher, diff.date_changed)
+    return response
+
+
+def build_subscribe_keyboard(callback_data):
+    """Кнопка подписки под ответом с заменами"""
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    keyboard.add(telebot.types.InlineKeyboardButton(
+        text="🔔 Подписаться / отписаться",
+        callback_data=callback_data
+    ))
+    return keyboard.to_json()
+
+
+# Клавиатуры храним уже сериализованными: telebot передает строку
+# в reply_markup как есть и не собирает JSON на каждую отправку
+def build_main_keyboard():
+    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.row("Замена по группам", "Замена по преподавателям")
+    keyboard.row("Выбрать дату", "Очистить")
+    return keyboard.to_json()
+
+
+# Сколько кнопок помещается на одной странице клавиатуры
+GROUPS_PAGE_SIZE = 30
+TEACHERS_PAGE_SIZE = 15
+
+
+def page_count(items, page_size):
+    return max(1, -(-len(items) // page_size))
+
+
+def build_paged_keyboard(labels, item_data, page_data, page, page_size, row_width):
+    """Одна страница inline-клавиатуры со стрелками перехода.
+
+    item_data(i) и page_data(p) возвращают callback_data для кнопки
+    элемента с номером i и для перехода на страницу p.
+    """
+    pages = page_count(labels, page_size)
+    page = min(max(page, 0), pages - 1)
+    start = page * page_size
+
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=row_width)
+    keyboard.add(*[
+        telebot.types.InlineKeyboardButton(text=label, callback_data=item_data(start + offset))
+        for offset, label in enumerate(labels[start:start + page_size])
+    ])
+
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(telebot.types.InlineKeyboardButton(text="◀️", callback_data=page_data(page - 1)))
+        navigation.append(telebot.types.InlineKeyboardButton(
+            text=f"{page + 1}/{pages}", callback_data=callbacks.pack(callbacks.NOOP)))
+        if page < pages - 1:
+            navigation.append(telebot.types.InlineKeyboardButton(text="▶️", callback_data=page_data(page + 1)))
+        keyboard.row(*navigation)
+    return keyboard.to_json()
+
+
+def build_groups_keyboard(groups, token, page=0, day=None):
+    """Страница кнопок групп, по 3 в ряд"""
+    if day is None:
+        item_data = lambda i: callbacks.pack(callbacks.GROUP, i, token)
+        page_data = lambda p: callbacks.pack(callbacks.GROUPS_PAGE, p, token)
+    else:
+        item_data = lambda i: callbacks.pack(callbacks.DAY_GROUP, day, i, token)
+        page_data = lambda p: callbacks.pack(callbacks.DAY_GROUPS_PAGE, day, p, token)
+    return build_paged_keyboard(groups, item_data, page_data, page, GROUPS_PAGE_SIZE, 3)
+
+
+def build_teachers_keyboard(teachers, token, page=0, day=None):
+    """Страница кнопок преподавателей, по одному в ряд"""
+    if day is None:
+        item_data = lambda i: callbacks.pack(callbacks.TEACHER, i, token)
+        page_data = lambda p: callbacks.pack(callbacks.TEACHERS_PAGE, p, token)
+    else:
+        item_data = lambda i: callbacks.pack(callbacks.DAY_TEACHER, day, i, token)
+        page_data = lambda p: callbacks.pack(callbacks.DAY_TEACHERS_PAGE, day, p, token)
+    return build_paged_keyboard(teachers, item_data, page_data, page, TEACHERS_PAGE_SIZE, 1)
+
+
+def format_day(day):
+    """ГГГГ-ММ-ДД -> ДД.ММ.ГГГГ"""
+    year, month, number = day.split('-')
+    return f"{number}.{month}.{year}"
+
+
+def build_dates_keyboard(dates):
+    """Кнопки выбора дня из архива, по 3 в ряд"""
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=3)
+    keyboard.add(*[
+        telebot.types.InlineKeyboardButton(text=format_day(day), callback_data=callbacks.pack(callbacks.DAY, day))
+        for day in dates
+    ])
+    return keyboard.to_json()
+
+
+def build_day_keyboard(day, token):
+    """Выбор между группами и преподавателями для дня из архива"""
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    keyboard.row(
+        telebot.types.InlineKeyboardButton(
+            text="👥 Группы", callback_data=callbacks.pack(callbacks.DAY_GROUPS_PAGE, day, 0, token)),
+        telebot.types.InlineKeyboardButton(
+            text="👨‍🏫 Преподаватели", callback_data=callbacks.pack(callbacks.DAY_TEACHERS_PAGE, day, 0, token))
+    )
+    return keyboard.to_json()
+
+
+def build_sources_keyboard(titles, current):
+    """Выбор источника замен, текущий отмечен галочкой"""
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
+    keyboard.add(*[
+        telebot.types.InlineKeyboardButton(
+            text=f"✅ {title}" if position == current else title,
+            callback_data=callbacks.pack(callbacks.SOURCE, position))
+        for position, title in enumerate(titles)
+    ])
+    return keyboard.to_json()
+
+
+# Функция для создания клавиатуры с результатами поиска
+def build_matches_keyboard(matches, token):
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
+    for match in matches:
+        icon = "👥" if match.kind == callbacks.GROUP else "👨‍🏫"
+        keyboard.add(telebot.types.InlineKeyboardButton(
+            text=f"{icon} {match.name}", callback_data=callbacks.pack(match.kind, match.position, token)))
+    return keyboard.to_json()
+
+
+MAIN_KEYBOARD = build_main_keyboard()
+
+# Сколько результатов показывать в inline-режиме
+INLINE_RESULTS = 20
+
+
+class RenderedSnapshot:
+    """Готовые ответы и клавиатуры для одного снимка"""
+
+    __slots__ = ('digest', 'group_messages', 'teacher_messages',
+                 'groups_pages', 'teachers_pages', 'search', '_inline')
+
+    def __init__(self, snapshot):
+        data = snapshot.data
+        index = snapshot.index
+        self.digest = snapshot.digest
+        self.group_messages = {
+            group_number: render_group(data, group_number, pairs)
+            for group_number, pairs in index.group_pairs.items()
+        }
+        self.teacher_messages = {
+            teacher: render_teacher(data, teacher, pairs)
+            for teacher, pairs in index.teacher_pairs.items()
+        }
+        # Все страницы клавиатур готовим сразу, листание только берет готовую
+        self.groups_pages = [
+            build_groups_keyboard(index.groups, snapshot.token, page)
+            for page in range(page_count(index.groups, GROUPS_PAGE_SIZE))
+        ]
+        self.teachers_pages = [
+            build_teachers_keyboard(index.teachers, snapshot.token, page)
+            for page in range(page_count(index.teachers, TEACHERS_PAGE_SIZE))
+        ]
+        self.search = SearchIndex(index)
+        self._inline = QueryCache()
+
+    def message_for(self, kind, name):
+        """Готовый ответ для группы или преподавателя"""
+        if kind == callbacks.GROUP:
+            return self.group_messages.get(name, f"Для группы {name} замен нет")
+        return self.teacher_messages.get(name, f"Для преподавателя {name} замен нет")
+
+    def inline_results(self, query):
+        """Результаты inline-запроса, собранные один раз на запрос и снимок"""
+        results = self._inline.get(query)
+        if results is None:
+            results = []
+            for match in self.search.search(query, limit=INLINE_RESULTS):
+                if match.kind == callbacks.GROUP:
+                    title = f"👥 Группа {match.name}"
+                else:
+                    title = f"👨‍🏫 {match.name}"
+                message = self.message_for(match.kind, match.name)
+                results.append(telebot.types.InlineQueryResultArticle(
+                    id=f"{match.kind}{match.position}",
+                    title=title,
+                    description=message.split("\n", 2)[1] if message.count("\n") > 1 else None,
+                    input_message_content=telebot.types.InputTextMessageContent(message),
+                ))
+            results = self._inline.put(query, results)
+        return results
+
+
+class RenderCache:
+    """Кэш отрисованных ответов, привязанный к хэшу снимка.
+
+    Заполняется целиком при подмене снимка и целиком же сбрасывается
+    при следующей подмене.
+    """
+
+    def __init__(self):
+        self._rendered = None
+        self._lock = threading.Lock()
+
+    def on_swap(self, snapshot):
+        """Перерисовывает все ответы для нового снимка"""
+        self.get(snapshot)
+        logger.info(f"Ответы отрисованы для версии {snapshot.version}")
+
+    def get(self, snapshot):
+        """Возвращает готовые ответы для снимка"""
+        rendered = self._rendered
+        if rendered is not None and rendered.digest == snapshot.digest:
+            return rendered
+        with self._lock:
+            rendered = self._rendered
+            if rendered is None or rendered.digest != snapshot.digest:
+                with RENDER_SECONDS.time():
+                    rendered = RenderedSnapshot(snapshot)
+                self._rendered = rendered
+        return rendered
@@ -0,0 +1,274 @@
+"""Прием обновлений от Telegram и пул обработчиков.
+
+Обновления принимаются long polling'ом или через webhook и раздаются в пул
+потоков с ограниченными очередями. Обновления одного чата всегда попадают
+в одну очередь и обрабатываются по порядку, разные чаты - параллельно,
+поэтому медленный ответ одному пользователю не задерживает остальных.
+При остановке прием прекращается, а уже принятые обновления дорабатываются.
+
+Если узлов бота несколько, обновления принимает только лидер (active):
+второй getUpdates с тем же токеном Telegram отклоняет с 409 Conflict,
+а set_webhook с разных узлов перебивал бы друг друга. В режиме webhook
+адрес должен вести на балансировщик перед всеми узлами.
+"""
+import json
+import logging
+import queue
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+
+from broadcast import count_error
+
+logger = logging.getLogger(__name__)
+
+POLLING = 'polling'
+WEBHOOK = 'webhook'
+
+# Метка остановки для потоков пула
+_STOP = object()
+
+
+def update_chat_id(update):
+    """Чат, к которому относится обновление; по нему выбирается очередь"""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    if update.inline_query:
+        return update.inline_query.from_user.id
+    return update.update_id
+
+
+class HandlerPool:
+    """Потоки обработчиков, у каждого своя ограниченная очередь"""
+
+    def __init__(self, process, workers=8, queue_size=1000):
+        self.process = process  # обычно bot.process_new_updates
+        self.workers = workers
+        self._queues = [queue.Queue(max(queue_size // workers, 1)) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'processed': 0, 'errors': 0, 'rejected': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def start(self):
+        for number, updates in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(updates,), name=f"handler-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def pending(self):
+        """Сколько обновлений ждет обработки"""
+        return sum(updates.qsize() for updates in self._queues)
+
+    def submit(self, update, block=True, timeout=None):
+        """Ставит обновление в очередь; False, если очередь переполнена"""
+        updates = self._queues[hash(update_chat_id(update)) % self.workers]
+        try:
+            updates.put(update, block, timeout)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('submitted')
+        return True
+
+    def _work(self, updates):
+        while True:
+            update = updates.get()
+            try:
+                if update is _STOP:
+                    return
+                self.process([update])
+                self._count('processed')
+            except Exception as e:
+                self._count('errors')
+                count_error(e, 'handler')
+                logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                updates.task_done()
+
+    def drain(self, timeout=30):
+        """Дожидается обработки принятых обновлений и останавливает потоки"""
+        deadline = time.monotonic() + timeout
+        for updates in self._queues:
+            updates.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        alive = [thread.name for thread in self._threads if thread.is_alive()]
+        if alive:
+            logger.warning(f"Не дождались обработчиков: {', '.join(alive)}, в очереди {self.pending()}")
+        self._threads = []
+        return not alive
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления от Telegram"""
+
+    def __init__(self, pool, host='0.0.0.0', port=8443, path='/webhook', secret_token=None,
+                 max_body=1024 * 1024):
+        self.pool = pool
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.send_response(server.accept(self))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"webhook: {format % args}")
+
+        return Handler
+
+    def accept(self, request):
+        """Принимает одно обновление и возвращает HTTP-статус ответа"""
+        if request.path != self.path:
+            return 404
+        if self.secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret_token:
+            return 403
+        length = int(request.headers.get('Content-Length') or 0)
+        if length > self.max_body:
+            return 413
+
+        try:
+            update = telebot.types.Update.de_json(json.loads(request.rfile.read(length)))
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return 400
+
+        # При переполненной очереди Telegram повторит доставку позже
+        if not self.pool.submit(update, block=False):
+            return 503
+        return 200
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook слушает {self.address[0]}:{self.address[1]}{self.path}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class BotRuntime:
+    """Запускает прием обновлений и пул обработчиков до сигнала остановки"""
+
+    def __init__(self, bot, workers=8, queue_size=1000, drain_timeout=30, active=None):
+        self.bot = bot
+        # Принимает ли этот узел обновления; без кластера - всегда
+        self.active = active or (lambda: True)
+        self.pool = HandlerPool(bot.process_new_updates, workers, queue_size)
+        self.drain_timeout = drain_timeout
+        self.stopped = threading.Event()
+
+    def stop(self, *args):
+        if not self.stopped.is_set():
+            logger.info("Остановка: прием обновлений прекращен")
+        self.stopped.set()
+
+    def _install_signals(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+    def _serve(self, receive):
+        self._install_signals()
+        self.pool.start()
+        try:
+            receive()
+        finally:
+            self.stop()
+            started = time.perf_counter()
+            self.pool.drain(self.drain_timeout)
+            logger.info(f"Обработчики остановлены за {time.perf_counter() - started:.2f} с, {self.pool.stats}")
+
+    def run_polling(self, timeout=20, idle_interval=1.0):
+        """Long polling: следующий запрос уходит, пока обработчики работают"""
+        def confirm(offset):
+            # Подтверждаем принятые обновления, чтобы они не пришли снова
+            # после перезапуска или другому узлу после смены лидера
+            if offset is None:
+                return
+            try:
+                self.bot.get_updates(offset=offset, limit=1, timeout=0, long_polling_timeout=0)
+            except Exception as e:
+                logger.warning(f"Не удалось подтвердить обновления: {e}")
+
+        def receive():
+            offset = None
+            receiving = False
+            while not self.stopped.is_set():
+                if not self.active():
+                    if receiving:
+                        logger.info("Узел больше не лидер, прием обновлений передан другому узлу")
+                        confirm(offset)
+                        offset, receiving = None, False
+                    self.stopped.wait(idle_interval)
+                    continue
+                if not receiving:
+                    self.bot.remove_webhook()
+                    receiving = True
+                try:
+                    updates = self.bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=timeout)
+                except Exception as e:
+                    logger.error(f"Ошибка получения обновлений: {e}")
+                    self.stopped.wait(3)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    # Полная очередь задерживает следующий запрос к Telegram
+                    self.pool.submit(update)
+
+            if receiving:
+                confirm(offset)
+
+        self._serve(receive)
+
+    def run_webhook(self, url, host='0.0.0.0', port=8443, path='/webhook', secret_token=None,
+                    idle_interval=1.0):
+        """Webhook: Telegram сам присылает обновления на url.
+
+        Принимают обновления все узлы, а регистрирует адрес только лидер.
+        """
+        server = WebhookServer(self.pool, host, port, path, secret_token)
+
+        def receive():
+            server.start()
+            registered = False
+            try:
+                while not self.stopped.is_set():
+                    if not registered and self.active():
+                        try:
+                            self.bot.set_webhook(url=url, secret_token=secret_token,
+                                                 max_connections=self.pool.workers)
+                            registered = True
+                        except Exception as e:
+                            logger.error(f"Ошибка регистрации webhook: {e}")
+                    self.stopped.wait(idle_interval)
+            finally:
+                # Webhook не снимаем: пока бот перезапускается, Telegram копит обновления
+                server.stop()
+
+        self._serve(receive)
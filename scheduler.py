@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Файл с историей моментов, когда замены менялись
+HISTORY_FILE = 'poll_history.json'
+
+# Сутки делятся на корзины по 15 минут
+BUCKET_MINUTES = 15
+BUCKETS = 24 * 60 // BUCKET_MINUTES
+
+# Пока истории нет, считаем, что замены публикуют с 17 до 18 часов
+PRIOR_WINDOWS = [(17 * 60, 18 * 60)]
+PRIOR_WEIGHT = 3
+
+
+class PollScheduler:
+    """Адаптивное расписание опроса сайта с заменами.
+
+    Запоминает, когда замены действительно менялись, и опрашивает часто
+    в корзинах суток, где изменения случались, и редко в остальное время.
+    Время (clock) и случайность (rand) можно подменить в тестах.
+    """
+
+    def __init__(self, history_file=HISTORY_FILE, dense_interval=5 * 60,
+                 sparse_interval=30 * 60, hot_share=0.25, jitter=0.1,
+                 error_backoff=60, max_backoff=30 * 60, history_size=200,
+                 clock=time.time, rand=random.random):
+        self.history_file = history_file
+        self.dense_interval = dense_interval
+        self.sparse_interval = sparse_interval
+        self.hot_share = hot_share
+        self.jitter = jitter
+        self.error_backoff = error_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.rand = rand
+        self.history = deque(maxlen=history_size)
+        self.errors = 0
+        self.polls = 0  # опросов с момента запуска
+        self.next_run = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загружает историю изменений"""
+        try:
+            if self.history_file and os.path.exists(self.history_file):
+                with open(self.history_file, 'r') as f:
+                    self.history.extend(json.load(f))
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке истории опроса: {e}")
+        return self
+
+    def _save(self):
+        if not self.history_file:
+            return
+        try:
+            with open(self.history_file, 'w') as f:
+                json.dump(list(self.history), f)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении истории опроса: {e}")
+
+    @staticmethod
+    def _bucket(timestamp):
+        moment = datetime.fromtimestamp(timestamp)
+        return (moment.hour * 60 + moment.minute) // BUCKET_MINUTES
+
+    def scores(self):
+        """Вес каждой корзины суток: априорное окно плюс история изменений"""
+        scores = [0.0] * BUCKETS
+        for start, end in PRIOR_WINDOWS:
+            for bucket in range(start // BUCKET_MINUTES, end // BUCKET_MINUTES):
+                scores[bucket] += PRIOR_WEIGHT
+        for timestamp in self.history:
+            bucket = self._bucket(timestamp)
+            # Соседние корзины тоже немного важнее: публикация может сдвигаться
+            scores[bucket] += 1
+            scores[(bucket - 1) % BUCKETS] += 0.5
+            scores[(bucket + 1) % BUCKETS] += 0.5
+        return scores
+
+    def hot_buckets(self):
+        """Корзины, в которых замены публикуются чаще всего"""
+        scores = self.scores()
+        threshold = max(scores) * self.hot_share
+        return {bucket for bucket, score in enumerate(scores) if score and score >= threshold}
+
+    def record_change(self, timestamp=None):
+        """Запоминает момент, когда замены изменились.
+
+        Изменение, найденное первым опросом после запуска, не запоминается:
+        замены поменялись, пока бот не работал, и когда именно - неизвестно.
+        """
+        if self.polls <= 1:
+            logger.info("Изменение при первом опросе после запуска в историю не попадает")
+            return
+        with self._lock:
+            self.history.append(timestamp or self.clock())
+            self._save()
+
+    def record_success(self):
+        self.polls += 1
+        self.errors = 0
+
+    def record_error(self):
+        self.polls += 1
+        self.errors += 1
+
+    def next_delay(self):
+        """Через сколько секунд опрашивать в следующий раз"""
+        now = self.clock()
+        if self.errors:
+            delay = min(self.error_backoff * 2 ** (self.errors - 1), self.max_backoff)
+        else:
+            hot = self.hot_buckets()
+            bucket = self._bucket(now)
+            if bucket in hot:
+                delay = self.dense_interval
+            else:
+                # Ищем ближайшую горячую корзину, чтобы не проспать ее начало
+                delay = self.sparse_interval
+                moment = datetime.fromtimestamp(now)
+                seconds_into_bucket = (moment.minute % BUCKET_MINUTES) * 60 + moment.second
+                for step in range(1, BUCKETS + 1):
+                    if (bucket + step) % BUCKETS in hot:
+                        until_hot = step * BUCKET_MINUTES * 60 - seconds_into_bucket
+                        delay = min(delay, until_hot)
+                        break
+
+        # Случайный сдвиг, чтобы не стучаться на сервер в одни и те же секунды
+        delay *= 1 + self.jitter * (2 * self.rand() - 1)
+        return max(delay, 1)
+
+    def schedule(self):
+        """Назначает следующий опрос и возвращает его время"""
+        self.next_run = self.clock() + self.next_delay()
+        return self.next_run
+
+    def poll_now(self):
+        """Просит выполнить опрос немедленно"""
+        self._wake.set()
+
+    def wait(self):
+        """Ждет следующего опроса; возвращает True, если его запросили вручную"""
+        next_run = self.schedule()
+        logger.info(f"Следующая проверка замен: {datetime.fromtimestamp(next_run):%H:%M:%S}")
+        triggered = self._wake.wait(max(next_run - self.clock(), 0))
+        self._wake.clear()
+        return triggered
@@ -0,0 +1,162 @@
+"""Поиск групп и преподавателей по введенному тексту.
+
+Индекс строится один раз на снимок вместе с остальными готовыми ответами:
+отсортированный список слов для поиска по началу слова (бинарный поиск)
+и триграммы для поиска по части слова. Запрос "14" находит группы 141,
+142..., запрос "Льво" - преподавателя "Львова А.Б.", запрос "вова" - его же
+по середине фамилии.
+"""
+import bisect
+import heapq
+import re
+import threading
+from collections import OrderedDict
+
+import callbacks
+
+_WORD = re.compile(r'\w+')
+
+# Порядок результатов: точное совпадение, начало названия, начало слова, часть слова
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING = range(4)
+
+
+def normalize(text):
+    """Нижний регистр и ё как е, чтобы "Семёнов" находился по "семенов" """
+    return text.lower().replace('ё', 'е')
+
+
+def split_words(text):
+    return _WORD.findall(normalize(text))
+
+
+def _trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class SearchMatch:
+    """Найденная группа или преподаватель"""
+
+    __slots__ = ('kind', 'name', 'position', 'rank')
+
+    def __init__(self, kind, name, position, rank):
+        self.kind = kind  # callbacks.GROUP или callbacks.TEACHER
+        self.name = name
+        self.position = position  # номер в index.groups или index.teachers
+        self.rank = rank
+
+
+class QueryCache:
+    """Небольшой LRU-кэш ответов на запросы"""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+
+class SearchIndex:
+    """Индекс поиска по группам и преподавателям одного снимка"""
+
+    def __init__(self, index, cache_size=512):
+        # Все найденное описывается номером в списке entries
+        self._entries = []
+        self._names = []
+        self._name_words = []
+        words = []
+        self._trigrams = {}
+
+        for kind, items in ((callbacks.GROUP, index.groups), (callbacks.TEACHER, index.teachers)):
+            for position, name in enumerate(items):
+                entry = len(self._entries)
+                self._entries.append((kind, name, position))
+                name_words = split_words(name)
+                # Название хранится словами через пробел, как и нормализованный запрос
+                self._names.append(' '.join(name_words))
+                self._name_words.append(tuple(name_words))
+                for word in set(name_words):
+                    words.append((word, entry))
+                    for trigram in _trigrams(word):
+                        self._trigrams.setdefault(trigram, set()).add(entry)
+
+        words.sort()
+        self._words = [word for word, _ in words]
+        self._word_entries = [entry for _, entry in words]
+        self._cache = QueryCache(cache_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _prefixed(self, word):
+        """Записи, в названии которых есть слово, начинающееся с word"""
+        start = bisect.bisect_left(self._words, word)
+        end = bisect.bisect_left(self._words, word + '\uffff', start)
+        return set(self._word_entries[start:end])
+
+    def _containing(self, word):
+        """Записи, в словах которых встречается word длиной от трех букв"""
+        postings = [self._trigrams.get(trigram) for trigram in _trigrams(word)]
+        if not all(postings):
+            return set()
+        # Пересекаем начиная с самого короткого списка
+        postings.sort(key=len)
+        found = set(postings[0])
+        for entries in postings[1:]:
+            found &= entries
+        return {entry for entry in found if word in self._names[entry]}
+
+    def search(self, query, limit=10):
+        """Список SearchMatch, лучшие совпадения первыми"""
+        query = ' '.join(split_words(query))
+        if not query:
+            return ()
+        key = (query, limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Кандидатов дает самое длинное слово запроса, остальные только проверяются
+        others = query.split()
+        longest = max(others, key=len)
+        others.remove(longest)
+        prefixed = self._prefixed(longest)
+        contained = self._containing(longest) - prefixed if len(longest) >= 3 else ()
+
+        ranked = []
+        for found_rank, entries in ((WORD_PREFIX, prefixed), (SUBSTRING, contained)):
+            for entry in entries:
+                name = self._names[entry]
+                rank = found_rank
+                for word in others:
+                    if any(name_word.startswith(word) for name_word in self._name_words[entry]):
+                        continue
+                    if word not in name:
+                        break
+                    rank = SUBSTRING
+                else:
+                    if name == query:
+                        rank = EXACT
+                    elif name.startswith(query):
+                        rank = PREFIX
+                    # Короткие названия раньше длинных, поэтому группа 141 идет перед 1410
+                    ranked.append((rank, len(name), name, entry))
+
+        matches = []
+        for rank, _, _, entry in heapq.nsmallest(limit, ranked):
+            kind, name, position = self._entries[entry]
+            matches.append(SearchMatch(kind, name, position, rank))
+        return self._cache.put(key, tuple(matches))
@@ -0,0 +1,161 @@
+"""Несколько сайтов замен в формате fetch-rep в одном боте.
+
+Источники описываются в sources.json списком объектов:
+
+    [{"name": "kit", "title": "КИТ", "url": "http://rep.spb-kit.ru/replacements/api/fetch-rep"},
+     {"name": "west", "title": "Западный корпус", "url": "...", "engine": "html",
+      "interval": 600, "timeout": 30, "pair_times": {"1": ["09:00", "10:30"], "2": ["10:40", "12:10"]}}]
+
+У каждого источника свой снимок с индексами, готовые ответы, архив,
+выгрузка и расписание опроса. Первый источник основной: его файлы называются
+как раньше (replacements.json, archive/, poll_history.json), поэтому без
+sources.json бот работает с одним сайтом колледжа, как и прежде.
+
+Каждый источник опрашивается в своем потоке, а загрузка с разбором идет
+в отдельном исполнителе с ограничением по времени. Медленный или зависший
+сайт задерживает только свой источник.
+"""
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import parser
+from archive import ARCHIVE_DIR, ReplacementsArchive
+from export import ExportCache, parse_pair_times
+from render import RenderCache
+from scheduler import HISTORY_FILE, PollScheduler
+from store import REPLACEMENTS_FILE, ReplacementsStore
+
+logger = logging.getLogger(__name__)
+
+# Файл со списком источников
+SOURCES_FILE = 'sources.json'
+
+DEFAULT_NAME = 'kit'
+DEFAULT_TITLE = 'КИТ'
+
+# Сколько ждать загрузку и разбор одного источника, секунд
+FETCH_TIMEOUT = 60
+
+
+def _suffixed(filename, suffix):
+    """replacements.json -> replacements_west.json"""
+    base, extension = os.path.splitext(filename)
+    return f"{base}{suffix}{extension}"
+
+
+class Source:
+    """Один сайт замен со своим снимком, индексами и расписанием опроса"""
+
+    def __init__(self, name, title, url, engine=None, interval=None, timeout=FETCH_TIMEOUT, primary=False,
+                 pair_times=None):
+        self.name = name
+        self.title = title
+        self.url = url
+        self.engine = engine
+        self.interval = interval
+        self.timeout = timeout
+        self.primary = primary
+
+        suffix = '' if primary else f"_{name}"
+        self.store = ReplacementsStore(_suffixed(REPLACEMENTS_FILE, suffix), source=name)
+        self.archive = ReplacementsArchive(ARCHIVE_DIR + suffix, source=name)
+        self.render_cache = RenderCache()
+        # Свое время пар, если звонки в корпусе другие
+        self.export_cache = ExportCache(self.store, parse_pair_times(pair_times) if pair_times else None)
+        for listener in (self.archive.on_swap, self.render_cache.on_swap, self.export_cache.on_swap):
+            self.store.subscribe(listener)
+
+        if interval:
+            # Фиксированный интервал вместо адаптивного расписания
+            self.scheduler = PollScheduler(_suffixed(HISTORY_FILE, suffix), dense_interval=interval,
+                                           sparse_interval=interval)
+        else:
+            self.scheduler = PollScheduler(_suffixed(HISTORY_FILE, suffix))
+
+        # Один поток на источник: следующий опрос не начнется, пока не закончился прошлый
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"fetch-{name}")
+        self._pending = None
+
+    def __repr__(self):
+        return f"Source({self.name!r}, {self.url!r})"
+
+    def _fetch(self, skip_unchanged):
+        fetcher = parser.get_fetcher(self.url, timeout=min(self.timeout, 30))
+        return parser.get_replacements(skip_unchanged=skip_unchanged, fetcher=fetcher, engine=self.engine)
+
+    def fetch(self, skip_unchanged=True):
+        """Загружает и разбирает страницу не дольше timeout секунд.
+
+        Возвращает то же, что parser.get_replacements. Если прошлый опрос
+        еще не закончился или не уложился в срок, возвращает ошибку, а сам
+        опрос доработает в фоне.
+        """
+        if self._pending is not None and not self._pending.done():
+            return {"error": f"Источник {self.name}: прошлый опрос еще выполняется"}
+        self._pending = self._executor.submit(self._fetch, skip_unchanged)
+        try:
+            return self._pending.result(timeout=self.timeout)
+        except TimeoutError:
+            logger.error(f"Источник {self.name} не ответил за {self.timeout} с")
+            return {"error": f"Источник {self.name}: превышено время ожидания"}
+        except Exception as e:
+            logger.error(f"Ошибка опроса источника {self.name}: {e}")
+            return {"error": str(e)}
+
+    def commit(self):
+        """Отмечает последнюю загруженную страницу принятой: ее данные сохранены"""
+        parser.get_fetcher(self.url).commit()
+
+
+def load_sources(filename=SOURCES_FILE):
+    """Источники из sources.json; без файла - один сайт колледжа"""
+    if not os.path.exists(filename):
+        return [Source(DEFAULT_NAME, DEFAULT_TITLE, parser.FETCH_URL, primary=True)]
+
+    with open(filename, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    sources = []
+    for number, entry in enumerate(entries):
+        sources.append(Source(
+            entry['name'], entry.get('title', entry['name']), entry['url'],
+            engine=entry.get('engine'),
+            interval=entry.get('interval'),
+            timeout=entry.get('timeout', FETCH_TIMEOUT),
+            primary=number == 0,
+            pair_times=entry.get('pair_times'),
+        ))
+    names = [source.name for source in sources]
+    if not sources or len(set(names)) != len(names):
+        raise ValueError(f"В {filename} нужен хотя бы один источник и уникальные имена: {names}")
+    logger.info(f"Источники замен: {', '.join(names)}")
+    return sources
+
+
+class SourceRegistry:
+    """Источники по имени; первый - основной, его видят пользователи без выбора"""
+
+    def __init__(self, sources):
+        self._sources = {source.name: source for source in sources}
+        self.primary = sources[0]
+
+    def __iter__(self):
+        return iter(self._sources.values())
+
+    def __len__(self):
+        return len(self._sources)
+
+    def get(self, name):
+        """Источник по имени; неизвестное имя (источник убрали) - основной"""
+        return self._sources.get(name) or self.primary
+
+    def position(self, source):
+        return list(self._sources).index(source.name)
+
+    def at(self, position):
+        names = list(self._sources)
+        return self._sources[names[position]] if 0 <= position < len(names) else None
+
+    def stores(self):
+        return {source.name: source.store for source in self}
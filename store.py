@@ -0,0 +1,147 @@
+import json
+import hashlib
+import logging
+import threading
+import time
+from types import MappingProxyType
+from parser import save_to_json
+from indexes import SnapshotIndex
+from models import Replacement, to_json
+
+logger = logging.getLogger(__name__)
+
+# Файл, в котором хранится последний снимок замен
+REPLACEMENTS_FILE = 'replacements.json'
+
+
+def _freeze(value):
+    """Превращает словари и списки в неизменяемые представления"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _records(data):
+    """Строки замен в виде Replacement, номера пар разбираются один раз"""
+    groups = {
+        group_number: [
+            row if isinstance(row, Replacement) else Replacement.from_dict(row)
+            for row in rows
+        ]
+        for group_number, rows in (data.get('groups') or {}).items()
+    }
+    return {**data, 'groups': groups}
+
+
+def _thaw(value):
+    """Обратное преобразование для сериализации в JSON"""
+    if isinstance(value, Replacement):
+        return value.to_dict()
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+def content_digest(data):
+    """Хэш содержимого замен, не зависящий от порядка ключей"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=to_json)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class Snapshot:
+    """Неизменяемый снимок замен, который видят обработчики"""
+
+    __slots__ = ('data', 'digest', 'version', 'loaded_at', 'index', 'source')
+
+    def __init__(self, data, version, source=None):
+        data = _records(data)
+        self.digest = content_digest(data)
+        self.data = _freeze(data)
+        self.index = SnapshotIndex(self.data)
+        self.version = version
+        self.source = source  # имя источника замен
+        self.loaded_at = time.time()
+
+    @property
+    def date(self):
+        return self.data.get('date')
+
+    @property
+    def token(self):
+        """Короткая метка версии для callback_data, одинаковая после перезапуска"""
+        return self.digest[:8]
+
+    def to_dict(self):
+        """Изменяемая копия данных в формате replacements.json"""
+        return _thaw(self.data)
+
+
+class ReplacementsStore:
+    """Хранит текущий снимок замен в памяти процесса.
+
+    Файл читается один раз при старте, дальше обработчики получают снимок
+    без обращения к диску. Новые данные подменяют снимок целиком, поэтому
+    обработчик всегда видит согласованную версию.
+    """
+
+    def __init__(self, filename=REPLACEMENTS_FILE, source=None):
+        self.filename = filename
+        self.source = source
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """Регистрирует функцию, которая вызывается с новым снимком после подмены"""
+        self._listeners.append(listener)
+
+    def load(self):
+        """Загружает последний сохраненный снимок с диска"""
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            logger.info(f"Файл {self.filename} не найден, снимок пуст")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при чтении JSON: {e}")
+            return None
+        return self.swap(data)
+
+    def current(self):
+        """Возвращает текущий снимок или None, если данных еще нет"""
+        return self._snapshot
+
+    def swap(self, data):
+        """Атомарно подменяет текущий снимок"""
+        with self._lock:
+            self._version += 1
+            snapshot = Snapshot(data, self._version, self.source)
+            self._snapshot = snapshot
+        logger.info(f"Снимок замен обновлен до версии {snapshot.version}")
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика подмены снимка: {e}")
+        return snapshot
+
+    def ingest(self, data):
+        """Сохраняет новые данные, если они отличаются от текущих.
+
+        Возвращает пару (старый снимок, новый снимок) или None,
+        если содержимое не изменилось.
+        """
+        previous = self._snapshot
+        if previous is not None and previous.digest == content_digest(data):
+            return None
+
+        # Сначала пишем файл, чтобы после перезапуска поднять тот же снимок
+        if not save_to_json(data, self.filename):
+            logger.error("Снимок не сохранен на диск, обновляем только память")
+        return previous, self.swap(data)
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Старый файл с подписками, переносится в базу один раз
+SUBSCRIPTIONS_FILE = 'subscriptions.json'
+
+GROUP = 'groups'
+TEACHER = 'teachers'
+
+
+class Subscriptions:
+    """Подписки пользователей на группы и преподавателей.
+
+    Кроме прямого словаря chat_id -> подписки держит инвертированные
+    индексы группа/преподаватель -> подписчики, чтобы по изменениям
+    быстро найти, кому отправлять уведомление.
+    """
+
+    def __init__(self, storage, legacy_file=SUBSCRIPTIONS_FILE):
+        self.storage = storage
+        self.legacy_file = legacy_file
+        self._by_chat = {}
+        self._subscribers = {GROUP: {}, TEACHER: {}}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загружает подписки из базы и переносит subscriptions.json"""
+        try:
+            with self._lock:
+                for chat_id, kind, key in self.storage.load_subscriptions():
+                    self._add(chat_id, kind, key)
+            self._migrate()
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке подписок: {e}")
+
+    def reload(self):
+        """Перечитывает подписки из хранилища, которое меняют и другие процессы"""
+        rows = self.storage.load_subscriptions()
+        with self._lock:
+            self._by_chat = {}
+            self._subscribers = {GROUP: {}, TEACHER: {}}
+            for chat_id, kind, key in rows:
+                self._add(chat_id, kind, key)
+
+    def refresh(self, chat_ids):
+        """Перечитывает подписки чатов, которые поменяли на других узлах; None - всех"""
+        if chat_ids is None:
+            self.reload()
+            return
+        rows = {chat_id: self.storage.subscriptions_of(chat_id) for chat_id in chat_ids}
+        with self._lock:
+            for chat_id, subscriptions in rows.items():
+                self._forget(chat_id)
+                for kind, key in subscriptions:
+                    self._add(chat_id, kind, key)
+
+    def _migrate(self):
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        with open(self.legacy_file, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        with self._lock:
+            for chat_id, entry in raw.items():
+                for kind in (GROUP, TEACHER):
+                    for key in entry.get(kind, []):
+                        self._add(int(chat_id), kind, key)
+                        self.storage.add_subscription(int(chat_id), kind, key)
+        os.replace(self.legacy_file, f"{self.legacy_file}.migrated")
+        logger.info(f"Подписки перенесены из {self.legacy_file}")
+
+    def _add(self, chat_id, kind, key):
+        entry = self._by_chat.setdefault(chat_id, {GROUP: set(), TEACHER: set()})
+        entry[kind].add(key)
+        self._subscribers[kind].setdefault(key, set()).add(chat_id)
+
+    def _discard(self, chat_id, kind, key):
+        entry = self._by_chat.get(chat_id)
+        if entry:
+            entry[kind].discard(key)
+            if not entry[GROUP] and not entry[TEACHER]:
+                del self._by_chat[chat_id]
+        subscribers = self._subscribers[kind].get(key)
+        if subscribers:
+            subscribers.discard(chat_id)
+            if not subscribers:
+                del self._subscribers[kind][key]
+
+    def _forget(self, chat_id):
+        entry = self._by_chat.get(chat_id)
+        if not entry:
+            return
+        for kind in (GROUP, TEACHER):
+            for key in list(entry[kind]):
+                self._discard(chat_id, kind, key)
+
+    def toggle(self, chat_id, kind, key):
+        """Подписывает или отписывает; возвращает True, если подписка включена.
+
+        Состояние решает хранилище, а не память: подписку могли поменять
+        через другой узел.
+        """
+        with self._lock:
+            subscribed = self.storage.toggle_subscription(chat_id, kind, key)
+            if subscribed:
+                self._add(chat_id, kind, key)
+            else:
+                self._discard(chat_id, kind, key)
+        return subscribed
+
+    def remove_chats(self, chat_ids):
+        """Удаляет все подписки указанных чатов"""
+        with self._lock:
+            for chat_id in chat_ids:
+                self._forget(chat_id)
+            self.storage.remove_subscriptions_of(chat_ids)
+
+    def of(self, chat_id):
+        """Подписки чата в виде {'groups': [...], 'teachers': [...]}"""
+        entry = self._by_chat.get(chat_id) or {GROUP: set(), TEACHER: set()}
+        return {kind: sorted(keys) for kind, keys in entry.items()}
+
+    def subscribed_chats(self):
+        """Чаты, у которых есть хотя бы одна подписка"""
+        return set(self._by_chat)
+
+    def affected(self, diff):
+        """Подбирает подписчиков по изменениям.
+
+        Возвращает {chat_id: {'groups': [...], 'teachers': [...]}} только для
+        тех чатов, чьих групп или преподавателей касаются изменения.
+        """
+        result = {}
+        with self._lock:
+            for kind, keys in ((GROUP, diff.groups), (TEACHER, diff.teachers)):
+                subscribers = self._subscribers[kind]
+                for key in keys:
+                    for chat_id in subscribers.get(key, ()):
+                        entry = result.setdefault(chat_id, {GROUP: [], TEACHER: []})
+                        entry[kind].append(key)
+        return result
@@ -0,0 +1,187 @@
+import os
+import re
+import random
+import logging
+from datetime import datetime
+from html.parser import HTMLParser
+from models import Replacement
+
+logger = logging.getLogger(__name__)
+
+# Слова, по которым строка считается заголовком с датой
+DATE_WORDS = ['замены', 'понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота']
+
+# Теги, после которых браузер переносит текст на новую строку
+BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'table', 'li', 'ul', 'ol',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'thead', 'tbody', 'caption'}
+
+# Теги, содержимое которых не отображается
+HIDDEN_TAGS = {'script', 'style', 'head', 'title'}
+
+# Доля строк таблицы, которые пишутся в лог на уровне DEBUG (0 - ни одной).
+# Построчный лог всей таблицы медленный, поэтому включается явно и выборочно
+ROW_DEBUG_SAMPLE = float(os.environ.get("PARSER_ROW_DEBUG_SAMPLE", "0"))
+
+_spaces = re.compile(r'[ \t\r\f\v\u00a0]+')
+
+
+def _normalize(text):
+    """Схлопывает пробелы так же, как это делает браузер в element.text"""
+    lines = (_spaces.sub(' ', line).strip() for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+class ReplacementsTableParser(HTMLParser):
+    """Потоковый разбор HTML из fetch-rep без запуска браузера.
+
+    Собирает видимый текст документа (для поиска даты) и ячейки всех
+    строк таблиц в том же порядке, в котором их отдавал Selenium.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._text = []
+        self._row = None
+        self._cell = None
+        self._cell_tag = None
+        self._hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HIDDEN_TAGS:
+            self._hidden += 1
+            return
+        if tag in BLOCK_TAGS:
+            self._text.append('\n')
+        if tag == 'tr':
+            self._close_row()
+            self._row = []
+        elif tag in ('td', 'th'):
+            self._close_cell()
+            if self._row is None:
+                self._row = []
+            self._cell = []
+            self._cell_tag = tag
+        elif tag == 'br' and self._cell is not None:
+            self._cell.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in HIDDEN_TAGS:
+            self._hidden = max(self._hidden - 1, 0)
+            return
+        if tag in ('td', 'th'):
+            self._close_cell()
+            self._text.append(' ')
+        elif tag == 'tr':
+            self._close_row()
+        elif tag == 'table':
+            self._close_row()
+        if tag in BLOCK_TAGS:
+            self._text.append('\n')
+
+    def handle_data(self, data):
+        if self._hidden:
+            return
+        # Перевод строки в исходнике браузер показывает пробелом,
+        # строки разделяют только блочные теги и <br>
+        data = data.replace('\n', ' ')
+        self._text.append(data)
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+    def _close_cell(self):
+        if self._cell is None:
+            return
+        # Selenium ищет только td, заголовочные th в ячейки не попадают
+        if self._cell_tag == 'td':
+            self._row.append(_normalize(''.join(self._cell)))
+        self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    @property
+    def text(self):
+        return _normalize(''.join(self._text))
+
+
+def parse_date(text):
+    """Ищет строку с датой в первых строках текста"""
+    for line in text.split('\n')[:3]:  # Проверяем первые 3 строки
+        if any(word in line.lower() for word in DATE_WORDS):
+            raw_date = line.strip()
+            date_match = re.search(r'\d{2}\.\d{2}\.\d{2}', line)
+            date = None
+            if date_match:
+                date_obj = datetime.strptime(date_match.group(0), "%d.%m.%y")
+                date = date_obj.strftime("%Y-%m-%d")
+            return raw_date, date
+    return None, None
+
+
+def parse_rows(rows):
+    """Собирает группы и замены из строк таблицы"""
+    groups = {}
+    current_group = None
+    debug_rows = ROW_DEBUG_SAMPLE > 0 and logger.isEnabledFor(logging.DEBUG)
+    for cells in rows:
+        if not cells:
+            continue
+
+        # Пропускаем заголовки и служебные записи
+        first_cell = cells[0]
+        if (first_cell == "№ пары" or
+            "директор" in first_cell.lower() or
+            any("венедиктова" in cell.lower() for cell in cells)):
+            continue
+
+        # Если это строка с номером группы
+        if len(cells) == 1:
+            if first_cell.isdigit():
+                current_group = first_cell
+                groups[current_group] = []
+
+        # Если это строка с заменами
+        elif len(cells) >= 4 and current_group and current_group in groups:
+            replacement = Replacement(
+                pair=cells[0],
+                original_subject=cells[1],
+                teacher=cells[2],
+                new_subject=cells[3],
+                classroom=cells[4] if len(cells) > 4 else ""
+            )
+
+            # Добавляем только если есть реальные данные
+            if any(v for v in replacement.fields() if v and "венедиктова" not in v.lower()):
+                groups[current_group].append(replacement)
+                if debug_rows and random.random() < ROW_DEBUG_SAMPLE:
+                    logger.debug(f"Группа {current_group}: {replacement.fields()}")
+
+    # Удаляем пустые группы
+    return {k: v for k, v in groups.items() if v}
+
+
+def parse_replacements_html(html):
+    """Разбирает HTML из fetch-rep в структуру {date, raw_date, groups}"""
+    table_parser = ReplacementsTableParser()
+    table_parser.feed(html)
+    table_parser.close()
+
+    raw_date, date = parse_date(table_parser.text)
+    result = {
+        "date": date,
+        "raw_date": raw_date,
+        "groups": parse_rows(table_parser.rows)
+    }
+    logger.info(f"Всего обработано групп: {len(result['groups'])}")
+    return result
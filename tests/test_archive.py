@@ -0,0 +1,52 @@
+import json
+
+from archive import ReplacementsArchive
+from store import Snapshot
+
+
+def snapshot(day, teacher):
+    return Snapshot({
+        'date': day,
+        'raw_date': f"Замены {day}",
+        'groups': {'142': [{'pair': '5', 'original_subject': 'Химия', 'teacher': teacher,
+                            'new_subject': 'Физика', 'classroom': 'ДО'}]},
+    }, version=0)
+
+
+def test_days_are_read_on_first_query(tmp_path):
+    writer = ReplacementsArchive(str(tmp_path))
+    for day in ('2024-12-20', '2024-12-21', '2024-12-23'):
+        writer.on_swap(snapshot(day, 'Скарбинская Н.П.'))
+
+    archive = ReplacementsArchive(str(tmp_path)).load()
+    assert archive.dates() == ['2024-12-20', '2024-12-21', '2024-12-23']
+    assert all(value is None for value in archive._days.values())
+
+    days = archive.query('2024-12-21', '2024-12-23', teacher='Скарбинская Н.П.')
+    assert [day for day, _ in days] == ['2024-12-21', '2024-12-23']
+    assert archive._days['2024-12-20'] is None
+    assert archive.get('2024-12-22') is None
+
+
+def test_preload_reads_all_days(tmp_path):
+    ReplacementsArchive(str(tmp_path)).on_swap(snapshot('2024-12-21', 'Скарбинская Н.П.'))
+    archive = ReplacementsArchive(str(tmp_path)).load()
+    archive.preload().join()
+    assert archive._days['2024-12-21'].date == '2024-12-21'
+
+
+def test_broken_day_is_dropped(tmp_path):
+    (tmp_path / '2024-12-21.json').write_text('{', encoding='utf-8')
+    (tmp_path / 'notes.json').write_text(json.dumps({}), encoding='utf-8')
+    archive = ReplacementsArchive(str(tmp_path)).load()
+    assert archive.dates() == ['2024-12-21']
+    assert archive.query(group='142') == []
+    assert archive.dates() == []
+
+
+def test_same_day_is_not_rewritten_after_restart(tmp_path):
+    ReplacementsArchive(str(tmp_path)).on_swap(snapshot('2024-12-21', 'Скарбинская Н.П.'))
+    archive = ReplacementsArchive(str(tmp_path)).load()
+    assert not archive.on_swap(snapshot('2024-12-21', 'Скарбинская Н.П.'))
+    assert archive.on_swap(snapshot('2024-12-21', 'Иванова А.Б.'))
+    assert [name for name in tmp_path.iterdir() if name.suffix == '.tmp'] == []
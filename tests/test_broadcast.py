@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import telebot
+
+import broadcast
+from benchmarks.fake_bot_api import FakeBotApi
+from broadcast import Broadcaster
+
+
+class FakeClock:
+    """Часы, которые идут только во время ожидания"""
+
+    def __init__(self):
+        self.now = 1024.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_broadcaster(clock, sent):
+    # Частота - степень двойки, чтобы ожидания складывались с часами без ошибок округления
+    return Broadcaster(lambda chat_id, text: sent.append((clock.now, chat_id)), rate=128,
+                       per_chat_interval=1.0, workers=1, clock=clock, sleep=clock.sleep)
+
+
+def test_last_sent_forgets_chats_after_interval():
+    clock, sent = FakeClock(), []
+    broadcaster = make_broadcaster(clock, sent)
+
+    broadcaster.run(range(1000), "первая")
+    assert len(sent) == 1000
+    # Интервал последних чатов еще идет, первых - уже истек
+    assert 0 < len(broadcaster._last_sent) < 1000
+
+    clock.sleep(2)
+    broadcaster.run([1, 2], "вторая")
+    assert set(broadcaster._last_sent) <= {1, 2}
+
+
+def test_per_chat_interval_kept_between_runs():
+    clock, sent = FakeClock(), []
+    broadcaster = make_broadcaster(clock, sent)
+
+    broadcaster.run([7], "первая")
+    broadcaster.run([7], "вторая")
+    (first, _), (second, _) = sent
+    assert second - first >= 1.0
+
+
+class ScriptedBotApi(FakeBotApi):
+    """Bot API, который отвечает на отправку в чат заданными ошибками по очереди"""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = {chat_id: list(replies) for chat_id, replies in errors.items()}
+
+    def respond(self, method, params):
+        if method == 'sendMessage':
+            replies = self.errors.get(int(params['chat_id']))
+            if replies:
+                with self._lock:
+                    return replies.pop(0)
+        return super().respond(method, params)
+
+
+TOO_MANY = (429, "Too Many Requests: retry after 7", {'retry_after': 7})
+SERVER_ERROR = (502, "Bad Gateway", None)
+BLOCKED = (403, "Forbidden: bot was blocked by the user", None)
+
+
+@pytest.fixture
+def bot_api(monkeypatch):
+    apis = []
+
+    def start(errors):
+        api = ScriptedBotApi(errors).start()
+        apis.append(api)
+        monkeypatch.setattr(telebot.apihelper, 'API_URL', api.api_url)
+        return api, telebot.TeleBot('123456:test', threaded=False)
+
+    yield start
+    for api in apis:
+        api.stop()
+
+
+def sent_to(api):
+    return [int(params['chat_id']) for _, method, params in api.calls if method == 'sendMessage']
+
+
+def test_retry_after_pauses_all_sends(bot_api):
+    api, bot = bot_api({2: [TOO_MANY]})
+    clock = FakeClock()
+    broadcaster = Broadcaster(bot.send_message, rate=128, workers=1, clock=clock, sleep=clock.sleep)
+
+    stats = broadcaster.run([1, 2, 3], "замены")
+    assert (stats.sent, stats.retries, stats.failed) == (3, 1, 0)
+    assert sent_to(api) == [1, 2, 2, 3]
+    # Ожидание по retry_after идет по подмененным часам, а не по настоящим
+    assert 7 <= stats.elapsed < 8
+    assert broadcaster.bucket._paused_until >= 1024.0 + 7
+
+
+def test_server_errors_back_off_exponentially(bot_api):
+    api, bot = bot_api({1: [SERVER_ERROR, SERVER_ERROR, SERVER_ERROR], 2: [SERVER_ERROR] * 4})
+    clock = FakeClock()
+    delays = []
+
+    def sleep(seconds):
+        delays.append(seconds)
+        clock.sleep(seconds)
+
+    broadcaster = Broadcaster(bot.send_message, rate=128, per_chat_interval=0, workers=1, backoff=0.5,
+                              max_retries=3, clock=clock, sleep=sleep)
+    stats = broadcaster.run([1, 2], "замены")
+    assert (stats.sent, stats.failed, stats.retries) == (1, 1, 6)
+    assert delays == [0.5, 1.0, 2.0, 0.5, 1.0, 2.0]
+    assert sent_to(api) == [1] * 4 + [2] * 4
+
+
+def test_client_errors_are_not_retried(bot_api):
+    api, bot = bot_api({1: [(400, "Bad Request: message is too long", None)]})
+    clock = FakeClock()
+    stats = Broadcaster(bot.send_message, rate=128, workers=1, clock=clock, sleep=clock.sleep).run([1], "x")
+    assert (stats.failed, stats.retries) == (1, 0)
+    assert sent_to(api) == [1]
+
+
+def test_blocked_chats_removed_in_batches(bot_api):
+    blocked = set(range(0, 50, 2))
+    api, bot = bot_api({chat_id: [BLOCKED] for chat_id in blocked})
+    clock = FakeClock()
+    batches = []
+    broadcaster = Broadcaster(bot.send_message, rate=128, workers=4, prune_batch=10,
+                              on_blocked=batches.append, clock=clock, sleep=clock.sleep)
+
+    stats = broadcaster.run(range(50), "замены")
+    assert (stats.sent, stats.blocked, stats.retries) == (25, 25, 0)
+    assert all(len(batch) >= 10 for batch in batches[:-1])
+    assert len(batches) < len(blocked)
+    assert sorted(chat_id for batch in batches for chat_id in batch) == sorted(blocked)
+
+
+def test_jobs_submitted_in_bounded_window(monkeypatch):
+    outstanding = []
+    most = []
+
+    class CountingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            outstanding.append(1)
+            most.append(len(outstanding))
+            future = super().submit(*args, **kwargs)
+            future.add_done_callback(lambda _: outstanding.pop())
+            return future
+
+    monkeypatch.setattr(broadcast, 'ThreadPoolExecutor', CountingExecutor)
+    sent = []
+    broadcaster = Broadcaster(lambda chat_id, text: sent.append(chat_id), rate=10 ** 9,
+                              per_chat_interval=0, workers=2)
+    stats = broadcaster.run(range(5000), "замены")
+    assert stats.sent == 5000
+    assert sorted(sent) == list(range(5000))
+    assert max(most) <= 2 * broadcast.SUBMIT_AHEAD + 1
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import callbacks
+from render import (GROUPS_PAGE_SIZE, TEACHERS_PAGE_SIZE, build_groups_keyboard, build_matches_keyboard,
+                    build_teachers_keyboard)
+from store import Snapshot
+
+LONG_TEACHER = 'Константинопольская-Вишневецкая А.В.'
+LONG_GROUP = '123456789'
+
+
+def make_snapshot(subject='Химия', teachers=1200):
+    groups = {}
+    for number in range(teachers):
+        groups[str(1000 + number)] = [{'pair': '1', 'original_subject': subject,
+                                       'teacher': f"Преподаватель{number:04} А.Б.",
+                                       'new_subject': 'Физика', 'classroom': '108'}]
+    groups[LONG_GROUP] = [{'pair': '2', 'original_subject': subject, 'teacher': LONG_TEACHER,
+                           'new_subject': 'Физика', 'classroom': '108'}]
+    return Snapshot({'date': '2024-12-21', 'raw_date': 'Замены суббота 21.12.24', 'groups': groups}, version=1)
+
+
+def buttons(keyboard):
+    return [button for row in json.loads(keyboard)['inline_keyboard'] for button in row]
+
+
+def test_pack_unpack():
+    data = callbacks.pack(callbacks.DAY_GROUP, '2024-12-21', 17, '3fa9c2d1')
+    assert data == 'ag:2024-12-21:17:3fa9c2d1'
+    assert callbacks.unpack(data) == ('ag', ['2024-12-21', '17', '3fa9c2d1'])
+    assert callbacks.unpack(callbacks.pack(callbacks.NOOP)) == ('n', [])
+
+
+def test_pack_limit_is_counted_in_bytes():
+    assert len(callbacks.pack('t', 'я' * 31).encode('utf-8')) == 64
+    with pytest.raises(ValueError):
+        callbacks.pack('t', 'я' * 32)
+    callbacks.pack('t', 'x' * 62)
+    with pytest.raises(ValueError):
+        callbacks.pack('t', 'x' * 63)
+
+
+@pytest.mark.parametrize('position', ['-1', '3', '', 'abc', '1.5', None, '99999999999999999999'])
+def test_resolve_rejects_bad_positions(position):
+    assert callbacks.resolve(['a', 'b', 'c'], position) is None
+
+
+def test_resolve():
+    assert callbacks.resolve(['a', 'b', 'c'], '2') == 'c'
+    assert callbacks.resolve(['a', 'b', 'c'], 0) == 'a'
+
+
+@pytest.mark.parametrize('day', [None, '2024-12-21'])
+def test_keyboards_round_trip_longest_names(day):
+    snapshot = make_snapshot()
+    index = snapshot.index
+    for build, items, page_size in ((build_teachers_keyboard, index.teachers, TEACHERS_PAGE_SIZE),
+                                    (build_groups_keyboard, index.groups, GROUPS_PAGE_SIZE)):
+        longest = max(items, key=lambda name: len(name.encode('utf-8')))
+        assert longest in (LONG_TEACHER, LONG_GROUP)
+        seen = set()
+        # Первая страница, страница с самым длинным названием и последняя
+        for page in (0, items.index(longest) // page_size, len(items) // page_size):
+            for button in buttons(build(items, snapshot.token, page=page, day=day)):
+                data = button['callback_data']
+                assert len(data.encode('utf-8')) <= callbacks.MAX_LENGTH
+                kind, parts = callbacks.unpack(data)
+                if kind in (callbacks.NOOP, callbacks.GROUPS_PAGE, callbacks.TEACHERS_PAGE,
+                            callbacks.DAY_GROUPS_PAGE, callbacks.DAY_TEACHERS_PAGE):
+                    continue
+                if day is not None:
+                    assert parts[0] == day
+                    parts = parts[1:]
+                position, token = parts
+                assert token == snapshot.token
+                assert callbacks.resolve(items, position) == button['text']
+                seen.add(button['text'])
+        assert longest in seen
+
+
+def test_search_buttons_round_trip():
+    snapshot = make_snapshot()
+    position = snapshot.index.teachers.index(LONG_TEACHER)
+    match = type('Match', (), {'kind': callbacks.TEACHER, 'name': LONG_TEACHER, 'position': position})
+    (button,) = buttons(build_matches_keyboard([match], snapshot.token))
+    kind, (found, token) = callbacks.unpack(button['callback_data'])
+    assert (kind, token) == (callbacks.TEACHER, snapshot.token)
+    assert callbacks.resolve(snapshot.index.teachers, found) == LONG_TEACHER
+
+
+def test_tokens_survive_restart_and_go_stale_on_change():
+    # Номер в кнопке верен только для снимка с той же меткой
+    snapshot = make_snapshot(teachers=10)
+    _, (_, token) = callbacks.unpack(callbacks.pack(callbacks.TEACHER, 0, snapshot.token))
+    assert make_snapshot(teachers=10).token == token
+    assert make_snapshot('Биология', teachers=10).token != token
+    assert make_snapshot(teachers=11).token != token
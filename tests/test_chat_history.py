@@ -0,0 +1,134 @@
+import json
+
+import pytest
+import telebot
+
+from benchmarks.fake_bot_api import FakeBotApi
+from chat_history import DELETE_BATCH, ChatCleaner, ChatHistory, TrackingBot
+
+
+class FakeClock:
+    """Часы, которые идут только во время ожидания"""
+
+    def __init__(self):
+        self.now = 1024.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ScriptedBotApi(FakeBotApi):
+    """Bot API, который отвечает на deleteMessages заданными ошибками по очереди"""
+
+    def __init__(self, errors=()):
+        super().__init__()
+        self.errors = list(errors)
+
+    def respond(self, method, params):
+        if method == 'deleteMessages' and self.errors:
+            with self._lock:
+                return self.errors.pop(0)
+        return super().respond(method, params)
+
+
+@pytest.fixture
+def bot_api(monkeypatch):
+    apis = []
+
+    def start(errors=()):
+        api = ScriptedBotApi(errors).start()
+        apis.append(api)
+        monkeypatch.setattr(telebot.apihelper, 'API_URL', api.api_url)
+        return api, TrackingBot('123456:test', ChatHistory(), threaded=False)
+
+    yield start
+    for api in apis:
+        api.stop()
+
+
+def deleted(api):
+    return [json.loads(params['message_ids']) for _, method, params in api.calls if method == 'deleteMessages']
+
+
+def run_cleaner(bot, clock, chat_id, message_ids, **kwargs):
+    cleaner = ChatCleaner(bot.delete_messages, clock=clock, sleep=clock.sleep, **kwargs)
+    cleaner.start()
+    cleaner.clear(chat_id, message_ids)
+    cleaner.join()
+    return cleaner
+
+
+def test_history_keeps_last_messages_per_chat():
+    history = ChatHistory(per_chat=3)
+    for message_id in range(1, 6):
+        history.remember(7, message_id)
+    assert history.take(7) == [3, 4, 5]
+    assert history.take(7) == []
+
+
+def test_history_evicts_least_recent_chat():
+    history = ChatHistory(per_chat=3, max_chats=2)
+    history.remember(1, 10)
+    history.remember(2, 20)
+    # Чат 1 снова активен, поэтому вытесняется чат 2
+    history.remember(1, 11)
+    history.remember(3, 30)
+    assert history.take(2) == []
+    assert history.take(1) == [10, 11]
+    assert history.take(3) == [30]
+
+
+def test_tracking_bot_remembers_messages(bot_api):
+    api, bot = bot_api()
+    sent = bot.send_message(5, "Привет")
+    incoming = telebot.types.Message.de_json({
+        'message_id': 3, 'date': 0, 'text': 'Очистить',
+        'chat': {'id': 5, 'type': 'private'}, 'from': {'id': 5, 'is_bot': False, 'first_name': 'user'},
+    })
+    bot.process_new_messages([incoming])
+    assert sorted(bot.history.take(5)) == sorted([sent.message_id, 3])
+
+
+def test_messages_deleted_in_batches_newest_first(bot_api):
+    api, bot = bot_api()
+    clock = FakeClock()
+    cleaner = run_cleaner(bot, clock, 5, list(range(1, 251)) + [250], rate=128)
+
+    batches = deleted(api)
+    assert [len(batch) for batch in batches] == [DELETE_BATCH, DELETE_BATCH, 50]
+    assert batches[0][0] == 250 and batches[-1][-1] == 1
+    assert sorted(sum(batches, [])) == list(range(1, 251))
+    assert cleaner.stats == {'chats': 1, 'calls': 3, 'messages': 250, 'errors': 0}
+
+
+def test_calls_are_paced_by_token_bucket(bot_api):
+    api, bot = bot_api()
+    clock = FakeClock()
+    run_cleaner(bot, clock, 5, range(1, 6 * DELETE_BATCH + 1), rate=2)
+    assert len(deleted(api)) == 6
+    # Два вызова сразу из полного ведра, остальные четыре по 0.5 с
+    assert clock.now - 1024.0 == 2.0
+
+
+def test_retry_after_429(bot_api):
+    api, bot = bot_api([(429, "Too Many Requests: retry after 8", {'retry_after': 8})])
+    clock = FakeClock()
+    cleaner = run_cleaner(bot, clock, 5, range(1, 11), rate=128)
+    assert len(deleted(api)) == 2
+    assert clock.now - 1024.0 >= 8
+    assert cleaner.stats['errors'] == 0
+    assert cleaner.stats['messages'] == 10
+
+
+def test_gives_up_after_retries_and_other_errors(bot_api):
+    too_many = (429, "Too Many Requests: retry after 1", {'retry_after': 1})
+    api, bot = bot_api([too_many] * 3 + [(400, "Bad Request: message can't be deleted", None)])
+    clock = FakeClock()
+    cleaner = run_cleaner(bot, clock, 5, range(1, DELETE_BATCH + 11), rate=128, max_retries=2)
+    # Первая пачка: три ответа 429 - попытки кончились; вторая пачка: 400 без повтора
+    assert len(deleted(api)) == 4
+    assert cleaner.stats['errors'] == 2
+    assert cleaner.stats['messages'] == 0
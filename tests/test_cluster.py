@@ -0,0 +1,243 @@
+import json
+import threading
+import time
+
+import pytest
+
+import cluster
+from cluster import ClusterNode, RedisBackend, SharedUserSources, SqliteBackend
+from store import ReplacementsStore
+from subscriptions import GROUP, Subscriptions
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def replacements(subject):
+    return {
+        'date': '2024-12-21',
+        'raw_date': 'Замены суббота 21.12.24',
+        'groups': {'142': [{'pair': '5', 'original_subject': 'Химия', 'teacher': 'Скарбинская Н.П.',
+                            'new_subject': subject, 'classroom': 'ДО'}]},
+    }
+
+
+@pytest.fixture
+def server():
+    if fakeredis is None:
+        pytest.skip("нужен пакет fakeredis")
+    return fakeredis.FakeServer()
+
+
+def backend(server):
+    return RedisBackend(client=fakeredis.FakeRedis(server=server))
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_publish_writes_version_with_snapshot(server):
+    shared = backend(server)
+    assert shared.latest_snapshot('kit') is None
+
+    first = shared.publish_snapshot('kit', 'a', replacements('Физика'))
+    second = shared.publish_snapshot('west', 'b', replacements('Химия'))
+
+    assert (first, second) == (1, 2)
+    assert shared.version() == 2
+    assert shared.latest_snapshot('kit') == (1, 'a', replacements('Физика'))
+    assert shared.latest_snapshot('west')[:2] == (2, 'b')
+
+
+def test_publish_notifies_waiting_node(server):
+    shared = backend(server)
+    follower = backend(server)
+    assert follower.wait_for_change(0, timeout=0.1) == 0
+
+    shared.publish_snapshot('kit', 'a', replacements('Физика'))
+    assert follower.wait_for_change(0, timeout=1) == 1
+
+
+def test_lease_is_exclusive_until_released(server):
+    first, second = backend(server), backend(server)
+    assert first.acquire_lease('leader', 'a', ttl=30)
+    assert first.acquire_lease('leader', 'a', ttl=30)
+    assert not second.acquire_lease('leader', 'b', ttl=30)
+
+    first.release_lease('leader', 'a')
+    assert second.acquire_lease('leader', 'b', ttl=30)
+
+
+def test_follower_receives_snapshot_from_leader(server, tmp_path):
+    leader_store = ReplacementsStore(str(tmp_path / 'leader.json'), source='kit')
+    follower_store = ReplacementsStore(str(tmp_path / 'follower.json'), source='kit')
+    leader = ClusterNode(backend(server), {'kit': leader_store}, node_id='leader', change_timeout=1)
+    follower = ClusterNode(backend(server), {'kit': follower_store}, node_id='follower', change_timeout=1)
+    leader_store.subscribe(leader.publish)
+    try:
+        leader.start()
+        follower.start()
+        assert leader.is_leader() and not follower.is_leader()
+
+        leader_store.ingest(replacements('Физика'))
+        assert wait_until(lambda: follower_store.current() is not None)
+        leader_store.ingest(replacements('Химия'))
+        assert wait_until(lambda: follower_store.current().digest == leader_store.current().digest)
+    finally:
+        follower.stop()
+        leader.stop()
+
+
+def test_follower_does_not_skip_snapshot_written_after_counter(server, tmp_path):
+    shared = backend(server)
+    store = ReplacementsStore(str(tmp_path / 'follower.json'), source='kit')
+    follower = ClusterNode(backend(server), {'kit': store}, node_id='follower', change_timeout=1)
+    # Другой узел держит аренду, этот только принимает снимки
+    shared.acquire_lease('leader', 'leader', ttl=30)
+    # Счетчик увеличен, а снимок еще не записан
+    shared.client.set(shared._key('version'), 1)
+    try:
+        follower.start()
+        time.sleep(0.3)
+        payload = {'version': 1, 'digest': 'a', 'data': replacements('Физика')}
+        shared.client.set(shared._key('snapshot:kit'), json.dumps(payload, ensure_ascii=False))
+        assert wait_until(lambda: store.current() is not None)
+    finally:
+        follower.stop()
+
+
+def test_shards_are_claimed_once(server):
+    shared = backend(server)
+    shared.push_tasks([{'chat_ids': [1, 2], 'text': 'a'}, {'chat_ids': [3], 'text': 'b'}])
+    assert shared.pending_tasks() == 2
+
+    first = shared.claim_task(visibility=60)
+    second = backend(server).claim_task(visibility=60)
+    assert {first[1]['text'], second[1]['text']} == {'a', 'b'}
+    assert shared.claim_task(visibility=60) is None
+
+    shared.complete_task(first[0])
+    shared.complete_task(second[0])
+    assert shared.pending_tasks() == 0
+
+
+def test_unfinished_shard_returns_to_queue(server):
+    shared = backend(server)
+    shared.push_tasks([{'chat_ids': [1], 'text': 'a'}])
+    task_id, _ = shared.claim_task(visibility=0)
+    assert shared.claim_task(visibility=60)[0] == task_id
+
+
+def test_concurrent_claims_take_each_shard_once(server):
+    shared = backend(server)
+    shared.push_tasks([{'chat_ids': [i], 'text': str(i)} for i in range(50)])
+    claimed = []
+
+    def worker():
+        node = backend(server)
+        while (task := node.claim_task(visibility=60)) is not None:
+            claimed.append(task[0])
+            # Взятая часть уже числится за узлом, пока он ее не завершил
+            assert node.client.zscore(node._key('claimed'), task[0]) is not None
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(set(claimed))
+    assert len(claimed) == 50
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def make_shared(request, tmp_path):
+    """Создает клиентов одного общего хранилища, как у разных узлов"""
+    if request.param == 'redis' and fakeredis is None:
+        pytest.skip("нужен пакет fakeredis")
+    server = fakeredis.FakeServer() if fakeredis else None
+    created = []
+
+    def make():
+        if request.param == 'sqlite':
+            shared = SqliteBackend(str(tmp_path / 'cluster.db'), poll_interval=0.02)
+        else:
+            shared = backend(server)
+        created.append(shared)
+        return shared
+
+    yield make
+    for shared in created:
+        shared.close()
+
+
+def start_node(shared, node_id, subscriptions, chosen):
+    node = ClusterNode(shared, {}, node_id=node_id, change_timeout=0.2)
+    node.subscribe_users(subscriptions.refresh)
+    node.subscribe_users(chosen.invalidate)
+    node.start()
+    return node
+
+
+def test_subscription_toggled_on_other_node_is_seen(make_shared):
+    first_backend, second_backend = make_shared(), make_shared()
+    first, second = Subscriptions(first_backend, legacy_file=None), Subscriptions(second_backend, legacy_file=None)
+    first_sources, second_sources = SharedUserSources(first_backend), SharedUserSources(second_backend)
+    nodes = [start_node(first_backend, 'a', first, first_sources),
+             start_node(second_backend, 'b', second, second_sources)]
+    first.load()
+    second.load()
+    try:
+        assert first.toggle(7, GROUP, '142') is True
+        assert wait_until(lambda: second.of(7)[GROUP] == ['142'])
+
+        # Нажатие на другом узле выключает подписку, а не включает ее повторно
+        assert second.toggle(7, GROUP, '142') is False
+        assert wait_until(lambda: first.of(7)[GROUP] == [])
+        assert first_backend.load_subscriptions() == []
+    finally:
+        for node in nodes:
+            node.stop()
+
+
+def test_source_chosen_on_other_node_is_seen(make_shared):
+    first_backend, second_backend = make_shared(), make_shared()
+    first_sources, second_sources = SharedUserSources(first_backend), SharedUserSources(second_backend)
+    nodes = [start_node(first_backend, 'a', Subscriptions(first_backend, legacy_file=None), first_sources),
+             start_node(second_backend, 'b', Subscriptions(second_backend, legacy_file=None), second_sources)]
+    try:
+        assert second_sources.source_of(7) is None
+        first_sources.set_source(7, 'west')
+        assert wait_until(lambda: second_sources.source_of(7) == 'west')
+    finally:
+        for node in nodes:
+            node.stop()
+
+
+def test_sqlite_reports_lost_user_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cluster, 'USER_CHANGES_KEPT', 2)
+    shared = SqliteBackend(str(tmp_path / 'cluster.db'))
+    cursor = shared.user_changes_cursor()
+    shared.set_user_source(1, 'kit')
+    assert shared.wait_for_user_changes(cursor, timeout=0) == (1, [1])
+
+    for chat_id in range(2, 7):
+        shared.set_user_source(chat_id, 'kit')
+    # Часть изменений уже удалена: узлу нужно перечитать всех
+    assert shared.wait_for_user_changes(1, timeout=0) == (6, None)
+    shared.close()
+
+
+def test_markers(make_shared):
+    shared = make_shared()
+    assert not shared.has_marker('migrated:a')
+    shared.set_marker('migrated:a')
+    shared.set_marker('migrated:a')
+    assert shared.has_marker('migrated:a') and not shared.has_marker('migrated:b')
@@ -0,0 +1,50 @@
+from diff import diff_snapshots
+from render import render_changes
+from store import Snapshot
+
+
+def snapshot(date, raw_date, groups):
+    return Snapshot({'date': date, 'raw_date': raw_date, 'groups': groups}, 1).data
+
+
+def row(pair, subject, teacher):
+    return {'pair': pair, 'original_subject': 'Химия', 'teacher': teacher, 'new_subject': subject, 'classroom': '301'}
+
+
+FRIDAY = snapshot('2024-12-20', 'Замены пятница 20.12.24', {
+    '142': [row('1', 'Физика', 'Иванов И.И.')],
+    '215': [row('3', 'История', 'Петров П.П.')],
+})
+
+
+def test_same_day_lists_changes():
+    updated = snapshot('2024-12-20', 'Замены пятница 20.12.24', {
+        '142': [row('1', 'Физика', 'Иванов И.И.'), row('2', 'Биология', 'Иванов И.И.')],
+    })
+    diff = diff_snapshots(FRIDAY, updated)
+
+    assert not diff.date_changed
+    assert [r.new_subject for r in diff.groups['142'].added] == ['Биология']
+    assert [r.new_subject for r in diff.groups['215'].removed] == ['История']
+
+    text = render_changes(updated, diff, {'groups': ['142'], 'teachers': []})
+    assert text.startswith('🔔 Изменения в заменах на Замены пятница 20.12.24')
+    assert '➕ Новые замены:' in text
+
+
+def test_new_day_is_not_diffed_against_previous_day():
+    saturday = snapshot('2024-12-21', 'Замены суббота 21.12.24', {
+        '142': [row('1', 'Физика', 'Иванов И.И.'), row('5', 'Литература', 'Сидорова А.А.')],
+    })
+    diff = diff_snapshots(FRIDAY, saturday)
+
+    assert diff.date_changed
+    assert set(diff.groups) == {'142'}
+    # Та же строка, что вчера, - тоже замена нового дня
+    assert [r.new_subject for r in diff.groups['142'].added] == ['Физика', 'Литература']
+    assert not diff.groups['142'].removed and not diff.groups['142'].changed
+
+    text = render_changes(saturday, diff, {'groups': ['142'], 'teachers': ['Сидорова А.А.']})
+    assert text.startswith('🔔 Новые замены на Замены суббота 21.12.24')
+    assert 'Больше не действует' not in text and '➕' not in text
+    assert text.count('Литература') == 2
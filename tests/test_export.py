@@ -0,0 +1,209 @@
+import gzip
+import http.client
+import json
+from urllib.parse import quote
+
+import pytest
+
+from export import (DEFAULT_PAIR_TIMES, ExportBody, ExportCache, ExportServer, _fold, _ical_text,
+                    accepts_gzip, build_calendar, etag_matches, parse_pair_times)
+from models import CANCELLED
+from store import ReplacementsStore
+
+TEACHER = 'Скарбинская Н.П.'
+
+
+def replacements(subject='Индивидуальный проект'):
+    return {
+        'date': '2024-12-21',
+        'raw_date': 'Замены суббота 21.12.24',
+        'groups': {
+            '142': [{'pair': '5', 'original_subject': 'Химия', 'teacher': TEACHER,
+                     'new_subject': subject, 'classroom': 'ДО'}],
+            '251': [{'pair': '1', 'original_subject': 'Физика', 'teacher': CANCELLED,
+                     'new_subject': '', 'classroom': ''}],
+        },
+    }
+
+
+def start_server(directory):
+    main = ReplacementsStore(str(directory / 'replacements.json'))
+    west = ReplacementsStore(str(directory / 'replacements_west.json'))
+    main.ingest(replacements())
+    west.ingest(replacements('Информатика'))
+    cache = ExportCache(main)
+    server = ExportServer(cache, port=0, sources={'kit': cache, 'west': ExportCache(west)})
+    server.start()
+    server.store = main
+    return server
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    server = start_server(tmp_path_factory.mktemp('export'))
+    yield server
+    server.stop()
+
+
+def request(server, path, method='GET', **headers):
+    connection = http.client.HTTPConnection(*server.address, timeout=5)
+    try:
+        connection.request(method, path, headers=headers)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def test_json_and_etag(server):
+    status, headers, body = request(server, '/api/groups/142.json')
+    assert status == 200
+    assert headers['Content-Type'].startswith('application/json')
+    assert json.loads(body)['replacements'][0]['new_subject'] == 'Индивидуальный проект'
+
+    status, again, body = request(server, '/api/groups/142.json', **{'If-None-Match': headers['ETag']})
+    assert (status, body) == (304, b'')
+    assert again['ETag'] == headers['ETag']
+
+    status, _, _ = request(server, '/api/groups/142.json', **{'If-None-Match': '"other"'})
+    assert status == 200
+
+
+def test_etag_changes_with_snapshot(tmp_path):
+    server = start_server(tmp_path)
+    try:
+        _, headers, _ = request(server, '/api/groups/142.json')
+        server.store.ingest(replacements('Математика'))
+        status, changed, body = request(server, '/api/groups/142.json', **{'If-None-Match': headers['ETag']})
+        assert status == 200
+        assert changed['ETag'] != headers['ETag']
+        assert json.loads(body)['replacements'][0]['new_subject'] == 'Математика'
+    finally:
+        server.stop()
+
+
+def test_gzip_negotiation(server):
+    _, plain_headers, plain = request(server, '/api/replacements.json')
+    status, headers, body = request(server, '/api/replacements.json', **{'Accept-Encoding': 'br, gzip'})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == plain
+    assert headers['ETag'] != plain_headers['ETag']
+
+    _, headers, body = request(server, '/api/replacements.json', **{'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in headers
+    assert body == plain
+
+    # Слабый ETag от прокси тоже подходит
+    status, _, _ = request(server, '/api/replacements.json', **{'If-None-Match': f'W/{plain_headers["ETag"]}'})
+    assert status == 304
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, False),
+    ('gzip', True),
+    ('deflate, gzip;q=0.5', True),
+    ('*', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.000', False),
+    ('*;q=0', False),
+    ('identity', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+
+def test_etag_matches():
+    body = ExportBody('text/plain', 'тело')
+    assert etag_matches('*', body)
+    assert etag_matches(f'"x", {body.gzip_etag}', body)
+    assert etag_matches(f'W/{body.etag}', body)
+    assert not etag_matches('"x"', body)
+    assert not etag_matches(None, body)
+
+
+def test_head_has_no_body(server):
+    status, headers, body = request(server, '/api/teachers.json', method='HEAD')
+    assert status == 200
+    assert int(headers['Content-Length']) > 0
+    assert body == b''
+
+
+def test_teacher_calendar(server):
+    status, headers, body = request(server, '/api/teachers/' + quote(TEACHER) + '.ics')
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/calendar')
+    text = body.decode('utf-8')
+    assert 'DTSTART;TZID=Europe/Moscow:20241221T121000' in text
+    assert 'LOCATION:Дистанционно' in text
+
+
+def test_sources(server):
+    _, _, body = request(server, '/api/sources/west/groups/142.json')
+    assert json.loads(body)['replacements'][0]['new_subject'] == 'Информатика'
+    _, _, body = request(server, '/api/sources/kit/groups/142.json')
+    assert json.loads(body)['replacements'][0]['new_subject'] == 'Индивидуальный проект'
+
+
+@pytest.mark.parametrize('path', [
+    '/api/sources/unknown/groups.json',
+    '/api/sources/' + quote('нет') + '/groups.json',
+    '/api/sources/',
+    '/api/sources/west',
+    '/api/groups/999.json',
+    '/api/groups/142.xml',
+    '/api/teachers/',
+    '/replacements.json',
+])
+def test_unknown_paths(server, path):
+    status, _, body = request(server, path)
+    assert (status, body) == (404, b'')
+
+
+def test_no_snapshot_yet(tmp_path):
+    server = ExportServer(ExportCache(ReplacementsStore(str(tmp_path / 'replacements.json'))), port=0)
+    server.start()
+    try:
+        assert request(server, '/api/groups.json')[0] == 404
+    finally:
+        server.stop()
+
+
+def test_ical_text():
+    assert _ical_text('a\\b;c,d\ne') == r'a\\b\;c\,d\ne'
+
+
+def test_fold_keeps_utf8_and_line_length():
+    line = 'SUMMARY:' + 'Индивидуальный проект, ' * 10
+    folded = _fold(line)
+    parts = folded.split('\r\n')
+    assert all(len(part.encode('utf-8')) <= 75 for part in parts)
+    assert all(part.startswith(' ') for part in parts[1:])
+    assert ''.join(part[1:] if n else part for n, part in enumerate(parts)) == line
+    assert _fold('SUMMARY:коротко') == 'SUMMARY:коротко'
+
+
+def test_calendar_uses_pair_times():
+    store = ReplacementsStore('/dev/null')
+    snapshot = store.swap(replacements())
+    rows = [replacement.with_group(group) for group in ('142', '251')
+            for _, replacement in snapshot.index.group_pairs[group]]
+
+    text = build_calendar(snapshot, 'группы 142', rows)
+    assert 'DTSTART;TZID=Europe/Moscow:20241221T083000' in text
+    assert 'STATUS:CANCELLED' in text
+
+    text = build_calendar(snapshot, 'группы 142', rows, {3: ('12:00', '13:30')})
+    assert 'DTSTART;TZID=Europe/Moscow:20241221T120000' in text
+    # Пары без времени в календарь не попадают
+    assert 'STATUS:CANCELLED' not in text
+
+
+def test_parse_pair_times():
+    assert parse_pair_times('1=09:00-10:30, 2=10:40-12:10') == {1: ('09:00', '10:30'), 2: ('10:40', '12:10')}
+    assert parse_pair_times({'1': ['09:00', '10:30'], '2': '10:40-12:10'}) == {1: ('09:00', '10:30'),
+                                                                              2: ('10:40', '12:10')}
+    assert parse_pair_times({str(pair): list(times) for pair, times in DEFAULT_PAIR_TIMES.items()}) == DEFAULT_PAIR_TIMES
+    with pytest.raises(ValueError):
+        parse_pair_times('1=9:00-10:30')
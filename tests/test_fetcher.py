@@ -0,0 +1,141 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import parser
+from fetcher import Fetcher
+
+PAGE = """<p>Замены суббота 21.12.24 нечетная</p>
+<table><tr><td>142</td></tr>
+<tr><td>5</td><td>Химия</td><td>Скарбинская Н.П.</td><td>Индивидуальный проект</td><td>ДО</td></tr></table>"""
+
+
+class PageServer:
+    """Локальная замена сайта замен: одна страница с ETag или без него"""
+
+    def __init__(self, body, etag=None):
+        self.body = body
+        self.etag = etag
+        self.requests = []  # If-None-Match каждого запроса
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/replacements/api/fetch-rep"
+
+    def _handler(self):
+        page = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                page.requests.append(self.headers.get('If-None-Match'))
+                if page.etag and self.headers.get('If-None-Match') == page.etag:
+                    self.send_response(304)
+                    self.send_header('ETag', page.etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = page.body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if page.etag:
+                    self.send_header('ETag', page.etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def test_not_modified_after_commit():
+    with PageServer(PAGE, etag='"v1"') as server:
+        fetcher = Fetcher(server.url)
+        first = fetcher.fetch()
+        assert first.changed and first.content == PAGE
+        fetcher.commit()
+
+        second = fetcher.fetch()
+        assert server.requests == [None, '"v1"']
+        assert not second.changed and second.content == PAGE
+        assert fetcher.stats['not_modified'] == 1
+
+
+def test_unchanged_body_without_etag():
+    with PageServer(PAGE) as server:
+        fetcher = Fetcher(server.url)
+        fetcher.fetch()
+        fetcher.commit()
+
+        result = fetcher.fetch()
+        assert not result.changed and result.content == PAGE
+        assert fetcher.stats['unchanged'] == 1
+
+        server.body = PAGE.replace('Химия', 'Физика')
+        result = fetcher.fetch()
+        assert result.changed and 'Физика' in result.content
+
+
+def test_uncommitted_response_is_fetched_again():
+    with PageServer(PAGE, etag='"v1"') as server:
+        fetcher = Fetcher(server.url)
+        assert fetcher.fetch().changed
+        # Без commit, например разбор упал: валидаторы не отправляются
+        assert fetcher.fetch().changed
+        assert server.requests == [None, None]
+
+
+def test_parse_error_does_not_hide_page(monkeypatch):
+    def broken(content):
+        raise ValueError("таблица не разобрана")
+
+    monkeypatch.setattr('table_parser.parse_replacements_html', broken)
+    monkeypatch.setattr(parser, 'get_replacements_selenium', broken)
+    with PageServer(PAGE, etag='"v1"') as server:
+        fetcher = Fetcher(server.url)
+        assert 'error' in parser.get_replacements(skip_unchanged=True, fetcher=fetcher)
+
+        monkeypatch.undo()
+        data = parser.get_replacements(skip_unchanged=True, fetcher=fetcher)
+        assert data['date'] == '2024-12-21'
+        assert data['groups']['142'][0].new_subject == 'Индивидуальный проект'
+
+        fetcher.commit()
+        assert parser.get_replacements(skip_unchanged=True, fetcher=fetcher) is parser.NOT_MODIFIED
+
+
+def test_source_timeout_keeps_page_for_next_poll(tmp_path, monkeypatch):
+    import sources
+    monkeypatch.chdir(tmp_path)
+    release = threading.Event()
+    original = parser.get_replacements
+
+    def slow(*args, **kwargs):
+        release.wait(5)
+        return original(*args, **kwargs)
+
+    with PageServer(PAGE, etag='"v1"') as server:
+        source = sources.Source('slow', 'Медленный', server.url, timeout=0.2, primary=True)
+        monkeypatch.setattr(parser, 'get_replacements', slow)
+        assert 'error' in source.fetch()
+        # Опрос доработал в фоне, но его результат никто не сохранил
+        release.set()
+        source._pending.result(5)
+        monkeypatch.setattr(parser, 'get_replacements', original)
+
+        assert source.fetch()['groups']['142']
+        source.commit()
+        assert source.fetch() is parser.NOT_MODIFIED
@@ -0,0 +1,131 @@
+import json
+import threading
+from datetime import datetime
+
+from scheduler import PollScheduler
+
+
+class FakeClock:
+    def __init__(self, moment):
+        self.now = moment.timestamp()
+
+    def __call__(self):
+        return self.now
+
+    def set(self, moment):
+        self.now = moment.timestamp()
+
+
+def make_scheduler(moment, rand=lambda: 0.5, **kwargs):
+    """Планировщик без файла истории и без случайного сдвига (rand=0.5)"""
+    clock = FakeClock(moment)
+    return PollScheduler(history_file=None, clock=clock, rand=rand, **kwargs), clock
+
+
+def at(hour, minute=0, day=20):
+    return datetime(2024, 12, day, hour, minute)
+
+
+def polled(scheduler, polls=2):
+    for _ in range(polls):
+        scheduler.record_success()
+    return scheduler
+
+
+def test_prior_window_is_polled_densely():
+    scheduler, _ = make_scheduler(at(17, 10))
+    assert scheduler.next_delay() == scheduler.dense_interval
+
+
+def test_sparse_delay_does_not_skip_hot_window():
+    scheduler, clock = make_scheduler(at(12))
+    assert scheduler.next_delay() == scheduler.sparse_interval
+
+    clock.set(at(16, 50))
+    assert scheduler.next_delay() == 10 * 60
+
+
+def test_buckets_are_learned_from_history():
+    scheduler, clock = make_scheduler(at(8, 10))
+    polled(scheduler)
+    assert scheduler.next_delay() == scheduler.sparse_interval
+
+    for day in range(1, 21):
+        scheduler.record_change(at(8, 5, day=day).timestamp())
+    hot = scheduler.hot_buckets()
+    assert {scheduler._bucket(at(7, 50).timestamp()), scheduler._bucket(at(8, 5).timestamp())} <= hot
+    # Редкое априорное окно уступает окну из истории
+    assert scheduler._bucket(at(17, 10).timestamp()) not in hot
+    assert scheduler.next_delay() == scheduler.dense_interval
+
+    clock.set(at(17, 10))
+    assert scheduler.next_delay() == scheduler.sparse_interval
+
+
+def test_jitter_bounds():
+    low, _ = make_scheduler(at(17, 10), rand=lambda: 0.0)
+    high, _ = make_scheduler(at(17, 10), rand=lambda: 1.0)
+    assert low.next_delay() == low.dense_interval * 0.9
+    assert high.next_delay() == high.dense_interval * 1.1
+
+
+def test_error_backoff_grows_and_resets():
+    scheduler, _ = make_scheduler(at(17, 10), error_backoff=60, max_backoff=200)
+    delays = []
+    for _ in range(4):
+        scheduler.record_error()
+        delays.append(scheduler.next_delay())
+    assert delays == [60, 120, 200, 200]
+
+    scheduler.record_success()
+    assert scheduler.next_delay() == scheduler.dense_interval
+
+
+def test_schedule_uses_clock():
+    scheduler, clock = make_scheduler(at(17, 10))
+    assert scheduler.schedule() == clock.now + scheduler.dense_interval
+    assert scheduler.next_run == clock.now + scheduler.dense_interval
+
+
+def test_poll_now_wakes_waiting_poller():
+    scheduler, _ = make_scheduler(at(12))
+    results = []
+    thread = threading.Thread(target=lambda: results.append(scheduler.wait()))
+    thread.start()
+    scheduler.poll_now()
+    thread.join(timeout=5)
+    assert results == [True]
+    # Запрос срабатывает один раз
+    assert not scheduler._wake.is_set()
+
+
+def test_first_poll_change_is_not_recorded():
+    scheduler, clock = make_scheduler(at(9))
+    scheduler.record_success()
+    scheduler.record_change()
+    assert list(scheduler.history) == []
+
+    scheduler.record_success()
+    scheduler.record_change()
+    assert list(scheduler.history) == [clock.now]
+
+
+def test_history_persists(tmp_path):
+    history_file = str(tmp_path / 'poll_history.json')
+    clock = FakeClock(at(8, 5))
+    scheduler = polled(PollScheduler(history_file=history_file, clock=clock, history_size=3))
+    for day in range(1, 6):
+        scheduler.record_change(at(8, 5, day=day).timestamp())
+
+    with open(history_file) as f:
+        assert len(json.load(f)) == 3
+    restored = PollScheduler(history_file=history_file, clock=clock).load()
+    assert list(restored.history) == list(scheduler.history)
+    assert restored.hot_buckets() == scheduler.hot_buckets()
+
+
+def test_broken_history_is_ignored(tmp_path):
+    history_file = tmp_path / 'poll_history.json'
+    history_file.write_text('{', encoding='utf-8')
+    scheduler = PollScheduler(history_file=str(history_file)).load()
+    assert list(scheduler.history) == []
@@ -0,0 +1,132 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+import telebot
+
+import parser
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.synthetic import render_html
+from subscriptions import GROUP
+from users_store import UserStore
+
+
+def page(subject):
+    return render_html({
+        'date': '2024-12-21',
+        'raw_date': 'Замены суббота 21.12.24',
+        'groups': {'142': [{'pair': '5', 'original_subject': 'Химия', 'teacher': 'Скарбинская Н.П.',
+                            'new_subject': subject, 'classroom': 'ДО'}],
+                   '251': [{'pair': '1', 'original_subject': 'Физика', 'teacher': 'Иванова А.Б.',
+                            'new_subject': 'Химия', 'classroom': '108'}]},
+    })
+
+
+class Recorder:
+    """Рассылка, которая только запоминает сообщения"""
+
+    def __init__(self):
+        self.messages = []
+        self.all = []
+
+    def run_messages(self, messages, **kwargs):
+        self.messages.append(messages)
+
+    def run(self, chat_ids, *args, **kwargs):
+        self.all.append(list(chat_ids))
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    """bot.py с двумя источниками на поддельном сервере, в своем каталоге"""
+    directory = tmp_path_factory.mktemp('sources')
+    api = FakeBotApi(pages={'/kit': page('Физика'), '/west': page('Информатика')}).start()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(directory)
+        monkeypatch.setattr(telebot.apihelper, 'API_URL', api.api_url)
+        for name in ('CLUSTER_BACKEND', 'SOURCES_FILE'):
+            monkeypatch.delenv(name, raising=False)
+        (directory / 'bot_token.txt').write_text('123456:test')
+        (directory / 'sources.json').write_text(json.dumps([
+            {'name': 'kit', 'title': 'КИТ', 'url': api.url + '/kit'},
+            {'name': 'west', 'title': 'Западный корпус', 'url': api.url + '/west'},
+        ], ensure_ascii=False), encoding='utf-8')
+
+        sys.modules.pop('bot', None)
+        bot = importlib.import_module('bot')
+        bot.user_store.open()
+        bot.subscriptions.load()
+        recorder = Recorder()
+        monkeypatch.setattr(bot, 'broadcaster', recorder)
+        for source in bot.sources:
+            bot.poll_replacements(source)
+        bot.api, bot.recorder = api, recorder
+        try:
+            yield bot
+        finally:
+            bot.user_store.close()
+            sys.modules.pop('bot', None)
+            api.stop()
+
+
+def choose_source(app, chat_id, position):
+    """Нажатие кнопки выбора источника, как в Telegram"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'user'}
+    app.bot.process_new_updates([telebot.types.Update.de_json({
+        'update_id': chat_id, 'callback_query': {
+            'id': str(chat_id), 'from': user, 'chat_instance': '1', 'data': f"so:{position}",
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': 'x'}}})])
+
+
+def test_sources_keep_separate_state(app):
+    kit, west = app.sources
+    assert kit.primary and not west.primary
+    assert (kit.store.filename, west.store.filename) == ('replacements.json', 'replacements_west.json')
+    assert (kit.archive.directory, west.archive.directory) == ('archive', 'archive_west')
+    assert (kit.scheduler.history_file, west.scheduler.history_file) == ('poll_history.json',
+                                                                        'poll_history_west.json')
+    assert parser.get_fetcher(kit.url) is not parser.get_fetcher(west.url)
+    assert kit.export_cache is not west.export_cache and kit.render_cache is not west.render_cache
+
+    assert kit.store.current().data['groups']['142'][0].new_subject == 'Физика'
+    assert west.store.current().data['groups']['142'][0].new_subject == 'Информатика'
+    assert west.store.current().source == 'west'
+    assert os.path.exists('archive/2024-12-21.json') and os.path.exists('archive_west/2024-12-21.json')
+    with open('replacements_west.json', encoding='utf-8') as f:
+        assert json.load(f)['groups']['142'][0]['new_subject'] == 'Информатика'
+
+
+def test_source_choice_persists(app):
+    choose_source(app, 501, 1)
+    assert app.user_store.source_of(501) == 'west'
+    assert app.read_replacements(501).source == 'west'
+    assert app.read_replacements(502).source == 'kit'
+
+    app.user_store.flush()
+    reopened = UserStore(app.user_store.filename, None).open()
+    try:
+        assert reopened.source_of(501) == 'west'
+    finally:
+        reopened.close()
+
+
+def test_subscribers_notified_only_for_their_source(app):
+    choose_source(app, 601, 1)
+    for chat_id in (601, 602):
+        app.subscriptions.toggle(chat_id, GROUP, '142')
+
+    app.recorder.messages.clear()
+    app.api.pages['/west'] = page('Базы данных')
+    app.poll_replacements(app.sources.get('west'))
+    (messages,) = app.recorder.messages
+    assert list(messages) == [601]
+    assert 'Базы данных' in messages[601]
+
+    app.recorder.messages.clear()
+    app.api.pages['/kit'] = page('Экономика')
+    app.poll_replacements(app.sources.primary)
+    (messages,) = app.recorder.messages
+    assert list(messages) == [602]
+    assert 'Экономика' in messages[602]
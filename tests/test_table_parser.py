@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+import parser
+from table_parser import parse_replacements_html
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+PAGES = ['replacements_basic', 'replacements_edge']
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, f"{name}.html"), encoding='utf-8') as f:
+        page = f.read()
+    with open(os.path.join(FIXTURES, f"{name}.json"), encoding='utf-8') as f:
+        expected = json.load(f)
+    return page, expected
+
+
+def plain(result):
+    """Результат разбора в формате replacements.json"""
+    groups = {number: [row.to_dict() for row in rows] for number, rows in result['groups'].items()}
+    return {**result, 'groups': groups}
+
+
+@pytest.mark.parametrize('name', PAGES)
+def test_html_parser_matches_expected(name):
+    page, expected = load(name)
+    assert plain(parse_replacements_html(page)) == expected
+
+
+def test_edge_cases():
+    page, _ = load('replacements_edge')
+    result = parse_replacements_html(page)
+    group = {row.pair: row for row in result['groups']['101']}
+
+    assert group['1'].cancelled and group['1'].new_subject == '' and group['1'].classroom == ''
+    assert group['2'].moved
+    # Пустая аудитория и строка без колонки аудитории
+    assert group['3'].classroom == '' and group['4'].classroom == ''
+    # <br> разделяет строки, &nbsp; и лишние пробелы схлопываются
+    assert group['4'].teacher == 'Смирнова О.В.\nКозлов Д.И.'
+    assert group['4'].new_subject == 'Английский язык'
+    assert result['groups']['103'][0].original_subject == 'Базы данных'
+    # Группа без замен, заголовки, подпись и скрипты в результат не попадают
+    assert set(result['groups']) == {'101', '103'}
+
+
+@pytest.fixture(scope='module')
+def chrome():
+    pytest.importorskip('selenium')
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    options = Options()
+    options.add_argument('--headless')
+    try:
+        webdriver.Chrome(options=options).quit()
+    except Exception as e:
+        pytest.skip(f"Chrome недоступен: {e}")
+
+
+@pytest.mark.parametrize('name', PAGES)
+def test_selenium_parser_matches_html_parser(chrome, name):
+    page, expected = load(name)
+    assert plain(parser.get_replacements_selenium(page)) == expected
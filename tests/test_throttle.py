@@ -0,0 +1,145 @@
+import threading
+
+from throttle import ChatRateLimiter, Debouncer, SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1024.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def test_debouncer_drops_repeats_inside_window():
+    clock = FakeClock()
+    debouncer = Debouncer(window=2.0, clock=clock)
+    assert not debouncer.repeated((1, 'g:3'))
+    clock.advance(1.5)
+    assert debouncer.repeated((1, 'g:3'))
+    assert not debouncer.repeated((2, 'g:3'))
+    assert not debouncer.repeated((1, 'g:4'))
+
+    # Окно считается от последнего нажатия
+    clock.advance(1.5)
+    assert debouncer.repeated((1, 'g:3'))
+    clock.advance(2.0)
+    assert not debouncer.repeated((1, 'g:3'))
+
+
+def test_debouncer_forgets_old_and_extra_keys():
+    clock = FakeClock()
+    debouncer = Debouncer(window=1.0, max_keys=3, clock=clock)
+    for key in range(3):
+        debouncer.repeated(key)
+    clock.advance(2.0)
+    debouncer.repeated('new')
+    assert list(debouncer._seen) == ['new']
+
+    for key in range(5):
+        debouncer.repeated(key)
+    assert len(debouncer._seen) <= 3
+    # Самый старый ключ вытеснен, повтор не распознается
+    assert not debouncer.repeated('new')
+
+
+def test_zero_window_never_drops():
+    debouncer = Debouncer(window=0, clock=FakeClock())
+    assert not debouncer.repeated('a')
+    assert not debouncer.repeated('a')
+
+
+def test_rate_limiter_burst_then_rate():
+    clock = FakeClock()
+    limiter = ChatRateLimiter(rate=1.0, burst=5, clock=clock)
+    assert [limiter.allow(1) for _ in range(6)] == [True] * 5 + [False]
+    # Другой чат со своим ведром
+    assert limiter.allow(2)
+
+    clock.advance(0.5)
+    assert not limiter.allow(1)
+    clock.advance(0.5)
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
+
+    # За долгую паузу токены копятся только до burst
+    clock.advance(60)
+    assert [limiter.allow(1) for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_rate_limiter_forgets_least_recent_chat():
+    clock = FakeClock()
+    limiter = ChatRateLimiter(rate=1.0, burst=1, max_chats=2, clock=clock)
+    assert limiter.allow(1)
+    assert limiter.allow(2)
+    assert limiter.allow(3)
+    assert list(limiter._buckets) == [2, 3]
+    # Забытый чат начинает с полного ведра
+    assert limiter.allow(1)
+    assert not limiter.allow(3)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    computed = []
+
+    def compute():
+        computed.append(1)
+        started.set()
+        release.wait(5)
+        return 'ответ'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flights.stats['coalesced'] < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['ответ'] * 5
+    assert computed == [1]
+    assert flights.stats == {'calls': 1, 'coalesced': 4}
+    # После завершения ключ вычисляется заново
+    assert flights.do('key', lambda: 'новый') == 'новый'
+
+
+def test_single_flight_shares_errors():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('сбой')
+
+    errors = []
+
+    def call():
+        try:
+            flights.do('key', fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flights.stats['coalesced'] < 1:
+        threading.Event().wait(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ['сбой', 'сбой']
+    # Ошибка не запоминается: следующий вызов считает заново
+    assert flights.do('key', lambda: 'снова') == 'снова'
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+
+import pytest
+
+from users_store import UserStore
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'bot.db'), str(tmp_path / 'users.json')
+
+
+def open_store(paths, **kwargs):
+    db_file, legacy_file = paths
+    # Долгий интервал: фоновая запись не мешает проверять явный flush и close
+    kwargs.setdefault('flush_interval', 3600)
+    return UserStore(db_file, legacy_file, **kwargs).open()
+
+
+def saved_users(paths):
+    conn = sqlite3.connect(paths[0])
+    try:
+        return {row[0] for row in conn.execute("SELECT chat_id FROM users")}
+    finally:
+        conn.close()
+
+
+def test_legacy_users_migrated_once(paths, tmp_path):
+    with open(paths[1], 'w') as f:
+        json.dump([1, "2", 3], f)
+
+    store = open_store(paths)
+    assert sorted(store.all()) == [1, 2, 3]
+    assert (tmp_path / 'users.json.migrated').exists()
+    assert not (tmp_path / 'users.json').exists()
+    store.remove_many([2])
+    store.close()
+
+    # Второй запуск не переносит файл заново и не возвращает удаленных
+    store = open_store(paths)
+    assert sorted(store.all()) == [1, 3]
+    store.close()
+
+
+def test_broken_legacy_file_is_kept(paths, tmp_path):
+    with open(paths[1], 'w') as f:
+        f.write('[1, 2')
+    store = open_store(paths)
+    assert len(store) == 0
+    assert (tmp_path / 'users.json').exists()
+    store.close()
+
+
+def test_changes_are_written_on_close(paths):
+    store = open_store(paths)
+    assert store.add(10)
+    assert not store.add(10)
+    store.add(11)
+    store.remove_many([11])
+    assert saved_users(paths) == set()
+
+    store.close()
+    assert saved_users(paths) == {10}
+    store = open_store(paths)
+    assert sorted(store.all()) == [10]
+    store.close()
+
+
+def test_batch_is_flushed_without_waiting(paths):
+    store = open_store(paths, flush_batch=3)
+    for chat_id in range(3):
+        store.add(chat_id)
+    assert saved_users(paths) == {0, 1, 2}
+    store.close()
+
+
+def test_background_flush(paths):
+    store = open_store(paths, flush_interval=0.01)
+    store.add(5)
+    store._stop.wait(0.5)
+    assert saved_users(paths) == {5}
+    store.close()
+
+
+def test_subscriptions(paths):
+    store = open_store(paths)
+    assert store.toggle_subscription(1, 'group', '142')
+    store.add_subscription(1, 'teacher', 'Скарбинская Н.П.')
+    store.add_subscription(1, 'teacher', 'Скарбинская Н.П.')
+    store.add_subscription(2, 'group', '142')
+    assert sorted(store.subscriptions_of(1)) == [('group', '142'), ('teacher', 'Скарбинская Н.П.')]
+
+    assert not store.toggle_subscription(1, 'group', '142')
+    store.remove_subscription(1, 'teacher', 'Скарбинская Н.П.')
+    assert store.subscriptions_of(1) == []
+
+    store.add_subscription(3, 'group', '251')
+    store.remove_subscriptions_of([3])
+    store.close()
+
+    store = open_store(paths)
+    assert store.load_subscriptions() == [(2, 'group', '142')]
+    store.close()
+
+
+def test_user_sources_and_instance_id(paths):
+    store = open_store(paths)
+    instance_id = store.instance_id()
+    assert store.source_of(1) is None
+    store.set_source(1, 'west')
+    store.set_source(1, 'kit')
+    store.set_source(2, 'west')
+    store.close()
+
+    store = open_store(paths)
+    assert store.user_sources() == {1: 'kit', 2: 'west'}
+    assert store.source_of(2) == 'west'
+    assert store.instance_id() == instance_id
+    store.close()
@@ -0,0 +1,108 @@
+"""Защита от всплесков нажатий после рассылки.
+
+Debouncer отбрасывает повторное нажатие той же кнопки тем же пользователем,
+ChatRateLimiter ограничивает частоту запросов от одного чата, SingleFlight
+склеивает одинаковые вычисления, которые идут одновременно: второй
+запрос ждет результат первого вместо того, чтобы считать заново.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class Debouncer:
+    """Повторы одного и того же ключа в пределах окна"""
+
+    def __init__(self, window=1.0, max_keys=50000, clock=time.monotonic):
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def repeated(self, key):
+        """True, если ключ уже встречался меньше window секунд назад"""
+        with self._lock:
+            now = self.clock()
+            # Ключи упорядочены по времени, устаревшие лежат в начале
+            while self._seen:
+                oldest, seen = next(iter(self._seen.items()))
+                if now - seen < self.window and len(self._seen) < self.max_keys:
+                    break
+                del self._seen[oldest]
+
+            repeated = key in self._seen
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            return repeated
+
+
+class ChatRateLimiter:
+    """Ведро токенов на каждый чат, без ожидания"""
+
+    def __init__(self, rate=1.0, burst=5, max_chats=50000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_chats = max_chats
+        self.clock = clock
+        self._buckets = OrderedDict()  # чат -> (токены, время)
+        self._lock = threading.Lock()
+
+    def allow(self, chat_id):
+        """Забирает токен чата; False, если чат превысил лимит"""
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self._buckets.pop(chat_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[chat_id] = (tokens, now)
+            if len(self._buckets) > self.max_chats:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Одно вычисление на ключ, остальные вызовы ждут его результат"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['calls'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
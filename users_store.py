@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# База с пользователями и подписками
+DB_FILE = 'bot.db'
+
+# Старый файл со списком пользователей, переносится в базу один раз
+USERS_FILE = 'users.json'
+
+
+class UserStore:
+    """Список пользователей в SQLite (WAL) с индексом в памяти.
+
+    Проверка "пользователь уже есть" идет по множеству в памяти, новые и
+    удаленные чаты копятся и записываются в базу пачками из фонового потока.
+    """
+
+    def __init__(self, filename=DB_FILE, legacy_file=USERS_FILE,
+                 flush_interval=1.0, flush_batch=500):
+        self.filename = filename
+        self.legacy_file = legacy_file
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._users = set()
+        self._sources = {}
+        self._pending_add = set()
+        self._pending_remove = set()
+        self._conn = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def open(self):
+        """Открывает базу, загружает индекс и переносит users.json"""
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS users (chat_id INTEGER PRIMARY KEY)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            " chat_id INTEGER NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL,"
+            " PRIMARY KEY (chat_id, kind, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_sources (chat_id INTEGER PRIMARY KEY, source TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        self._users = {row[0] for row in self._conn.execute("SELECT chat_id FROM users")}
+        self._sources = dict(self._conn.execute("SELECT chat_id, source FROM user_sources"))
+        self._migrate()
+        logger.info(f"Загружено пользователей: {len(self._users)}")
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        return self
+
+    def _migrate(self):
+        """Одноразовый перенос пользователей из users.json"""
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        try:
+            with open(self.legacy_file, 'r') as f:
+                legacy = {int(chat_id) for chat_id in json.load(f)}
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке пользователей: {e}")
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO users (chat_id) VALUES (?)",
+                ((chat_id,) for chat_id in legacy)
+            )
+            self._conn.commit()
+            self._users |= legacy
+        os.replace(self.legacy_file, f"{self.legacy_file}.migrated")
+        logger.info(f"Перенесено пользователей из {self.legacy_file}: {len(legacy)}")
+
+    def __contains__(self, chat_id):
+        return chat_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def all(self):
+        """Снимок списка пользователей для рассылки"""
+        with self._lock:
+            return list(self._users)
+
+    def add(self, chat_id):
+        """Добавляет пользователя; возвращает True, если он новый"""
+        if chat_id in self._users:
+            return False
+        with self._lock:
+            if chat_id in self._users:
+                return False
+            self._users.add(chat_id)
+            self._pending_remove.discard(chat_id)
+            self._pending_add.add(chat_id)
+            if len(self._pending_add) >= self.flush_batch:
+                self.flush()
+        return True
+
+    def remove_many(self, chat_ids):
+        """Удаляет пользователей из рассылки"""
+        with self._lock:
+            for chat_id in chat_ids:
+                self._users.discard(chat_id)
+                self._pending_add.discard(chat_id)
+                self._pending_remove.add(chat_id)
+            if len(self._pending_remove) >= self.flush_batch:
+                self.flush()
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        with self._lock:
+            if not self._pending_add and not self._pending_remove:
+                return
+            added, removed = self._pending_add, self._pending_remove
+            self._pending_add, self._pending_remove = set(), set()
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO users (chat_id) VALUES (?)",
+                        ((chat_id,) for chat_id in added)
+                    )
+                    self._conn.executemany(
+                        "DELETE FROM users WHERE chat_id = ?",
+                        ((chat_id,) for chat_id in removed)
+                    )
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении пользователей: {e}")
+                # Вернем изменения в очередь, чтобы записать их в следующий раз
+                self._pending_add |= added
+                self._pending_remove |= removed
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Останавливает фоновую запись и закрывает базу"""
+        self._stop.set()
+        # Фоновый поток не должен писать в уже закрытую базу
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def instance_id(self):
+        """Постоянный идентификатор этой базы, создается при первом обращении"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance_id', ?)",
+                               (uuid.uuid4().hex,))
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'instance_id'").fetchone()[0]
+
+    # Выбранный источник замен; пользователи без выбора видят основной
+
+    def source_of(self, chat_id):
+        return self._sources.get(chat_id)
+
+    def set_source(self, chat_id, source):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_sources (chat_id, source) VALUES (?, ?)",
+                (chat_id, source)
+            )
+            self._sources[chat_id] = source
+
+    def user_sources(self):
+        with self._lock:
+            return dict(self._sources)
+
+    # Подписки хранятся в той же базе, их меняют редко и пишут сразу
+
+    def load_subscriptions(self):
+        with self._lock:
+            return self._conn.execute("SELECT chat_id, kind, key FROM subscriptions").fetchall()
+
+    def add_subscription(self, chat_id, kind, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (chat_id, kind, key) VALUES (?, ?, ?)",
+                (chat_id, kind, key)
+            )
+
+    def remove_subscription(self, chat_id, kind, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM subscriptions WHERE chat_id = ? AND kind = ? AND key = ?",
+                (chat_id, kind, key)
+            )
+
+    def subscriptions_of(self, chat_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT kind, key FROM subscriptions WHERE chat_id = ?", (chat_id,)
+            ).fetchall()
+
+    def toggle_subscription(self, chat_id, kind, key):
+        """Включает или выключает подписку; True, если она включена"""
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM subscriptions WHERE chat_id = ? AND kind = ? AND key = ?",
+                (chat_id, kind, key)
+            ).rowcount
+            if not removed:
+                self._conn.execute(
+                    "INSERT INTO subscriptions (chat_id, kind, key) VALUES (?, ?, ?)",
+                    (chat_id, kind, key)
+                )
+        return not removed
+
+    def remove_subscriptions_of(self, chat_ids):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM subscriptions WHERE chat_id = ?",
+                ((chat_id,) for chat_id in chat_ids)
+            )